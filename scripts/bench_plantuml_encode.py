@@ -0,0 +1,87 @@
+"""
+PlantUML编码性能测试
+
+对比逐字符 if/elif 映射的旧编码方式与查表编码（bytes.translate）在大型类图上的吞吐量
+
+用法: python scripts/bench_plantuml_encode.py [--classes 50 200 1000] [--repeat 20]
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "utils"))
+
+from uml_mcp_server import plantuml_decode, plantuml_encode
+
+_BASE64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_PLANTUML = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+
+
+def legacy_encode(text):
+    """旧的编码方式：逐字符查找映射并拼接字符串（与原 if/elif 链的行为一致）"""
+    compressed = zlib.compress(text.encode('utf-8'))
+    standard_b64 = base64.b64encode(compressed).decode('ascii')
+    result = ""
+    for c in standard_b64:
+        if c == '=':
+            continue
+        for source, target in zip(_BASE64, _PLANTUML):
+            if c == source:
+                result += target
+                break
+        else:
+            result += c
+    return result
+
+
+def make_class_diagram(num_classes):
+    """生成包含 num_classes 个类及其关联关系的类图"""
+    lines = ["@startuml"]
+    for i in range(num_classes):
+        lines.append(f"class Class{i} {{")
+        for j in range(6):
+            lines.append(f"  -String field{j}_{i * 7919 % 1000}")
+        for j in range(4):
+            lines.append(f"  +method{j}(arg{j}: int): String")
+        lines.append("}")
+    for i in range(1, num_classes):
+        lines.append(f'Class{i} "1" -- "many" Class{(i * 31) % i}: rel{i}')
+    lines.append("@enduml")
+    return "\n".join(lines)
+
+
+def bench(func, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PlantUML编码性能测试")
+    parser.add_argument("--classes", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'类数量':>8} {'源码KB':>8} {'编码KB':>8} {'旧方式 ms':>10} {'查表 ms':>10} {'查表 MB/s':>10} {'加速比':>8}")
+    for num_classes in args.classes:
+        text = make_class_diagram(num_classes)
+        encoded = plantuml_encode(text)
+        assert encoded == legacy_encode(text), "查表编码结果与旧方式不一致"
+        assert plantuml_decode(encoded) == text, "解码结果与原文不一致"
+
+        legacy = bench(legacy_encode, text, args.repeat)
+        table = bench(plantuml_encode, text, args.repeat)
+        size = len(text.encode('utf-8'))
+        print(
+            f"{num_classes:>8} {size / 1024:>8.1f} {len(encoded) / 1024:>8.1f} "
+            f"{legacy * 1000:>10.2f} {table * 1000:>10.2f} "
+            f"{size / table / 1024 / 1024:>10.1f} {legacy / table:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+UML渲染方式性能对比
+
+分别通过PlantUML服务（HTTP）和本地常驻PlantUML进程渲染同一批各不相同的类图（绕过图片缓存），
+统计单张图的延迟和并发渲染的吞吐量
+
+用法: python scripts/bench_uml_backends.py [--diagrams 30] [--concurrency 4] [--backends server local]
+需要先启动PlantUML服务（server），或配置 PLANTUML_JAR（local）
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "utils"))
+
+from uml_mcp_server import local_renderer, plantuml_encode, render_via_server
+
+
+def make_diagram(index, num_classes=8):
+    """生成第 index 张类图，每张内容不同"""
+    lines = ["@startuml"]
+    for i in range(num_classes):
+        lines.append(f"class C{index}_{i} {{\n  -int field{i}\n  +method{i}(): void\n}}")
+    for i in range(1, num_classes):
+        lines.append(f"C{index}_{i - 1} --> C{index}_{i}")
+    lines.append("@enduml")
+    return "\n".join(lines)
+
+
+async def render(backend, code):
+    if backend == "local":
+        return await local_renderer.render(code, "png")
+    return await render_via_server(plantuml_encode(code), "png")
+
+
+async def bench_backend(backend, diagrams, concurrency):
+    # 第一张图包含建立连接/启动JVM的时间，单独统计
+    start = time.perf_counter()
+    await render(backend, make_diagram(-1))
+    cold = time.perf_counter() - start
+
+    latencies = []
+    for index in range(diagrams):
+        start = time.perf_counter()
+        await render(backend, make_diagram(index))
+        latencies.append(time.perf_counter() - start)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(index):
+        async with semaphore:
+            await render(backend, make_diagram(diagrams + index))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited(index) for index in range(diagrams)))
+    throughput = diagrams / (time.perf_counter() - start)
+
+    latencies.sort()
+    return {
+        "cold": cold,
+        "mean": statistics.mean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "throughput": throughput,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="UML渲染方式性能对比")
+    parser.add_argument("--diagrams", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--backends", nargs="+", default=["server", "local"], choices=["server", "local"])
+    args = parser.parse_args()
+
+    print(f"{'渲染方式':>8} {'首张 ms':>10} {'平均 ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'并发 张/秒':>12}")
+    for backend in args.backends:
+        try:
+            result = await bench_backend(backend, args.diagrams, args.concurrency)
+        except Exception as e:
+            print(f"{backend:>8} 不可用: {e}")
+            continue
+        print(
+            f"{backend:>8} {result['cold'] * 1000:>10.1f} {result['mean'] * 1000:>10.1f} "
+            f"{result['p50'] * 1000:>10.1f} {result['p95'] * 1000:>10.1f} {result['throughput']:>12.1f}"
+        )
+    await local_renderer.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+'''
+Agent运行时服务
+
+把所有Agent（以及它们启动的MCP子进程）放在一个独立进程中运行，
+通过本地HTTP接口对外提供调用。多个无状态的API worker可以共享同一组运行时，
+API侧按会话粘滞路由（见 utils/runtime_client.py）。
+
+启动方式：
+    uv run src/agent_runtime.py --port 9001            # 单个运行时
+    uv run src/agent_runtime.py --port 9001 --pool 2   # 端口9001、9002上的两个运行时
+'''
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Dict
+
+import uvicorn
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from agents.agent import Agent
+from agents.umlAgent import UML_Agent
+from agents.explainAgent import ExplainAgent
+from agents.questionAgent import questionAgent
+from agents.paperAgent import PaperAgent
+from agents.testAgent import TestAgent
+from agents.reviewplanAgent import ReviewPlanAgent
+from utils.conversation_logger import ConversationLogger
+from utils.logger import MyLogger, logging
+from utils.runtime_client import encode_value, decode_value
+from utils.disconnect import CancelOnDisconnectMiddleware
+from utils.response_cache import response_cache
+from utils.tool_result_cache import tool_result_cache
+from utils.mcp_supervisor import mcp_supervisor
+from utils.tool_latency import tool_latency
+from utils.tool_output import tool_output_processor
+from utils.tool_selector import tool_selector
+from utils.structured_output import structured_output_stats
+from models.practice_history import PracticeHistory
+from models.review_plan import ReviewPlanManager
+
+load_dotenv()
+
+logger = MyLogger(name="AgentRuntime", level=logging.INFO, colored=True)
+
+api_key = os.getenv("DASHSCOPE_API_KEY")
+base_url = os.getenv("DASHSCOPE_BASE_URL")
+model = 'qwen-plus'
+
+DEFAULT_RUNTIME_PORT = int(os.getenv("AGENT_RUNTIME_PORT", "9001"))
+
+
+# 注册名 -> Agent类
+AGENT_CLASSES = {
+    "agent": Agent,
+    "uml": UML_Agent,
+    "explain": ExplainAgent,
+    "question": questionAgent,
+    "paper": PaperAgent,
+    "test": TestAgent,
+    "review_plan": ReviewPlanAgent,
+}
+
+
+def build_agent_handles() -> Dict[str, Agent]:
+    """
+    创建不初始化的Agent实例
+
+    远程模式下API进程只转发调用，只需要Agent的方法引用来定位运行时中的Agent，
+    不创建LLM客户端、MCP客户端和检索器
+    """
+    return {name: cls.__new__(cls) for name, cls in AGENT_CLASSES.items()}
+
+
+def build_agents(conversation_logger, practice_history, review_plan_manager) -> Dict[str, Agent]:
+    """
+    创建所有Agent实例
+
+    API进程（本地模式）和运行时进程共用这份注册表，注册名也是远程调用时的Agent标识
+
+    Returns:
+        Dict[str, Agent]: 注册名到Agent实例的映射
+    """
+    return {
+        "agent": Agent(api_key, base_url, model),
+        "uml": UML_Agent(api_key, base_url, model),
+        "explain": ExplainAgent(api_key, base_url, model),
+        "question": questionAgent(api_key, base_url, model),
+        "paper": PaperAgent(),
+        "test": TestAgent(api_key, base_url, model),
+        "review_plan": ReviewPlanAgent(conversation_logger, practice_history, review_plan_manager),
+    }
+
+
+def create_runtime_app(project_path: str) -> FastAPI:
+    """
+    创建运行时服务
+
+    Agent直接运行在该服务的事件循环上，不再需要额外的后台线程
+    """
+    conversation_logger = ConversationLogger(project_path)
+    practice_history = PracticeHistory(project_path)
+    review_plan_manager = ReviewPlanManager(project_path)
+    registry = build_agents(conversation_logger, practice_history, review_plan_manager)
+
+    runtime_app = FastAPI()
+    # API worker放弃请求时（超时或客户端断开）会关闭连接，此时取消对应的Agent调用
+    runtime_app.add_middleware(CancelOnDisconnectMiddleware)
+    state = {"ready": False, "started_at": time.time(), "in_flight": 0}
+
+    @runtime_app.on_event("startup")
+    async def startup():
+        for name, agt in registry.items():
+            await agt.setup()
+        state["ready"] = True
+        logger.success(f"Agent运行时初始化完成 (pid={os.getpid()})")
+
+    @runtime_app.get("/health")
+    async def health():
+        return {
+            "status": "success" if state["ready"] else "starting",
+            "pid": os.getpid(),
+            "uptime": round(time.time() - state["started_at"], 1),
+            "in_flight": state["in_flight"],
+            "agents": list(registry.keys()),
+            "response_cache": response_cache.stats(),
+            "tool_cache": tool_result_cache.stats(),
+            "mcp": mcp_supervisor.stats(),
+            "tool_latency": tool_latency.stats(),
+            "tool_output": tool_output_processor.stats(),
+            "tool_selector": tool_selector.stats(),
+            "structured_output": structured_output_stats(),
+        }
+
+    @runtime_app.post("/invoke")
+    async def invoke(request: Request):
+        payload = await request.json()
+        agent_name, method = payload.get("agent"), payload.get("method") or ""
+
+        if not state["ready"]:
+            return JSONResponse({"error": "Agent运行时尚未准备好", "type": "NotReady"}, status_code=503)
+
+        agt = registry.get(agent_name)
+        func = getattr(agt, method, None) if agt is not None and not method.startswith("_") else None
+        if func is None or not asyncio.iscoroutinefunction(func):
+            return JSONResponse({"error": f"未知的调用: {agent_name}.{method}", "type": "NotFound"}, status_code=404)
+
+        args = decode_value(payload.get("args", []))
+        kwargs = decode_value(payload.get("kwargs", {}))
+        timeout = payload.get("timeout", 300)
+
+        state["in_flight"] += 1
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout=timeout)
+            return {"result": encode_value(result)}
+        except asyncio.TimeoutError:
+            return JSONResponse({"error": "请求超时", "type": "TimeoutError"}, status_code=504)
+        except Exception as e:
+            logger.error(f"执行 {agent_name}.{method} 时出错: {e}")
+            return JSONResponse({"error": str(e), "type": type(e).__name__}, status_code=500)
+        finally:
+            state["in_flight"] -= 1
+
+    return runtime_app
+
+
+def run_pool(host: str, port: int, pool: int):
+    """启动固定数量的运行时进程，端口依次递增"""
+    processes = []
+    for i in range(pool):
+        processes.append(subprocess.Popen([
+            sys.executable, os.path.abspath(__file__),
+            "--host", host, "--port", str(port + i),
+        ]))
+        logger.info(f"已启动运行时进程: {host}:{port + i}")
+
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agent运行时服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_RUNTIME_PORT)
+    parser.add_argument("--pool", type=int, default=1, help="运行时进程数量")
+    cli_args = parser.parse_args()
+
+    if cli_args.pool > 1:
+        run_pool(cli_args.host, cli_args.port, cli_args.pool)
+    else:
+        project_path = os.getenv("PROJECT_PATH", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        uvicorn.run(create_runtime_app(project_path), host=cli_args.host, port=cli_args.port, reload=False)
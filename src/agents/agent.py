@@ -8,16 +8,22 @@ from llmClient import LLMClient
 from mcpClient import MCPClient
 from utils.load_json import load_mcp_config
 from utils.logger import MyLogger, logging, Colors
+from utils.mcp_supervisor import mcp_supervisor
+from utils.response_cache import response_cache
+from utils.tool_output import tool_output_processor, READ_TOOL_OUTPUT
+from utils.tool_selector import tool_selector
 from collections import defaultdict
 from dotenv import load_dotenv
 import asyncio
 from asyncio import CancelledError
 import json
 from retrieve import Retriever
-from typing import List
+from typing import Any, Callable, List, Optional
 load_dotenv()
 
 PROJECT_PATH = os.getenv('PROJECT_PATH')
+# 等待MCP服务器连接的最长时间（秒）
+MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "60"))
 
 # 创建彩色日志记录器
 logger = MyLogger(name="Agent", level=logging.INFO, colored=True)
@@ -33,6 +39,11 @@ all_servers = [
 
 class Agent():
     '''agent = llm+tool'''
+
+    # 工具白名单（工具名或服务器名），None 表示不限制；每次请求再从中按相似度挑选
+    tool_allowlist: Optional[List[str]] = None
+    # 提示词中要求使用的工具，总是发送，不参与相似度筛选
+    tool_always_include: List[str] = []
     
     @staticmethod
     def get_base_system_prompt() -> str:
@@ -55,10 +66,12 @@ class Agent():
         self.mcp_clients = defaultdict(MCPClient)
         
         self.tools = []
+        self._tool_servers = set()
+        self._tool_server_of = {}
         for server_name, config in mcp_servers.items():
             if server_name in self.mcp_servers:
-                command, args = config['command'], config['args']
-                self.mcp_clients[server_name] = MCPClient(command, args)
+                command, args = config.get('command'), config.get('args', [])
+                self.mcp_clients[server_name] = MCPClient(command, args, module=config.get('module'), name=server_name)
 
         self.retriever = Retriever(similarity_threshold=0.5)
         self.label = None
@@ -69,6 +82,26 @@ class Agent():
     async def getMessages(self):
         return await self.llmClient.getMessages()
 
+    async def embed_text(self, text: str) -> List[float]:
+        '''
+        使用知识库的嵌入模型计算文本向量（在线程中执行，不阻塞事件循环）
+
+        args:
+            text: 文本
+        '''
+        embedding_model = self.retriever.vector_store.embedding_model
+        return await asyncio.to_thread(embedding_model.get_query_embedding, text)
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        '''
+        批量计算文本向量（在线程中执行，不阻塞事件循环）
+
+        args:
+            texts: 文本列表
+        '''
+        embedding_model = self.retriever.vector_store.embedding_model
+        return await asyncio.to_thread(embedding_model.get_text_embedding_batch, texts)
+
     async def update_label(self, label: str):
         '''
         更新索引标签
@@ -94,26 +127,42 @@ class Agent():
         
         logger.info(f"上下文已保存到: {logger.color_text(log_messages_file, 'CYAN')}")
             
+    def _refresh_tools(self):
+        """根据已经连接过的MCP服务器重建工具列表"""
+        self.tools = []
+        self._tool_servers = set()
+        self._tool_server_of = {}
+        for name, client in self.mcp_clients.items():
+            tools = client.getTool()
+            if tools:
+                self._tool_servers.add(name)
+            self._tool_server_of.update({tool.name: name for tool in tools})
+            self.tools.extend([
+                {
+                    "type": "function",
+                    "function":{
+                    "name" : tool.name,
+                    "description": tool.description,
+                    "input_schema": tool.inputSchema
+                    } 
+                }
+            
+            for tool in tools])
+        if self.tools and tool_output_processor.enabled:
+            self.tools.append(tool_output_processor.tool_schema())
+
     async def setup(self):
         # 启动所有服务，并记录所有工具
         try:
-            for name in self.mcp_clients:
-                mcp_client = self.mcp_clients[name]
-                await mcp_client.connect_to_server()
+            # 每个客户端由监控任务负责连接、保活和重启，各服务器并行连接
+            agent_type = self.__class__.__name__
+            for name, mcp_client in self.mcp_clients.items():
+                mcp_supervisor.start(mcp_client, f"{name}@{agent_type}")
+            for name, mcp_client in self.mcp_clients.items():
+                if not await mcp_supervisor.wait_ready(mcp_client, MCP_CONNECT_TIMEOUT):
+                    logger.warning(f"MCP服务器 {logger.color_text(name, 'CYAN')} 尚未连接，将在后台继续重试")
             
-            for name, client in self.mcp_clients.items():
-                tools = client.getTool()
-                self.tools.extend([
-                    {
-                        "type": "function",
-                        "function":{
-                        "name" : tool.name,
-                        "description": tool.description,
-                        "input_schema": tool.inputSchema
-                        } 
-                    }
-                
-                for tool in tools])
+            self._refresh_tools()
             
             # 添加初始化完成的日志，显示 Agent 类型
             agent_type = self.__class__.__name__
@@ -126,8 +175,53 @@ class Agent():
             error_msg = logger.color_text(str(e), "RED")
             logger.error(f"{agent_type} 初始化失败: {error_msg}")
     
-    async def chat(self, query: str) -> str:
+    async def _notify_tool_result(self, callback: Optional[Callable], name: str, tool_res: Any):
+        """把工具调用结果交给调用方（回调出错不影响对话）"""
+        if callback is None:
+            return
         try:
+            result = callback(name, tool_res)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            logger.warning(f"处理工具 {name} 的调用结果时出错: {e}")
+
+    async def _summarize_tool_output(self, text: str) -> str:
+        """对过长的工具输出做一次摘要"""
+        return await self.llmClient.complete(
+            f"请概括以下工具输出的要点，保留关键事实、数据和出处，不要添加原文没有的信息：\n{text}",
+            system_prompt="你是一个信息摘要助手，只输出摘要本身",
+        )
+
+    async def _tool_result_content(self, name: str, tool_res: Any, query: str):
+        """写入上下文的工具结果：过长的文本输出截取与问题相关的部分，其余原样返回"""
+        content = tool_res.content
+        texts = [item.text for item in content if getattr(item, "type", None) == "text"]
+        text = "\n".join(texts)
+        if len(text) <= tool_output_processor.limit_for(name):
+            return content
+        return await tool_output_processor.process(
+            name,
+            text,
+            query,
+            embed_query=self.embed_text,
+            embed_documents=self.embed_texts,
+            summarize=self._summarize_tool_output,
+        )
+
+    async def chat(self, query: str, tool_result_callback: Optional[Callable[[str, Any], Any]] = None) -> str:
+        """
+        对话，按需调用工具
+
+        Args:
+            query: 用户的问题
+            tool_result_callback: 每次工具调用成功后以 (工具名, 调用结果) 调用，可以是异步函数
+        """
+        try:
+            # 初始化时未连上的服务器之后连上了，补充它们的工具
+            if any(client.getTool() for name, client in self.mcp_clients.items() if name not in self._tool_servers):
+                self._refresh_tools()
+
             logger.info(f"检索标签: {logger.color_text(self.label or '无', 'CYAN')}")
             chunk_text = self.retriever.retrieve(query, self.label)
             
@@ -136,9 +230,22 @@ class Agent():
             else:
                 logger.warning("未获取到检索结果")
 
+            # 只发送与本次请求相关的工具，整个工具调用循环使用同一组工具
+            agent_type = self.__class__.__name__
+            tools = await tool_selector.select(
+                self.tools,
+                query,
+                allowlist=tool_selector.allowlist_for(agent_type, self.tool_allowlist),
+                always_include=self.tool_always_include,
+                tool_servers=self._tool_server_of,
+                embed_query=self.embed_text,
+                embed_documents=self.embed_texts,
+            )
+            turns = 1
+
             prompt = f"根据以下检索结果，回答用户的问题：\n{chunk_text}\n用户的问题是：{query}"
-            if len(self.tools) > 0:
-                res = await self.llmClient.chat(message=prompt, tools=self.tools)
+            if len(tools) > 0:
+                res = await self.llmClient.chat(message=prompt, tools=tools)
             else:
                 res = await self.llmClient.chat(message=prompt)
             
@@ -156,6 +263,14 @@ class Agent():
                     name, args = func.name, func.arguments
                     
                     args = json.loads(args)
+                    if name == READ_TOOL_OUTPUT:
+                        await self.llmClient.add_tool_call(
+                            role="tool", 
+                            content=tool_output_processor.read(args.get("output_id", ""), args.get("offset", 0), args.get("length")), 
+                            tool_call_id=tool_call.id
+                        )
+                        continue
+
                     target_client = None
                     for mcp_name, mcp_client in self.mcp_clients.items():
                         if mcp_client.have_tool(name):
@@ -164,37 +279,40 @@ class Agent():
                     
                     if target_client:
                         try:
-                            # 检查客户端连接状态，如果需要则重新连接
+                            # 检查客户端连接状态，断开时等待监控任务完成重连
                             if not target_client._connected or target_client.session is None:
-                                logger.info(f"重新连接客户端: {logger.color_text(name, 'CYAN')}")
-                                await target_client.connect_to_server()
+                                logger.info(f"等待客户端重新连接: {logger.color_text(name, 'CYAN')}")
+                                await mcp_supervisor.restart(target_client, MCP_CONNECT_TIMEOUT)
                                 
                             # 调用工具
                             tool_res = await target_client.call_tool(name, args)  
                             logger.success(f"工具 {logger.color_text(name, 'CYAN')} 调用成功")
+                            await self._notify_tool_result(tool_result_callback, name, tool_res)
 
                             await self.llmClient.add_tool_call(
                                 role="tool", 
-                                content=tool_res.content, 
+                                content=await self._tool_result_content(name, tool_res, query), 
                                 tool_call_id=tool_call.id
                             )
                         except Exception as e:
                             error_msg = logger.color_text(str(e), "RED")
                             logger.error(f"工具 {logger.color_text(name, 'CYAN')} 调用出错: {error_msg}")
                             
-                            # 如果是事件循环关闭错误，尝试重新连接所有客户端
+                            # 如果是事件循环关闭错误，重启出错的客户端
                             if "Event loop is closed" in str(e):
-                                logger.warning("检测到事件循环关闭错误，尝试重新连接所有客户端")
+                                logger.warning("检测到事件循环关闭错误，尝试重新连接客户端")
                                 try:
-                                    await self.reconnect_all_clients()
+                                    if not await mcp_supervisor.restart(target_client, MCP_CONNECT_TIMEOUT):
+                                        raise RuntimeError("重新连接超时")
                                     # 重试工具调用
                                     try:
                                         tool_res = await target_client.call_tool(name, args)
                                         logger.success(f"重新连接后工具 {logger.color_text(name, 'CYAN')} 调用成功")
+                                        await self._notify_tool_result(tool_result_callback, name, tool_res)
 
                                         await self.llmClient.add_tool_call(
                                             role="tool", 
-                                            content=tool_res.content, 
+                                            content=await self._tool_result_content(name, tool_res, query), 
                                             tool_call_id=tool_call.id
                                         )
                                     except Exception as retry_e:
@@ -213,13 +331,23 @@ class Agent():
                                         content=f"工具{name}调用出错: 事件循环已关闭且无法重新连接 - {str(e)}", 
                                         tool_call_id=tool_call.id
                                     )
-
-                if len(self.tools) > 0:
-                    res = await self.llmClient.chat(message=None, tools=self.tools)
+                            else:
+                                # 其他错误也要回复这次工具调用，模型可以据此换参数重试或改用其他工具
+                                await self.llmClient.add_tool_call(
+                                    role="tool", 
+                                    content=f"工具{name}调用出错: {str(e)}", 
+                                    tool_call_id=tool_call.id
+                                )
+
+                turns += 1
+                if len(tools) > 0:
+                    res = await self.llmClient.chat(message=None, tools=tools)
                 else:
                     res = await self.llmClient.chat(message=None)
                 tool_calls = res.choices[0].message.tool_calls if res.choices[0].message.tool_calls else None
             
+            if self.tools:
+                tool_selector.record(agent_type, self.tools, tools, turns)
             logger.info("回复结果")
             # await self.write_messages() # 写入上下文信息
             return {
@@ -242,38 +370,53 @@ class Agent():
             logger.error(f"删除向量索引失败: {res}")
 
 
-    async def create_index(self, files_dir: str, label: str):
+    async def create_index(self, files_dir: str, label: str, files: Optional[List[str]] = None):
         '''
         创建向量索引
 
         args:
             file_path: 文件路径
             label: 索引标签
+            files: 新增文件列表，提供且索引已存在时只把这些文件加入索引
         '''
-        index = self.retriever.create_index(files_dir, label)
+        index = self.retriever.create_index(files_dir, label, files)
         logger.info(f"创建向量索引成功，索引标签为{label}")
         return index
 
+    async def reload_index(self, label: str):
+        '''
+        知识库索引创建、更新或删除后调用，远程模式下会在所有运行时上执行
+
+        检索时每次都从磁盘加载索引，这里只需丢弃本进程中基于旧索引生成的缓存回答
+
+        args:
+            label: 索引标签
+        '''
+        removed = response_cache.invalidate_label(label)
+        logger.info(f"知识库 {label} 已变化，丢弃 {removed} 条缓存回答")
+        return removed
+
 
 
     async def cleanup(self):
-        """清理所有客户端资源，必须和 connect_to_server 在同一任务中执行"""
+        """清理所有客户端资源，由各客户端的监控任务关闭连接"""
         for name, client in self.mcp_clients.items():
             try:
-                # 直接 await，不要 shield，也不要并行 gather
-                await client.cleanup()
+                await mcp_supervisor.stop(client)
                 logger.info(f"客户端 {name} 清理完成")
             except Exception as e:
                 logger.error(f"清理客户端 {name} 时出错: {e}")
 
     async def reconnect_all_clients(self):
-        """尝试重新连接所有MCP客户端"""
-        for name, client in self.mcp_clients.items():
-            try:
-                await client.connect_to_server()
+        """重启所有MCP客户端（并行进行）"""
+        results = await asyncio.gather(*(
+            mcp_supervisor.restart(client, MCP_CONNECT_TIMEOUT) for client in self.mcp_clients.values()
+        ))
+        for name, ok in zip(self.mcp_clients, results):
+            if ok:
                 logger.info(f"重新连接客户端 {name} 成功")
-            except Exception as e:
-                logger.error(f"重新连接客户端 {name} 失败: {e}")
+            else:
+                logger.error(f"重新连接客户端 {name} 失败")
 
 
 
@@ -1,4 +1,5 @@
 from agents.agent import Agent
+from utils.response_cache import cached_response
 from dotenv import load_dotenv
 import os
 import asyncio
@@ -11,6 +12,9 @@ load_dotenv()
 '''
 
 class ExplainAgent(Agent):
+    # 解释概念只需要搜索
+    tool_allowlist = ["bingcn"]
+
     def __init__(self, api_key: str, base_url: str, model: str = None, label: str = None) -> None:
         super().__init__(api_key, base_url, model, label, [
             'filesystem',
@@ -30,6 +34,7 @@ class ExplainAgent(Agent):
         return base_prompt + '\n' + explain_prompt
 
 
+    @cached_response("explain", prompt_arg="query", style_arg="style")
     async def chat(self, query: str, style: str,  bing_search: bool = False) -> str:
         # 将style转换为解释风格
         s2p = {
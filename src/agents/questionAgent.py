@@ -3,6 +3,22 @@ import os
 import asyncio
 # import aiomysql
 from agents.agent import Agent
+from utils.response_cache import cached_response
+from utils.logger import MyLogger, logging
+from utils.grading import GradingEngine
+from utils.structured_output import (
+    parse_structured,
+    GeneratedQuestion,
+    QuickAnswer,
+    AnswerGrade,
+    PracticeQuestions,
+)
+from utils.practice_generation import (
+    split_pieces,
+    is_valid_question,
+    dedupe_questions,
+    assemble_practice_set,
+)
 from enum import Enum
 import json
 from typing import Dict, List, Optional, Union
@@ -11,6 +27,14 @@ load_dotenv()
 
 PROJECT_PATH = os.getenv('PROJECT_PATH')
 
+logger = MyLogger(name="QuestionAgent", level=logging.INFO, colored=True)
+
+# 并行生成练习集：题目数量达到阈值时拆分为多个子任务并发生成
+PRACTICE_PARALLEL_MIN_QUESTIONS = int(os.getenv("PRACTICE_PARALLEL_MIN_QUESTIONS", "6"))
+PRACTICE_PARALLEL_CHUNK = int(os.getenv("PRACTICE_PARALLEL_CHUNK", "2"))
+PRACTICE_PARALLEL_CONCURRENCY = int(os.getenv("PRACTICE_PARALLEL_CONCURRENCY", "4"))
+PRACTICE_PARALLEL_RETRIES = int(os.getenv("PRACTICE_PARALLEL_RETRIES", "2"))
+
 class QuestionType(str, Enum):
     """题目类型枚举"""
     MULTIPLE_CHOICE = "选择题"
@@ -32,6 +56,10 @@ class questionAgent(Agent):
         super().__init__(api_key, base_url, model, label, [
             # "memory"
         ])
+        self.grading_engine = GradingEngine(
+            self.llmClient.complete,
+            concurrency=int(os.getenv("GRADING_CONCURRENCY", "4"))
+        )
         
     def get_system_prompt(self) -> str:
         return super().get_base_system_prompt() + """你是一个专业的软件工程教育专家，擅长出题和批改试题。
@@ -96,8 +124,10 @@ class questionAgent(Agent):
 
         try:
             response = await self.chat(prompt)
-            # 解析JSON响应
-            question_data = json.loads(response)
+            if response["status"] != "success":
+                return response
+            # 解析JSON响应，格式有误时让模型修复
+            question_data = await parse_structured(response["message"], GeneratedQuestion, repair=self.llmClient.complete)
             question_data["status"] = "success"
             return question_data
         except Exception as e:
@@ -107,6 +137,7 @@ class questionAgent(Agent):
             }
 
     # 解释用户输入的题目
+    @cached_response("explain_question", prompt_arg="question")
     async def explain_question(
         self,
         question: str
@@ -205,8 +236,10 @@ class questionAgent(Agent):
 
         try:
             response = await self.chat(prompt)
-            # 解析JSON响应
-            grading_result = json.loads(response)
+            if response["status"] != "success":
+                return response
+            # 解析JSON响应，格式有误时让模型修复
+            grading_result = await parse_structured(response["message"], AnswerGrade, repair=self.llmClient.complete)
             grading_result["status"] = "success"
             return grading_result
         except Exception as e:
@@ -224,70 +257,35 @@ class questionAgent(Agent):
         """
         批改练习题集
         
+        客观题在本地批改，主观题逐题并发调用模型批改，结果按固定规则汇总（见 utils/grading.py）
+        
         Args:
             practice_set: 题目集
             student_answers: 学生答案集
             reference_answers: 参考答案集
             
         Returns:
-            Dict: 包含批改结果的字典
+            Dict: 包含批改结果的字典，message为批改结果的JSON字符串
         """
-        prompt = f"""请对以下软件工程练习题集进行批改：
-
-        题目集：
-        {practice_set}
-
-        学生答案集：
-        {student_answers}
-
-        参考答案集：
-        {reference_answers}
-
-        要求：
-        1. 给出详细的批改结果
-        2. 详细说明得分点和失分点
-        3. 提供具体的改进建议
-        4. 指出答案中的亮点和创新点（如果有）
-
-        输出格式：
-        {{
-                "score": "总分", 
-                "scoring_points": [ 
-                    {{
-                        "id": "题目id",
-                        "point": "对应知识点", 
-                        "score": "得分", 
-                        "deduction": "扣分" 
-                    }},
-                    ...
-                ],
-                "comments": "总体评价",  
-                "suggestions": ["改进建议1", "改进建议2", ...], 
-                "highlights": ["亮点1", "亮点2", ...] 
-        }}
-
-        请确保输出是有效的JSON格式。"""
-
         try:
-            response = await self.chat(prompt)
-            # 解析JSON响应
-            grading_result = response
-            grading_result["status"] = "success"
-            return grading_result
+            grading_result = await self.grading_engine.grade(practice_set, student_answers, reference_answers)
+            return {
+                "status": "success",
+                "message": json.dumps(grading_result, ensure_ascii=False)
+            }
         except Exception as e:
             return {
                 "status": "error",
                 "message": f"批改练习题集时出错: {str(e)}"
-            }   
-        
-    
+            }
 
     async def generate_practice_set(
         self,
         topics: List[str],
         num_questions: int = 5,
         difficulty: QuestionDifficulty = QuestionDifficulty.MEDIUM,
-        question_type: QuestionType = QuestionType.MULTIPLE_CHOICE
+        question_type: QuestionType = QuestionType.MULTIPLE_CHOICE,
+        parallel: Optional[bool] = None
     ) -> Dict:
         """
         生成练习题集
@@ -297,9 +295,15 @@ class questionAgent(Agent):
             num_questions: 题目数量
             difficulty: 题目难度
             question_type: 题目类型
+            parallel: 是否拆分为多个子任务并发生成，为None时题目数量达到阈值才并发
         Returns:
             Dict: 包含题目集的字典
         """
+        if parallel is None:
+            parallel = num_questions >= PRACTICE_PARALLEL_MIN_QUESTIONS
+        if parallel:
+            return await self._generate_practice_set_parallel(topics, num_questions, difficulty, question_type)
+
         prompt = f"""请生成一套包含{num_questions}道软件工程练习题，难度为{difficulty.value}，题型为{question_type.value}。
 
         知识点范围：
@@ -349,6 +353,117 @@ class questionAgent(Agent):
                 "message": f"生成练习题集时出错: {str(e)}"
             }
 
+    async def _generate_practice_set_parallel(
+        self,
+        topics: List[str],
+        num_questions: int,
+        difficulty: QuestionDifficulty,
+        question_type: QuestionType
+    ) -> Dict:
+        """
+        并发生成练习题集
+
+        按知识点拆分为若干子任务并发调用模型，去除重复题目后组装，
+        只重试失败或题目不足的子任务
+
+        Returns:
+            Dict: 与 generate_practice_set 相同格式的结果
+        """
+        context = ""
+        if self.label:
+            context = await asyncio.to_thread(self.retriever.retrieve, "，".join(topics), self.label)
+
+        semaphore = asyncio.Semaphore(PRACTICE_PARALLEL_CONCURRENCY)
+
+        async def run_piece(topic: str, count: int, avoid: List[str]) -> List[Dict]:
+            prompt = f"""请围绕知识点"{topic}"生成{count}道软件工程练习题，难度为{difficulty.value}，题型为{question_type.value}。
+        {f"参考资料：{context}" if context else ""}
+        {("不要与以下题目重复：" + "；".join(avoid)) if avoid else ""}
+
+        要求：
+        1. 每道题都要提供参考答案和解析
+        2. 选择题必须提供选项
+
+        你只需要返回一个json字符串,包含以下内容，不要输出多余的前后缀：
+
+        {{
+            "questions": [
+                {{
+                    "type": "{question_type.value}",
+                    "value": 分值,
+                    "difficulty": "简单/中等/困难",
+                    "question": "题目描述",
+                    "options": ["选项1", "选项2", ...],
+                    "reference_answer": "参考答案",
+                    "analysis": "解题思路",
+                    "topics": ["涉及知识点1", ...]
+                }}
+            ]
+        }}
+        """
+            async with semaphore:
+                text = await self.llmClient.complete(prompt)
+            data = await parse_structured(text, PracticeQuestions, repair=self.llmClient.complete)
+            questions = [q for q in data["questions"] if is_valid_question(q, question_type.value)]
+            if not questions:
+                raise ValueError(f"知识点 {topic} 的子任务没有返回有效题目")
+            return questions[:count]
+
+        pending = split_pieces(topics, num_questions, PRACTICE_PARALLEL_CHUNK)
+        collected: List[Dict] = []
+
+        try:
+            for attempt in range(PRACTICE_PARALLEL_RETRIES + 1):
+                if not pending:
+                    break
+                if attempt > 0:
+                    logger.warning(f"重试 {len(pending)} 个失败的子任务（第{attempt}次）")
+
+                avoid = [q["question"] for q in collected]
+                results = await asyncio.gather(
+                    *(run_piece(topic, count, avoid) for topic, count in pending),
+                    return_exceptions=True
+                )
+
+                failed = []
+                for (topic, count), result in zip(pending, results):
+                    if isinstance(result, Exception):
+                        logger.warning(f"子任务失败: {result}")
+                        failed.append((topic, count))
+                        continue
+                    collected.extend(result)
+                    if len(result) < count:
+                        failed.append((topic, count - len(result)))
+
+                collected, removed = dedupe_questions(collected)
+                if removed:
+                    # 去掉的重复题目按知识点重新补充
+                    logger.info(f"去除了 {removed} 道重复题目")
+                    missing = num_questions - len(collected) - sum(count for _, count in failed)
+                    if missing > 0:
+                        failed.extend(split_pieces(topics, missing, PRACTICE_PARALLEL_CHUNK))
+                pending = failed
+
+            if not collected:
+                return {
+                    "status": "error",
+                    "message": "生成练习题集时出错: 所有子任务均失败"
+                }
+            if len(collected) < num_questions:
+                logger.warning(f"练习题集只生成了 {len(collected)}/{num_questions} 道题目")
+
+            practice_set = assemble_practice_set(collected[:num_questions], difficulty.value, question_type.value)
+            return {
+                "status": "success",
+                "message": json.dumps(practice_set, ensure_ascii=False)
+            }
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"生成练习题集时出错: {str(e)}"
+            }
+
+    @cached_response("quick_answer", prompt_arg="question")
     async def quick_answer(
         self,
         question: str
@@ -386,8 +501,10 @@ class questionAgent(Agent):
 
         try:
             response = await self.chat(prompt)
-            # 解析JSON响应
-            answer_data = json.loads(response)
+            if response["status"] != "success":
+                return response
+            # 解析JSON响应，格式有误时让模型修复
+            answer_data = await parse_structured(response["message"], QuickAnswer, repair=self.llmClient.complete)
             answer_data["status"] = "success"
             return answer_data
         except Exception as e:
@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Any
 import uuid
 from agents.agent import Agent
+from utils.structured_output import parse_structured, ReviewPlan, StructuredOutputError
 
 class ReviewPlanAgent(Agent):
     """复习计划代理"""
@@ -120,15 +121,16 @@ class ReviewPlanAgent(Agent):
                         "message": llm_response['message']
                     }
                 
-                plan_data = json.loads(llm_response['message'])
+                # 解析并校验计划结构，格式有误时让模型修复
+                plan_data = await parse_structured(llm_response['message'], ReviewPlan, repair=self.llmClient.complete)
                 
                 # 为每个步骤生成ID和计划时间（如果没有）
                 current_date = datetime.now()
                 for i, step in enumerate(plan_data.get("steps", [])):
-                    if "id" not in step:
+                    if not step.get("id"):
                         step["id"] = f"step_{uuid.uuid4().hex[:8]}"
                     
-                    if "schedule_time" not in step:
+                    if not step.get("schedule_time"):
                         # 默认每天一个步骤
                         step_date = (current_date + timedelta(days=i)).isoformat()
                         step["schedule_time"] = step_date
@@ -152,8 +154,8 @@ class ReviewPlanAgent(Agent):
                     "plan": plan_data
                 }
                 
-            except json.JSONDecodeError as e:
-                # JSON解析失败，可能LLM返回的不是有效JSON
+            except StructuredOutputError as e:
+                # 修复后仍然不是有效的计划
                 print(f"JSON解析失败: {e}")
                 return {
                     "status": "error",
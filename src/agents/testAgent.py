@@ -4,6 +4,7 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from agents.agent import Agent
+from utils.response_cache import cached_response
 from utils.logger import MyLogger, logging
 import json
 from typing import Dict, List, Optional, Any, Union
@@ -152,6 +153,7 @@ class TestAgent(Agent):
                 "message": f"分析代码可测试性时出错: {str(e)}"
             }
     
+    @cached_response("explain_testing_concept", prompt_arg="concept")
     async def explain_testing_concept(self, concept: str) -> Dict:
         """
         解释软件测试相关概念
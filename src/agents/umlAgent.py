@@ -1,5 +1,6 @@
 from agents.agent import Agent
 from utils.logger import MyLogger, logging
+import json
 import os
 logger = MyLogger( level=logging.INFO)
 from dotenv import load_dotenv
@@ -9,6 +10,11 @@ load_dotenv()
 PROJECT_PATH = os.getenv("PROJECT_PATH")
 
 class UML_Agent(Agent):
+    # 文件系统只需要写入生成的文件
+    tool_allowlist = ["UML-MCP-Server", "write_file", "create_directory"]
+    # 提示词要求批量出图并写入static目录，这两个工具不能被相似度筛掉
+    tool_always_include = ["generate_uml_batch", "write_file"]
+
     def __init__(self, api_key: str, base_url: str, model: str, label: str = None):
        
         super().__init__(api_key, base_url, model, label, [
@@ -20,6 +26,7 @@ class UML_Agent(Agent):
         system_prompt = f'''
         你是一个UML图生成专家，请根据用户的需求生成UML图。
         对于写文件，你的权限目录是：{os.path.join(PROJECT_PATH, "static")}。
+        需要画多张图时，使用 generate_uml_batch 工具一次生成所有图。
         你的最终回复不需要提供生成的UML图的链接或者代码，只需要输出你画的UML图的解释文本，而且要尽可能详细的解释。
         '''
 
@@ -33,7 +40,24 @@ class UML_Agent(Agent):
             请根据用户的需求生成{diagram_type}
             '''
             
-            res = await self.chat(prompt)
+            # 收集UML工具生成的图片路径（按内容哈希命名，各请求互不影响）
+            static_paths = []
+
+            def collect_static_path(name, tool_res):
+                for item in getattr(tool_res, "content", None) or []:
+                    try:
+                        data = json.loads(getattr(item, "text", "") or "")
+                    except json.JSONDecodeError:
+                        continue
+                    # 批量生成工具返回 {"results": [...]}
+                    results = data.get("results", [data]) if isinstance(data, dict) else []
+                    for result in results:
+                        if isinstance(result, dict) and result.get("static_path"):
+                            static_paths.append(result["static_path"])
+
+            res = await self.chat(prompt, tool_result_callback=collect_static_path)
+            if isinstance(res, dict):
+                res["static_paths"] = static_paths
             
             return res 
         
@@ -1,6 +1,6 @@
 from agents.agent import Agent 
 from fastapi import FastAPI, File, Form, UploadFile, HTTPException, APIRouter, Body, Depends, BackgroundTasks, Query, Request, Response
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from dotenv import load_dotenv
 import threading
 import os
@@ -11,7 +11,6 @@ import time
 from typing import List, Any, Callable, TypeVar, Awaitable, Optional, Dict, Union
 import shutil
 import concurrent.futures
-import functools
 from agents.umlAgent import UML_Agent
 from fastapi.staticfiles import StaticFiles
 from enum import Enum
@@ -22,6 +21,7 @@ from agents.paperAgent import PaperAgent
 from agents.testAgent import TestAgent, Language, TestType
 from fastapi.middleware.cors import CORSMiddleware
 import json
+from urllib.parse import quote
 # 导入认证模块
 from auth import auth_router, get_current_active_user, User
 from utils.conversation_logger import ConversationLogger
@@ -29,6 +29,25 @@ from models.practice_history import PracticeHistory
 from datetime import datetime
 from models.review_plan import ReviewPlanManager
 from agents.reviewplanAgent import ReviewPlanAgent
+from utils.upload_handler import save_uploads, discard_uploads, UploadLimitExceeded
+from utils.runtime_client import RuntimeClient
+from utils.disconnect import CancelOnDisconnectMiddleware
+from utils.admission import AdmissionController, AdmissionRejected
+from utils.response_cache import response_cache
+from utils.tool_result_cache import tool_result_cache
+from utils.mcp_supervisor import mcp_supervisor
+from utils.tool_latency import tool_latency
+from utils.tool_output import tool_output_processor
+from utils.tool_selector import tool_selector
+from utils.structured_output import structured_output_stats
+from utils.grading import GradingEngine
+from llmClient import LLMClient
+from utils.single_flight import SingleFlight
+from utils.practice_pool_builder import PracticePoolBuilder
+from models.practice_pool import PracticePool
+from utils.export_service import ExportService, SUPPORTED_FORMATS
+from utils.static_files import HashedStaticFiles
+from agent_runtime import build_agents, build_agent_handles
 
 
 
@@ -56,19 +75,53 @@ practice_history = PracticeHistory(PROJECT_ROOT)
 # 初始化复习计划管理器
 review_plan_manager = ReviewPlanManager(PROJECT_ROOT)
 
+# 预生成练习集题库，后台补充任务在启动时创建
+# 多worker部署时各worker竞争同一个文件锁，只有拿到锁的worker运行补充任务
+practice_pool = PracticePool(PROJECT_PATH)
+practice_pool_builder = None
+PRACTICE_POOL_BUILDER = os.getenv("PRACTICE_POOL_BUILDER", "true").lower() == "true"
+PRACTICE_POOL_IDLE_RUNNING = int(os.getenv("PRACTICE_POOL_IDLE_RUNNING", "1"))
+
+
+# Agent运行模式：
+# - local：所有Agent运行在本进程的后台线程事件循环中（默认）
+# - remote：Agent运行在独立的运行时进程中（见 agent_runtime.py），本进程只做转发，可以开启多个worker
+AGENT_RUNTIME_MODE = os.getenv("AGENT_RUNTIME_MODE", "local")
+AGENT_RUNTIME_URLS = [url.strip() for url in os.getenv("AGENT_RUNTIME_URLS", "http://127.0.0.1:9001").split(",") if url.strip()]
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
 
 # 全局变量
-agent = Agent(api_key, base_url, model) 
+if AGENT_RUNTIME_MODE == "remote":
+    # 远程模式下Agent运行在运行时进程中，本进程只保留用于转发调用的Agent句柄
+    agent_registry = build_agent_handles()
+else:
+    agent_registry = build_agents(conversation_logger, practice_history, review_plan_manager)
+agent = agent_registry["agent"]
 agent_lock = threading.Lock()
 agent_ready = threading.Event()
-umlAgent = UML_Agent(api_key, base_url, model)
-explainAgent = ExplainAgent(api_key, base_url, model)
-question_agent = questionAgent(api_key, base_url, model)
-paper_agent = PaperAgent()
-test_agent = TestAgent(api_key, base_url, model)
-review_plan_agent = ReviewPlanAgent(conversation_logger, practice_history, review_plan_manager)
+umlAgent = agent_registry["uml"]
+explainAgent = agent_registry["explain"]
+question_agent = agent_registry["question"]
+paper_agent = agent_registry["paper"]
+test_agent = agent_registry["test"]
+review_plan_agent = agent_registry["review_plan"]
+
+# 全班批改直接在API的事件循环中运行，使用独立的模型客户端：
+# httpx连接池绑定在创建它的事件循环上，不能与Agent事件循环中的 question_agent 共用
+class_grading_engine = GradingEngine(
+    LLMClient(api_key, base_url, model, system_prompt=question_agent.get_system_prompt()).complete,
+    concurrency=int(os.getenv("GRADING_CONCURRENCY", "4"))
+)
 
-agents = [agent, umlAgent, explainAgent, question_agent, paper_agent, test_agent, review_plan_agent]
+agents = list(agent_registry.values())
+# Agent实例到注册名的映射，远程模式下用于定位运行时中的Agent
+agent_names = {id(agt): name for name, agt in agent_registry.items()}
+
+runtime_client = None
+if AGENT_RUNTIME_MODE == "remote":
+    runtime_client = RuntimeClient(AGENT_RUNTIME_URLS)
+    # 远程模式下本进程不启动Agent，由运行时负责初始化
+    agent_ready.set()
 
 type2agent = {
     "UmlAgent": umlAgent,
@@ -88,6 +141,11 @@ os.makedirs(UML_STATIC_DIR, exist_ok=True)
 DOCS_DIR = os.path.join(os.getenv("PROJECT_PATH"), "static", "docs")
 os.makedirs(DOCS_DIR, exist_ok=True)
 
+# 习题集导出服务（工作进程池 + 按内容缓存）
+export_service = ExportService.from_env(DOCS_DIR)
+# 一次批量导出的最大习题集数量
+EXPORT_BATCH_MAX = int(os.getenv("EXPORT_BATCH_MAX", "50"))
+
 class ChatRequest(BaseModel):
     message: str
 
@@ -131,20 +189,29 @@ class ExplainStyle(str, Enum):
     FUNNY = "FUNNY"
 
 
+# 相同的并发Agent调用只执行一次
+single_flight = SingleFlight()
+
 # 工具函数
 async def run_in_agent_thread(
     coro_func: Callable[..., Awaitable[T]], 
     *args, 
     timeout: int = 300,
+    session_key: Optional[Any] = None,
+    coalesce: bool = False,
     **kwargs
 ) -> T:
     """
     在Agent线程的事件循环中执行异步函数，并等待结果
     
+    远程模式下，调用会被转发到Agent运行时进程
+    
     Args:
         coro_func: 要执行的异步函数
         *args: 传递给异步函数的位置参数
         timeout: 等待结果的超时时间（秒）
+        session_key: 会话标识（通常是用户ID），远程模式下用于粘滞路由
+        coalesce: 是否与参数相同的正在执行的调用合并，只适用于结果与用户无关的调用
         **kwargs: 传递给异步函数的关键字参数
         
     Returns:
@@ -154,42 +221,83 @@ async def run_in_agent_thread(
         concurrent.futures.TimeoutError: 如果等待超时
         Exception: 如果异步函数执行出错
     """
+    if coalesce:
+        agent_name = agent_names.get(id(getattr(coro_func, "__self__", None)), "")
+        key = SingleFlight.make_key(agent_name, coro_func.__qualname__, args, kwargs)
+        return await single_flight.do(
+            key,
+            lambda: _run_agent_call(coro_func, args, kwargs, timeout, session_key)
+        )
+    return await _run_agent_call(coro_func, args, kwargs, timeout, session_key)
+
+async def _run_agent_call(
+    coro_func: Callable[..., Awaitable[T]],
+    args: tuple,
+    kwargs: Dict,
+    timeout: int,
+    session_key: Optional[Any]
+) -> T:
+    """执行一次Agent调用（本地Agent线程或远程运行时）"""
     global agent_loop
     
+    if runtime_client is not None:
+        agent_name = agent_names.get(id(getattr(coro_func, "__self__", None)))
+        if agent_name is None:
+            raise RuntimeError(f"无法在Agent运行时中定位方法: {coro_func}")
+        return await runtime_client.invoke(
+            agent_name,
+            coro_func.__name__,
+            args=args,
+            kwargs=kwargs,
+            timeout=timeout,
+            session_key=session_key
+        )
+    
     if agent_loop is None or agent_loop.is_closed():
         raise RuntimeError("Agent事件循环未创建或已关闭")
     
-    # 创建Future对象，用于在线程间传递结果
-    response_future = concurrent.futures.Future()
+    # 把协程直接提交到agent事件循环，并把返回的concurrent.futures.Future包装为
+    # 当前事件循环可await的Future，等待期间不占用线程池中的线程
+    response_future = asyncio.run_coroutine_threadsafe(coro_func(*args, **kwargs), agent_loop)
     
-    def run_in_loop():
-        """在agent事件循环中运行协程并设置Future结果"""
-        try:
-            # 创建协程
-            coro = coro_func(*args, **kwargs)
-            # 创建Task
-            task = agent_loop.create_task(coro)
-            
-            # 添加回调函数以设置Future的结果
-            def set_result(task):
-                try:
-                    result = task.result()
-                    response_future.set_result(result)
-                except Exception as e:
-                    response_future.set_exception(e)
-            
-            task.add_done_callback(set_result)
-        except Exception as e:
-            response_future.set_exception(e)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(response_future), timeout=timeout)
+    except asyncio.TimeoutError:
+        # wait_for超时会取消包装的Future，取消会传播到agent事件循环中的Task
+        raise concurrent.futures.TimeoutError()
+    finally:
+        # 请求被取消（如客户端断开连接）时，同样取消agent事件循环中的Task
+        if not response_future.done():
+            response_future.cancel()
+
+# Agent请求准入控制：全局/用户并发上限、交互式与批处理通道、有界公平队列
+admission_controller = AdmissionController.from_env()
+
+def agent_admission(endpoint: str):
+    """
+    生成端点的准入依赖，请求处理期间占用一个执行额度
     
-    # 将函数调度到agent事件循环所在的线程中执行
-    agent_loop.call_soon_threadsafe(run_in_loop)
+    Args:
+        endpoint: 端点路径，用于确定调度通道
+    """
+    lane = admission_controller.lane_for(endpoint)
     
-    # 等待结果
-    return await asyncio.get_event_loop().run_in_executor(
-        None, 
-        functools.partial(response_future.result, timeout=timeout)
-    )
+    async def dependency(current_user: User = Depends(get_current_active_user)):
+        try:
+            await admission_controller.acquire(current_user.id, lane)
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=e.status_code,
+                detail=e.message,
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            admission_controller.release(current_user.id, lane, time.monotonic() - start)
+    
+    return dependency
 
 class ErrorTrackingRequest(BaseModel):
     question: str
@@ -199,6 +307,15 @@ class ErrorTrackingRequest(BaseModel):
 class StepByStepRequest(BaseModel):
     question: str
 
+class ClassGradingRequest(BaseModel):
+    practice_set: Union[List[Dict], Dict]
+    submissions: List[Dict]
+    reference_answers: Optional[Union[List, Dict]] = None
+
+class BatchExportRequest(BaseModel):
+    item_ids: List[str]
+    format: str = "pdf"
+
 # 启动 Agent 的异步任务
 async def start_agent():
     global agent
@@ -248,8 +365,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 挂载静态文件目录
-app.mount("/static", StaticFiles(directory=UML_STATIC_DIR), name="static")
+# 客户端断开连接时取消正在处理的请求，取消会一直传播到Agent任务
+app.add_middleware(CancelOnDisconnectMiddleware)
+
+# 挂载静态文件目录（按内容哈希命名的UML图等文件带长期缓存头）
+app.mount("/static", HashedStaticFiles(directory=UML_STATIC_DIR), name="static")
 
 DIST_DIR = os.path.join(os.getenv("PROJECT_PATH"), "dist")
 
@@ -273,6 +393,7 @@ app.include_router(auth_router)
 @app.post("/chat")
 async def chat(
     message: str = Form(...),
+    _admission: None = Depends(agent_admission("/chat")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -294,7 +415,7 @@ async def chat(
     
     try:
         # 在Agent线程的事件循环中执行异步函数
-        response = await run_in_agent_thread(agent.chat, message, timeout=300)
+        response = await run_in_agent_thread(agent.chat, message, timeout=300, session_key=current_user.id)
         
         # 记录对话
         agent_type = agent.__class__.__name__
@@ -354,41 +475,63 @@ async def create_or_update_index(
     # 创建知识库目录（如果不存在）
     os.makedirs(kb_dir, exist_ok=True)
     
-    # 保存上传的文件
-    file_paths = []
+    # 流式保存上传的文件，按内容哈希去重
     try:
-        for file in files:
-            print(f"处理文件: {file.filename}")
-            dest_path = os.path.join(kb_dir, file.filename)
-            
-            # 检查文件是否已存在
-            if os.path.exists(dest_path) and is_update:
-                # 更新模式下，为重名文件添加时间戳
-                file_name, file_ext = os.path.splitext(file.filename)
-                timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-                new_filename = f"{file_name}_{timestamp}{file_ext}"
-                dest_path = os.path.join(kb_dir, new_filename)
-                print(f"文件已存在，重命名为: {new_filename}")
-            
-            # 读取上传的文件内容并写入目标位置
-            with open(dest_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-                
-            file_paths.append(dest_path)
-            print(f"已保存文件到: {dest_path}")
-
+        upload_result = await save_uploads(files, kb_dir)
+    except UploadLimitExceeded as e:
+        if not is_existing_kb:
+            shutil.rmtree(kb_dir, ignore_errors=True)
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         return {"status": "error", "message": f"保存文件时出错: {str(e)}"}
     
+    file_paths = upload_result["saved"]
+    duplicates = upload_result["duplicates"]
     operation_type = "更新" if is_update else "创建"
+    duplicate_msg = f"，跳过 {len(duplicates)} 个重复文件" if duplicates else ""
+    index_exists = os.path.exists(os.path.join(VECTOR_STORE_DIR, name))
+    
+    # 没有新增内容且索引已存在时无需重建索引
+    if not file_paths and index_exists:
+        return {
+            "status": "success",
+            "message": f"知识库 {name} 没有新增文件{duplicate_msg}",
+            "duplicates": duplicates
+        }
     
     try:
-        # 等待结果
-        await run_in_agent_thread(agent.create_index, files_dir=kb_dir, label=name, timeout=120)
-        return {"status": "success", "message": f"成功{operation_type}知识库: {name}，添加了 {len(file_paths)} 个文件"}
-    except Exception as e:
+        # 索引已存在时只向其中添加新文件，否则为整个目录建立索引
+        await run_in_agent_thread(
+            agent.create_index,
+            files_dir=kb_dir,
+            label=name,
+            files=file_paths if index_exists else None,
+            timeout=120,
+            session_key=current_user.id
+        )
+    except BaseException as e:
+        # 索引失败、超时或客户端断开：删除新文件且不写清单，重试时会重新索引
+        discard_uploads(file_paths)
+        if not is_existing_kb:
+            shutil.rmtree(kb_dir, ignore_errors=True)
+        if not isinstance(e, Exception):
+            raise
         return {"status": "error", "message": f"{operation_type}向量存储时出错: {str(e)}"}
+    
+    upload_result["manifest"].save()
+    await _reload_index(name)
+    return {
+        "status": "success",
+        "message": f"成功{operation_type}知识库: {name}，添加了 {len(file_paths)} 个文件{duplicate_msg}",
+        "duplicates": duplicates
+    }
+
+async def _reload_index(name: str):
+    """知识库索引变化后，丢弃各运行时中基于旧索引的缓存回答（远程模式下广播到所有运行时）"""
+    try:
+        await run_in_agent_thread(agent.reload_index, name, timeout=30)
+    except Exception as e:
+        print(f"刷新知识库 {name} 的缓存回答时出错: {e}")
 
 @app.get("/list_knowledge_bases")
 async def list_knowledge_bases(current_user: User = Depends(get_current_active_user)):
@@ -430,7 +573,8 @@ async def delete_knowledge_base(
         raise HTTPException(status_code=400, detail="请提供知识库名称")
     
     try:
-        await run_in_agent_thread(agent.delete_index, name, timeout=30)
+        await run_in_agent_thread(agent.delete_index, name, timeout=30, session_key=current_user.id)
+        await _reload_index(name)
         return {"status": "success", "message": f"成功删除知识库: {name}"}
     except Exception as e:
         return {"status": "error", "message": f"删除知识库时出错: {str(e)}"}
@@ -462,7 +606,7 @@ async def update_label(
     if not agent or not agent_ready.is_set():
         return {"status": "error", "message": "Agent 尚未准备好，请稍后再试"}
     
-    if agent_loop is None or agent_loop.is_closed():
+    if runtime_client is None and (agent_loop is None or agent_loop.is_closed()):
         return {"status": "error", "message": "Agent事件循环未创建或已关闭"}
 
 
@@ -474,7 +618,7 @@ async def update_label(
         # 等待结果
         for agent_type in agent_type_list:
             agt = type2agent[agent_type]
-            await run_in_agent_thread(agt.update_label, name, timeout=30)
+            await run_in_agent_thread(agt.update_label, name, timeout=30, session_key=current_user.id)
 
         return {"status": "success", "message": f"成功更新知识库标签: {name}"}
     except Exception as e:
@@ -484,6 +628,7 @@ async def update_label(
 async def generate_uml(
     query: str = Form(...),
     diagram_type: DiagramType = Form(...),
+    _admission: None = Depends(agent_admission("/umlAgent/generate_uml")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -499,7 +644,8 @@ async def generate_uml(
         {
             "status": "success"/"error",
             "message": str,
-            "static_path": str,
+            "static_path": str,  # 按内容哈希命名的图片地址，没有生成图片时为None
+            "static_paths": List[str],
         }
     """
 
@@ -509,7 +655,8 @@ async def generate_uml(
             umlAgent.generate_uml, 
             query=query, 
             diagram_type=diagram_type.value,
-            timeout=300
+            timeout=300,
+            session_key=current_user.id
         )
         
         # 记录对话
@@ -521,7 +668,14 @@ async def generate_uml(
             response=response
         )
         
-        return {"status": "success", "message": response['message'], "static_path": f"http://localhost:8000/static/{diagram_type.value}/uml.png"}
+        # 图片按内容哈希命名，返回本次请求生成的最后一张
+        static_paths = [f"http://localhost:8000/static/{path}" for path in response.get("static_paths", [])]
+        return {
+            "status": "success",
+            "message": response['message'],
+            "static_path": static_paths[-1] if static_paths else None,
+            "static_paths": static_paths
+        }
     except Exception as e:
         print(f"生成UML图时出错: {e}")
         return {"status": "error", "message": f"生成UML图时出错: {str(e)}"}
@@ -531,6 +685,7 @@ async def explain(
     query: str = Form(...),
     style_label: ExplainStyle = Form(...),
     bing_search: bool = Form(False),
+    _admission: None = Depends(agent_admission("/explainAgent/explain")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -543,7 +698,9 @@ async def explain(
             query,                  # 第一个参数
             style_label.value,      # 第二个参数
             bing_search,            # 第四个参数
-            timeout=120             # timeout是run_in_agent_thread的参数
+            timeout=120,            # timeout是run_in_agent_thread的参数
+            session_key=current_user.id,
+            coalesce=True
         )
 
 
@@ -571,6 +728,7 @@ async def explain(
 @app.post("/questionAgent/explain_question")
 async def explain_question(
     question: str = Form(...),
+    _admission: None = Depends(agent_admission("/questionAgent/explain_question")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -580,7 +738,9 @@ async def explain_question(
         # 调用Agent解析题目
         response = await run_in_agent_thread(
             question_agent.explain_question,
-            question
+            question,
+            session_key=current_user.id,
+            coalesce=True
         )
         
         # 记录Agent响应
@@ -599,6 +759,7 @@ async def explain_question(
 @app.post("/questionAgent/quick_answer")
 async def quick_answer(
     question: str = Form(...),
+    _admission: None = Depends(agent_admission("/questionAgent/quick_answer")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -616,7 +777,9 @@ async def quick_answer(
         # 调用Agent快速回答问题
         response = await run_in_agent_thread(
             question_agent.quick_answer,
-            question
+            question,
+            session_key=current_user.id,
+            coalesce=True
         )
         
         # 记录Agent响应
@@ -635,6 +798,7 @@ async def generate_practice_set(
     num_questions: int = Form(5),
     difficulty: QuestionDifficulty = Form(QuestionDifficulty.MEDIUM),
     type: QuestionType = Form(QuestionType.MULTIPLE_CHOICE),
+    _admission: None = Depends(agent_admission("/questionAgent/generate_practice_set")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -667,14 +831,28 @@ async def generate_practice_set(
         # 将接收到的字符串转换为列表
         topic_list = [topic.strip() for topic in topics.split(",") if topic.strip()]
         
-        # 调用question_agent时传入处理后的列表
-        result = await run_in_agent_thread(
-            question_agent.generate_practice_set,
-            topic_list,
-            num_questions,
-            difficulty,
-            type
+        # 优先使用题库中预生成的练习集
+        # 题库是SQLite，读写放到线程中执行，不阻塞事件循环
+        combo_key = await asyncio.to_thread(
+            practice_pool.record_demand, topic_list, num_questions, difficulty.value, type.value
         )
+        result = await asyncio.to_thread(practice_pool.take, combo_key)
+        
+        if result is None:
+            # 题库中没有，现场生成
+            result = await run_in_agent_thread(
+                question_agent.generate_practice_set,
+                topic_list,
+                num_questions,
+                difficulty,
+                type,
+                session_key=current_user.id,
+                coalesce=True
+            )
+        
+        # 空闲时补充该组合（只有热门组合会被补充）
+        if practice_pool_builder is not None:
+            practice_pool_builder.request_refill(combo_key)
 
         # 记录对话
         conversation_logger.log_conversation(
@@ -694,6 +872,7 @@ async def grade_practice_set(
     practice_set: str = Form(...),  # 题目集的JSON字符串
     student_answers: str = Form(...),  # 学生答案集的JSON字符串
     reference_answers: str = Form(...),  # 参考答案集的JSON字符串
+    _admission: None = Depends(agent_admission("/questionAgent/grade_practice_set")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -736,11 +915,14 @@ async def grade_practice_set(
                 "message": "输入数据格式错误，请确保是有效的JSON格式"
             }
         
-        # 调用question_agent的批改方法
-        result = await question_agent.grade_practice_set(
+        # 调用question_agent的批改方法（在Agent事件循环中执行，不阻塞请求处理）
+        result = await run_in_agent_thread(
+            question_agent.grade_practice_set,
             practice_set=practice_set_data,
             student_answers=student_answers_data,
-            reference_answers=reference_answers_data    
+            reference_answers=reference_answers_data,
+            timeout=300,
+            session_key=current_user.id
         )
         
         if result["status"] == "success":
@@ -760,10 +942,76 @@ async def grade_practice_set(
             "message": f"批改练习题集时出错: {str(e)}"
         }
 
+@app.post("/questionAgent/grade_class")
+async def grade_class(
+    request: ClassGradingRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    批改全班的练习题集，逐行返回结果（NDJSON）
+    
+    Args:
+        request: {
+            "practice_set": 题目集,
+            "submissions": [{"student_id": ..., "name": ..., "answers": 答案集}, ...],
+            "reference_answers": 参考答案集（可选，默认使用题目中的参考答案）
+        }
+        
+    Returns:
+        每个学生批改完成后输出一行 {"type": "student", ...}，
+        最后输出一行全班汇总 {"type": "summary", ...}
+    """
+    if not request.submissions:
+        return {"status": "error", "message": "没有需要批改的答案"}
+    
+    # 批改引擎只使用无状态的模型调用，直接在当前事件循环中运行，远程模式下同样适用
+    results = class_grading_engine.grade_class(
+        request.practice_set,
+        request.submissions,
+        request.reference_answers
+    )
+    lane = admission_controller.lane_for("/questionAgent/grade_class")
+    
+    async def stream():
+        # 准入额度在响应体中占用：yield依赖的退出代码在流式响应开始发送之前就会执行
+        try:
+            await admission_controller.acquire(current_user.id, lane)
+        except AdmissionRejected as e:
+            await results.aclose()
+            yield json.dumps(
+                {"type": "error", "message": e.message, "retry_after": e.retry_after},
+                ensure_ascii=False
+            ) + "\n"
+            return
+        
+        summary = None
+        start = time.monotonic()
+        try:
+            async for item in results:
+                if item["type"] == "summary":
+                    summary = item
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "message": f"批改时出错: {str(e)}"}, ensure_ascii=False) + "\n"
+        finally:
+            admission_controller.release(current_user.id, lane, time.monotonic() - start)
+            await results.aclose()
+        
+        conversation_logger.log_conversation(
+            user_id=current_user.id,
+            username=current_user.username,
+            agent_type="QuestionAgent",
+            query=f"批改全班练习：{len(request.submissions)}名学生",
+            response={"status": "success" if summary else "error", "message": summary}
+        )
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/paperAgent/search_papers")
 async def search_papers(
     topic: str = Form(...), 
     max_results: int = Form(...),
+    _admission: None = Depends(agent_admission("/paperAgent/search_papers")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -785,7 +1033,9 @@ async def search_papers(
             paper_agent.search_papers_by_topic,
             topic=topic,
             max_results=max_results,
-            timeout=300
+            timeout=300,
+            session_key=current_user.id,
+            coalesce=True
         )
         
         # 记录对话
@@ -805,26 +1055,28 @@ async def search_papers(
 @app.post("/paperAgent/download_and_read_paper")
 async def download_and_read_paper(
     paper_id: str = Form(...),
+    _admission: None = Depends(agent_admission("/paperAgent/download_and_read_paper")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     获取论文详情
     """
     try:
-        result = await run_in_agent_thread(paper_agent.download_and_read_paper, paper_id, timeout=120)
+        result = await run_in_agent_thread(paper_agent.download_and_read_paper, paper_id, timeout=120, session_key=current_user.id)
         return {"status": "success", "message": result['message']}
     except Exception as e:
         return {"status": "error", "message": f"下载和阅读论文时出错: {str(e)}"}
 
 @app.post("/paperAgent/list_and_organize_papers")
 async def list_and_organize_papers(
+    _admission: None = Depends(agent_admission("/paperAgent/list_and_organize_papers")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     列出并组织论文
     """
     try:
-        result = await run_in_agent_thread(paper_agent.list_and_organize_papers, timeout=120)
+        result = await run_in_agent_thread(paper_agent.list_and_organize_papers, timeout=120, session_key=current_user.id)
         return {"status": "success", "message": result['message']}
     except Exception as e:
         return {"status": "error", "message": f"列出和组织论文时出错: {str(e)}"}        
@@ -834,13 +1086,14 @@ async def list_and_organize_papers(
 async def analyze_paper_for_project(
     paper_id: str = Form(...), 
     project_description: str = Form(...),
+    _admission: None = Depends(agent_admission("/paperAgent/analyze_paper_for_project")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     分析论文对特定项目的应用价值
     """
     try:
-        result = await run_in_agent_thread(paper_agent.analyze_paper_for_project, paper_id, project_description, timeout=120)
+        result = await run_in_agent_thread(paper_agent.analyze_paper_for_project, paper_id, project_description, timeout=120, session_key=current_user.id)
         return {"status": "success", "message": result['message']}
     except Exception as e:
         return {"status": "error", "message": f"分析论文对特定项目的应用价值时出错: {str(e)}"}
@@ -849,19 +1102,50 @@ async def analyze_paper_for_project(
 @app.post("/paperAgent/recommend_learning_path")
 async def recommend_learning_path(
     topic: str = Form(...),
+    _admission: None = Depends(agent_admission("/paperAgent/recommend_learning_path")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     推荐学习路径
     """
     try:
-        result = await run_in_agent_thread(paper_agent.recommend_learning_path, topic, timeout=120)
+        result = await run_in_agent_thread(paper_agent.recommend_learning_path, topic, timeout=120, session_key=current_user.id)
         return {"status": "success", "message": result['message']}
     except Exception as e:
         return {"status": "error", "message": f"推荐学习路径时出错: {str(e)}"}
 
 
 
+@app.get("/metrics")
+async def get_metrics(current_user: User = Depends(get_current_active_user)):
+    """
+    获取服务运行指标
+    
+    Returns:
+        dict: 包含各组件实时指标的字典
+    """
+    metrics = {
+        "status": "success",
+        "admission": admission_controller.stats(),
+        "single_flight": single_flight.stats(),
+        "practice_pool": practice_pool.stats(),
+        "export": export_service.stats(),
+    }
+    if practice_pool_builder is not None:
+        metrics["practice_pool"]["builder"] = practice_pool_builder.stats()
+    if runtime_client is not None:
+        # 远程模式下Agent（及其缓存）运行在运行时进程中
+        metrics["runtimes"] = await runtime_client.health()
+    else:
+        metrics["response_cache"] = response_cache.stats()
+        metrics["tool_cache"] = tool_result_cache.stats()
+        metrics["mcp"] = mcp_supervisor.stats()
+        metrics["tool_latency"] = tool_latency.stats()
+        metrics["tool_output"] = tool_output_processor.stats()
+        metrics["tool_selector"] = tool_selector.stats()
+        metrics["structured_output"] = structured_output_stats()
+    return metrics
+
 # 添加新的下载端点
 @app.get("/download/{filename}")
 async def download_file(
@@ -1028,6 +1312,7 @@ async def generate_test_cases(
     language: Language = Form(...),
     test_type: TestType = Form(...),
     description: str = Form(""),
+    _admission: None = Depends(agent_admission("/testAgent/generate_test_cases")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -1053,7 +1338,8 @@ async def generate_test_cases(
             language=language,
             test_type=test_type,
             description=description,
-            timeout=300
+            timeout=300,
+            session_key=current_user.id
         )
         
         # 记录对话
@@ -1075,6 +1361,7 @@ async def generate_test_cases(
 async def analyze_code_for_testability(
     code: str = Form(...),
     language: Language = Form(...),
+    _admission: None = Depends(agent_admission("/testAgent/analyze_code_for_testability")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -1096,7 +1383,8 @@ async def analyze_code_for_testability(
             test_agent.analyze_code_for_testability,
             code=code,
             language=language,
-            timeout=300
+            timeout=300,
+            session_key=current_user.id
         )
         
         # 记录对话
@@ -1119,6 +1407,7 @@ async def evaluate_test_coverage(
     code: str = Form(...),
     tests: str = Form(...),
     language: Language = Form(...),
+    _admission: None = Depends(agent_admission("/testAgent/evaluate_test_coverage")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -1142,7 +1431,8 @@ async def evaluate_test_coverage(
             code=code,
             tests=tests,
             language=language,
-            timeout=300
+            timeout=300,
+            session_key=current_user.id
         )
         
         # 记录对话
@@ -1187,21 +1477,13 @@ async def download_practice_set(
                 "message": "输入数据格式错误，请确保是有效的JSON格式"
             }
         
-        # 生成唯一的文件名
-        timestamp = int(time.time())
-        filename = f"practice_set_{current_user.id}_{timestamp}"
-        
-        # 文件路径
-        file_path = os.path.join(DOCS_DIR, f"{filename}.{format}")
-        
-        # 根据格式生成文件
-        if format == "pdf":
-            await generate_pdf(practice_set_data, file_path)
-        elif format == "docx":
-            await generate_docx(practice_set_data, file_path)
-        else:
+        if format not in SUPPORTED_FORMATS:
             return {"status": "error", "message": "不支持的格式，只支持pdf或docx"}
         
+        # 在工作进程中渲染，相同内容直接使用已导出的文件
+        timestamp = int(time.time())
+        file_path = await export_service.export(practice_set_data, format)
+        
         # 返回文件下载响应
         return FileResponse(
             file_path,
@@ -1211,193 +1493,57 @@ async def download_practice_set(
     except Exception as e:
         return {"status": "error", "message": f"下载习题集时出错: {str(e)}"}
 
-async def generate_pdf(practice_set_data, file_path):
+@app.post("/questionAgent/download_practice_sets")
+async def download_practice_sets(
+    request: BatchExportRequest,
+    current_user: User = Depends(get_current_active_user)
+):
     """
-    生成PDF文件
-    
-    Args:
-        practice_set_data: 习题集数据
-        file_path: 输出文件路径
-    """
-    from reportlab.lib.pagesizes import A4
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
-    from reportlab.lib.units import inch
-    
-    # 注册中文字体
-    try:
-        # 尝试注册思源黑体（Source Han Sans）
-        pdfmetrics.registerFont(TTFont('SourceHanSans', 'SourceHanSans-Regular.ttf'))
-        font_name = 'SourceHanSans'
-    except:
-        try:
-            # 尝试注册宋体
-            pdfmetrics.registerFont(TTFont('SimSun', 'SimSun.ttf'))
-            font_name = 'SimSun'
-        except:
-            # 如果都失败，使用默认字体
-            font_name = 'Helvetica'
-            print("警告：未能加载中文字体，文档可能无法正确显示中文")
-    
-    # 创建自定义样式
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(
-        name='ChineseTitle',
-        fontName=font_name,
-        fontSize=18,
-        leading=22,
-        alignment=1  # 居中
-    ))
-    styles.add(ParagraphStyle(
-        name='ChineseHeading',
-        fontName=font_name,
-        fontSize=14,
-        leading=18
-    ))
-    styles.add(ParagraphStyle(
-        name='ChineseNormal',
-        fontName=font_name,
-        fontSize=10,
-        leading=14
-    ))
-    
-    # 创建PDF文档
-    doc = SimpleDocTemplate(
-        file_path,
-        pagesize=A4,
-        rightMargin=72,
-        leftMargin=72,
-        topMargin=72,
-        bottomMargin=72
-    )
-    
-    # 创建内容列表
-    content = []
-    
-    # 添加标题
-    title = Paragraph("软件工程练习题集", styles['ChineseTitle'])
-    content.append(title)
-    content.append(Spacer(1, 12))
-    
-    # 添加题目
-    for i, question in enumerate(practice_set_data.get("questions", [])):
-        # 题目标题
-        question_title = Paragraph(f"{i+1}. {question.get('question', '未提供题目')}", styles['ChineseHeading'])
-        content.append(question_title)
-        content.append(Spacer(1, 6))
-        
-        # 选项（如果有）
-        if question.get("options"):
-            for j, option in enumerate(question["options"]):
-                option_text = Paragraph(f"{option}", styles['ChineseNormal'])
-                content.append(option_text)
-            content.append(Spacer(1, 6))
-        
-        # 参考答案
-        answer_title = Paragraph("参考答案:", styles['ChineseHeading'])
-        content.append(answer_title)
-        answer_text = Paragraph(question.get("reference_answer", "未提供答案"), styles['ChineseNormal'])
-        content.append(answer_text)
-        content.append(Spacer(1, 6))
-        
-        # 解析
-        if question.get("analysis"):
-            analysis_title = Paragraph("解析:", styles['ChineseHeading'])
-            content.append(analysis_title)
-            analysis_text = Paragraph(question.get("analysis", ""), styles['ChineseNormal'])
-            content.append(analysis_text)
-        
-        content.append(Spacer(1, 12))
-    
-    # 构建PDF
-    doc.build(content)
+    批量下载习题历史记录中的习题集，打包为zip
 
-async def generate_docx(practice_set_data, file_path):
-    """
-    生成DOCX文件
+    各习题集并行渲染，渲染完成一个就写入压缩包并发送一个
     
     Args:
-        practice_set_data: 习题集数据
-        file_path: 输出文件路径
+        request: 包含历史记录项ID列表和下载格式（pdf或docx）
+        current_user: 当前登录的用户
+        
+    Returns:
+        StreamingResponse: zip文件下载响应
     """
+    if request.format not in SUPPORTED_FORMATS:
+        return {"status": "error", "message": "不支持的格式，只支持pdf或docx"}
+    item_ids = list(dict.fromkeys(request.item_ids))
+    if not item_ids:
+        return {"status": "error", "message": "请选择要下载的习题集"}
+    if len(item_ids) > EXPORT_BATCH_MAX:
+        return {"status": "error", "message": f"一次最多下载{EXPORT_BATCH_MAX}套习题集"}
+
     try:
-        from docx import Document
-        from docx.shared import Pt, RGBColor
-        from docx.enum.text import WD_ALIGN_PARAGRAPH
-        
-        # 创建文档
-        doc = Document()
-        
-        # 设置中文字体
-        chinese_font = '宋体'  # 或者使用'微软雅黑', '黑体'等
-        
-        # 添加标题
-        title = doc.add_heading("软件工程练习题集", 0)
-        for run in title.runs:
-            run.font.name = chinese_font
-        
-        # 添加题目
-        for i, question in enumerate(practice_set_data.get("questions", [])):
-            # 题目标题
-            heading = doc.add_heading(f"{i+1}. {question.get('question', '未提供题目')}", 2)
-            for run in heading.runs:
-                run.font.name = chinese_font
-            
-            # 选项（如果有）
-            if question.get("options"):
-                for option in question["options"]:
-                    para = doc.add_paragraph(option)
-                    for run in para.runs:
-                        run.font.name = chinese_font
-            
-            # 参考答案
-            answer_para = doc.add_paragraph()
-            answer_run = answer_para.add_run("参考答案:")
-            answer_run.bold = True
-            answer_run.font.name = chinese_font
-            
-            answer_text = doc.add_paragraph(question.get("reference_answer", "未提供答案"))
-            for run in answer_text.runs:
-                run.font.name = chinese_font
-            
-            # 解析
-            if question.get("analysis"):
-                analysis_para = doc.add_paragraph()
-                analysis_run = analysis_para.add_run("解析:")
-                analysis_run.bold = True
-                analysis_run.font.name = chinese_font
-                
-                analysis_text = doc.add_paragraph(question.get("analysis", ""))
-                for run in analysis_text.runs:
-                    run.font.name = chinese_font
-            
-            # 添加分隔线
-            doc.add_paragraph("-----------------------------------")
-        
-        # 保存文档
-        doc.save(file_path)
-    except ImportError:
-        # 如果python-docx不可用，使用简单的文本文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write("软件工程练习题集\n\n")
-            
-            for i, question in enumerate(practice_set_data.get("questions", [])):
-                f.write(f"{i+1}. {question.get('question', '未提供题目')}\n\n")
-                
-                if question.get("options"):
-                    for j, option in enumerate(question["options"]):
-                        f.write(f"{option}\n")
-                    f.write("\n")
-                
-                f.write(f"参考答案: {question.get('reference_answer', '未提供答案')}\n\n")
-                
-                if question.get("analysis"):
-                    f.write(f"解析: {question.get('analysis', '')}\n\n")
-                
-                f.write("-----------------------------------\n\n")
+        history = {item.get('id'): item for item in practice_history.get_user_history(current_user.id)}
+    except Exception as e:
+        print(f"获取习题历史记录时出错: {e}")
+        return {"status": "error", "message": f"获取习题历史记录时出错: {str(e)}"}
+
+    missing = [item_id for item_id in item_ids if item_id not in history]
+    if missing:
+        return {"status": "error", "message": f"未找到指定的历史记录: {', '.join(missing)}"}
+
+    items = []
+    for item_id in item_ids:
+        item = history[item_id]
+        questions = item.get("questions")
+        # 历史记录中保存的可能是完整的习题集，也可能只是题目列表
+        practice_set_data = questions if isinstance(questions, dict) else {"questions": questions or []}
+        name = f"{'_'.join(item.get('topics') or [])}_{item.get('difficulty', '')}"
+        items.append((name, practice_set_data))
+
+    timestamp = int(time.time())
+    filename = quote(f"练习题集_{timestamp}.zip")
+    return StreamingResponse(
+        export_service.export_zip(items, request.format),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{filename}"}
+    )
 
 @app.get("/questionAgent/practice_history")
 async def get_practice_history(
@@ -1586,6 +1732,7 @@ async def get_practice_history_item(
 
 @app.post("/reviewAgent/generate_plan")
 async def generate_review_plan(
+    _admission: None = Depends(agent_admission("/reviewAgent/generate_plan")),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -1604,7 +1751,8 @@ async def generate_review_plan(
             review_plan_agent.generate_review_plan,
             user_id=current_user.id,
             username=current_user.username,
-            timeout=300
+            timeout=300,
+            session_key=current_user.id
         )
         
         # 记录对话
@@ -1787,22 +1935,74 @@ async def serve_spa(request: Request, full_path: str):
         print(f"读取SPA首页出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+# 练习集题库的后台补充任务（挂载的子应用不会触发startup事件，注册在外层应用上）
+@app_with_prefix.on_event("startup")
+async def start_practice_pool_builder():
+    global practice_pool_builder
+    if not PRACTICE_POOL_BUILDER:
+        return
+    
+    async def generate(combo: Dict) -> Dict:
+        return await run_in_agent_thread(
+            question_agent.generate_practice_set,
+            combo["topics"],
+            combo["num_questions"],
+            QuestionDifficulty(combo["difficulty"]),
+            QuestionType(combo["question_type"]),
+            timeout=300
+        )
+    
+    builder = PracticePoolBuilder.from_env(
+        practice_pool,
+        generate,
+        # 只在没有排队、运行中请求不多时生成，不和用户请求争抢Agent
+        lambda: agent_ready.is_set() and admission_controller.is_idle(PRACTICE_POOL_IDLE_RUNNING),
+        lock_path=os.path.join(PROJECT_PATH, "data", "practice_pool_builder.lock")
+    )
+    if builder.start():
+        practice_pool_builder = builder
+
+@app_with_prefix.on_event("shutdown")
+async def stop_practice_pool_builder():
+    if practice_pool_builder is not None:
+        await practice_pool_builder.stop()
+
+# 导出服务的工作进程在启动时创建并注册字体
+@app_with_prefix.on_event("startup")
+async def start_export_service():
+    try:
+        await export_service.start()
+    except Exception as e:
+        print(f"导出服务启动失败，将在首次导出时重试: {e}")
+
+@app_with_prefix.on_event("shutdown")
+async def stop_export_service():
+    export_service.shutdown()
+
 # 使用新的应用实例
 app = app_with_prefix
 
 if __name__ == "__main__":
-    # 启动后台线程
-    agent_thread = threading.Thread(target=background_start_agent, daemon=True)
-    agent_thread.start()
-    
-    # 等待agent初始化
-    timeout = 120  
-    start_time = time.time()
-    while not agent_ready.is_set() and time.time() - start_time < timeout:
-        time.sleep(0.5)
-    
-    if not agent_ready.is_set():
-        print("警告: Agent初始化超时，API服务可能无法正常工作")
-    
-    # 禁用uvicorn的热重载功能
-    uvicorn.run(app, host="0.0.0.0", port=8001, reload=False)
\ No newline at end of file
+    if runtime_client is not None:
+        # 远程模式：Agent由独立的运行时进程提供，API进程无状态，可以开启多个worker
+        print(f"Agent运行时地址: {', '.join(AGENT_RUNTIME_URLS)}，API worker数量: {API_WORKERS}")
+        uvicorn.run("api:app", host="0.0.0.0", port=8001, reload=False, workers=API_WORKERS)
+    else:
+        if API_WORKERS > 1:
+            print("警告: 本地模式下每个worker都会启动一整套MCP子进程，已忽略API_WORKERS，请使用AGENT_RUNTIME_MODE=remote")
+        
+        # 启动后台线程
+        agent_thread = threading.Thread(target=background_start_agent, daemon=True)
+        agent_thread.start()
+        
+        # 等待agent初始化
+        timeout = 120  
+        start_time = time.time()
+        while not agent_ready.is_set() and time.time() - start_time < timeout:
+            time.sleep(0.5)
+        
+        if not agent_ready.is_set():
+            print("警告: Agent初始化超时，API服务可能无法正常工作")
+        
+        # 禁用uvicorn的热重载功能
+        uvicorn.run(app, host="0.0.0.0", port=8001, reload=False)
\ No newline at end of file
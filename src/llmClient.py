@@ -1,4 +1,4 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import json
 from typing import List
 import os
@@ -12,6 +12,8 @@ class LLMClient():
     def __init__(self, api_key: str, base_url: str, model: str, system_prompt: str = None) -> None:
         '''初始化大模型客户端'''
         self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # 无状态的单次调用使用异步客户端，可以并发执行
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url)
         self.system_prompt = system_prompt
 
         self.messages = [
@@ -60,6 +62,29 @@ class LLMClient():
         
         return response
     
+    '''不带上下文、不使用工具的单次调用，不修改self.messages，可以安全地并发调用'''
+    async def complete(self, message: str, system_prompt: str = None, temperature: float = None) -> str:
+        messages = [
+            {
+                "role": "system",
+                "content": system_prompt or self.system_prompt
+            },
+            {
+                "role": "user",
+                "content": message
+            }
+        ]
+        kwargs = {}
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+
+        response = await self.async_client.chat.completions.create(
+            messages=messages,
+            model=self.model,
+            **kwargs
+        )
+        return response.choices[0].message.content
+
     '''增添messages'''
     async def add_content(self, role: str, content: str):
         self.messages.append(
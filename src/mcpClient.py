@@ -1,12 +1,18 @@
 import asyncio
+import importlib
 import os
 import platform
+import time
 from contextlib import AsyncExitStack
 
 from mcp.client.stdio import stdio_client, StdioServerParameters
+from mcp.shared.memory import create_connected_server_and_client_session
 from mcp import ClientSession
+from mcp.types import CallToolResult, TextContent
 
 from utils.logger import MyLogger, logging, Colors
+from utils.tool_result_cache import tool_result_cache, WRITE_TOOLS
+from utils.tool_latency import tool_latency, tool_timeouts
 
 # 创建彩色日志记录器
 logger = MyLogger(name="MCPClient", level=logging.INFO, colored=True)
@@ -14,10 +20,47 @@ logger = MyLogger(name="MCPClient", level=logging.INFO, colored=True)
 # 检测是否为Windows环境
 IS_WINDOWS = platform.system() == "Windows"
 
+# 是否在进程内加载配置了 module 的Python MCP服务器
+MCP_IN_PROCESS = os.getenv("MCP_IN_PROCESS", "true").lower() == "true"
+
+# 模块名 -> 进程内服务器的启动任务，每个模块只执行一次
+_startup_tasks: dict[str, asyncio.Task] = {}
+
+
+def load_in_process_server(module: str):
+    """
+    按 "模块路径:变量名" 加载Python MCP服务器（变量名默认为 mcp）
+
+    Returns:
+        底层的 mcp Server 对象（FastMCP 会取出其内部的 Server）
+    """
+    module_name, _, attr = module.partition(":")
+    server = getattr(importlib.import_module(module_name), attr or "mcp")
+    return getattr(server, "_mcp_server", server)
+
+
+def run_in_process_startup(module: str):
+    """在后台执行服务器模块的 on_startup 协程（如预热常驻进程），与子进程方式下服务器启动时的行为一致"""
+    module_name = module.partition(":")[0]
+    on_startup = getattr(importlib.import_module(module_name), "on_startup", None)
+    if on_startup is not None and module_name not in _startup_tasks:
+        _startup_tasks[module_name] = asyncio.create_task(on_startup())
+
+
 class MCPClient:
-    def __init__(self, command: str, args: list[str]):
+    def __init__(self, command: str, args: list[str], module: str | None = None, name: str | None = None):
+        """
+        Args:
+            command: 启动MCP服务器的命令
+            args: 命令参数
+            module: 可选，本项目中的Python MCP服务器（"模块路径:变量名"），
+                    配置后在进程内通过内存通道连接，不再启动子进程
+            name: mcp.json 中的服务器名，用于区分工具调用缓存
+        """
+        self.name = name or module or command
         self.command = command
         self.args = args
+        self.module = module if MCP_IN_PROCESS else None
         self.session: ClientSession | None = None
         self.exit_stack = AsyncExitStack()
         self._lock = asyncio.Lock()
@@ -31,6 +74,17 @@ class MCPClient:
             if self._connected:
                 return
 
+            if self.module:
+                try:
+                    await self._connect_in_process()
+                    return
+                except Exception as e:
+                    error_msg = logger.color_text(str(e), "RED")
+                    if not self.command:
+                        logger.error(f"进程内加载MCP服务器失败: {error_msg}")
+                        raise
+                    logger.warning(f"进程内加载MCP服务器 {self.module} 失败，改为启动子进程: {error_msg}")
+
             # 设置环境变量
             env = os.environ.copy()
             if IS_WINDOWS:
@@ -72,7 +126,67 @@ class MCPClient:
                     logger.error(f"Windows环境下可能需要全局安装相关{logger.color_text('NPM包', 'YELLOW')}")
                 raise
 
+    async def _connect_in_process(self):
+        """
+        在进程内连接Python MCP服务器
+
+        客户端和服务器之间通过内存通道传递消息，省去子进程启动和stdio上的序列化，
+        工具列表和调用方式与stdio连接完全一致
+        """
+        server = load_in_process_server(self.module)
+        run_in_process_startup(self.module)
+        self.session = await self.exit_stack.enter_async_context(
+            create_connected_server_and_client_session(server)
+        )
+
+        # 获取可用工具
+        response = await self.session.list_tools()
+        self.tools = response.tools
+        self.tool_names = [tool.name for tool in self.tools]
+
+        logger.success(f"MCP连接成功（进程内）: {logger.color_text(self.module, 'CYAN')}")
+        self._connected = True
+
     async def call_tool(self, tool_name: str, args: dict):
+        """
+        调用工具；幂等工具的结果按参数缓存，命中时不请求服务器
+
+        每个工具有自己的超时时间，超时后取消调用并返回 isError 的结果，
+        由模型决定换参数重试、换工具还是直接回答，不会一直占住Agent的事件循环
+        """
+        cached = tool_result_cache.get(self.name, tool_name, args)
+        if cached is not None:
+            logger.info(f"工具调用缓存命中: {logger.color_text(tool_name, 'CYAN')}")
+            return CallToolResult.model_validate(cached)
+
+        timeout = tool_timeouts.get(self.name, tool_name)
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self._call_tool(tool_name, args), timeout=timeout)
+        except asyncio.TimeoutError:
+            tool_latency.record(self.name, tool_name, (time.monotonic() - start) * 1000, "timeout")
+            logger.warning(f"工具 {logger.color_text(tool_name, 'CYAN')} 调用超时（{timeout:g}秒），已取消")
+            return CallToolResult(
+                content=[TextContent(
+                    type="text",
+                    text=f"工具 {tool_name} 调用超时（超过{timeout:g}秒），已取消。"
+                         f"可以换用更小的范围或其他参数重试、改用其他工具，或根据已有信息直接回答。",
+                )],
+                isError=True,
+            )
+        except Exception:
+            tool_latency.record(self.name, tool_name, (time.monotonic() - start) * 1000, "error")
+            raise
+        tool_latency.record(self.name, tool_name, (time.monotonic() - start) * 1000, "error" if result.isError else "ok")
+
+        if not result.isError:
+            tool_result_cache.put(self.name, tool_name, args, result.model_dump(mode="json"))
+        if tool_name in WRITE_TOOLS:
+            # 有副作用的工具可能改变了同一服务器上其他工具的结果
+            tool_result_cache.invalidate_server(self.name)
+        return result
+
+    async def _call_tool(self, tool_name: str, args: dict):
         if not self.session or not self._connected:
             raise RuntimeError("未连接到服务器")
         if tool_name not in self.tool_names:
@@ -99,6 +213,23 @@ class MCPClient:
     def getTool(self) -> list:
         return self.tools
 
+    async def ping(self):
+        """检查连接是否存活"""
+        if not self.session or not self._connected:
+            raise RuntimeError("未连接到服务器")
+        await self.session.send_ping()
+
+    async def reset(self):
+        """关闭当前连接并重置状态，之后可以重新连接（必须在建立连接的同一任务中调用）"""
+        self._connected = False
+        self.session = None
+        try:
+            await self.exit_stack.aclose()
+        except Exception as e:
+            logger.warning(f"关闭MCP连接时出错: {e}")
+        finally:
+            self.exit_stack = AsyncExitStack()
+
     async def cleanup(self):
         """清理所有资源"""
         await self.exit_stack.aclose()
@@ -0,0 +1,243 @@
+from sqlalchemy import Column, Integer, String, Float, Text, create_engine, func
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from typing import Dict, List, Optional
+import json
+import os
+import time
+
+from utils.structured_output import extract_json
+
+Base = declarative_base()
+
+
+def make_combo_key(topics: List[str], num_questions: int, difficulty: str, question_type: str) -> str:
+    """
+    生成练习集组合的键
+
+    知识点去空白、去重、排序后参与计算，"需求分析,UML" 与 "uml, 需求分析" 视为同一组合
+    """
+    normalized_topics = sorted({topic.strip().lower() for topic in topics if topic.strip()})
+    return json.dumps([normalized_topics, num_questions, difficulty, question_type], ensure_ascii=False)
+
+
+def parse_practice_set(result: Dict) -> Optional[Dict]:
+    """
+    解析 generate_practice_set 的返回结果
+
+    Returns:
+        Optional[Dict]: 题目集，结果不是有效JSON时返回None
+    """
+    if not isinstance(result, dict) or result.get("status") != "success":
+        return None
+    data = extract_json(result.get("message"), allow_partial=False)
+    return data if isinstance(data, dict) else None
+
+
+def validate_practice_set(result: Dict, num_questions: int) -> bool:
+    """检查生成的练习集是否可以放入题库：题目数量正确，每道题都有题干和参考答案"""
+    data = parse_practice_set(result)
+    if data is None:
+        return False
+    questions = data.get("questions")
+    if not isinstance(questions, list) or len(questions) != num_questions:
+        return False
+    return all(
+        isinstance(q, dict) and q.get("question") and q.get("reference_answer")
+        for q in questions
+    )
+
+
+class PooledPracticeSet(Base):
+    """预生成的练习集"""
+    __tablename__ = "practice_sets"
+
+    id = Column(Integer, primary_key=True)
+    combo_key = Column(String, index=True)
+    payload = Column(Text)
+    created_at = Column(Float)
+
+
+class PracticeDemand(Base):
+    """练习集组合的请求统计，用于决定预生成哪些组合"""
+    __tablename__ = "practice_demand"
+
+    combo_key = Column(String, primary_key=True)
+    topics = Column(Text)
+    num_questions = Column(Integer)
+    difficulty = Column(String)
+    question_type = Column(String)
+    requests = Column(Integer, default=0)
+    last_requested = Column(Float, index=True)
+
+
+class PracticePool:
+    """练习集题库：存放后台预生成的练习集，请求时直接取用"""
+
+    def __init__(self, project_path: str, max_age_days: int = 30):
+        """
+        初始化练习集题库
+
+        Args:
+            project_path: 项目路径
+            max_age_days: 预生成练习集的最长保存时间（天）
+        """
+        db_path = os.path.join(project_path, "data", "practice_pool.db")
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.engine = create_engine(f"sqlite:///{db_path}", connect_args={"timeout": 30})
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        Base.metadata.create_all(bind=self.engine)
+        self.max_age = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+
+    def record_demand(self, topics: List[str], num_questions: int, difficulty: str, question_type: str) -> str:
+        """
+        记录一次练习集请求
+
+        Returns:
+            str: 组合的键
+        """
+        combo_key = make_combo_key(topics, num_questions, difficulty, question_type)
+        db = self.SessionLocal()
+        try:
+            demand = db.get(PracticeDemand, combo_key)
+            if demand is None:
+                demand = PracticeDemand(
+                    combo_key=combo_key,
+                    topics=json.dumps(topics, ensure_ascii=False),
+                    num_questions=num_questions,
+                    difficulty=difficulty,
+                    question_type=question_type,
+                    requests=0
+                )
+                db.add(demand)
+            demand.requests += 1
+            demand.last_requested = time.time()
+            db.commit()
+        finally:
+            db.close()
+        return combo_key
+
+    def take(self, combo_key: str) -> Optional[Dict]:
+        """
+        取出一套预生成的练习集（取出后从题库中删除，每套只发给一次请求）
+
+        Returns:
+            Optional[Dict]: generate_practice_set 格式的结果，题库为空时返回None
+        """
+        db = self.SessionLocal()
+        try:
+            item = (
+                db.query(PooledPracticeSet)
+                .filter(
+                    PooledPracticeSet.combo_key == combo_key,
+                    PooledPracticeSet.created_at >= time.time() - self.max_age
+                )
+                .order_by(PooledPracticeSet.created_at)
+                .first()
+            )
+            if item is None:
+                self.misses += 1
+                return None
+            payload = item.payload
+            # 按ID删除并检查删除行数，多个进程同时取到同一套时只有一个成功
+            deleted = db.query(PooledPracticeSet).filter(PooledPracticeSet.id == item.id).delete()
+            db.commit()
+            if not deleted:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(payload)
+        finally:
+            db.close()
+
+    def add(self, combo_key: str, result: Dict) -> None:
+        """放入一套已校验的练习集"""
+        db = self.SessionLocal()
+        try:
+            db.add(PooledPracticeSet(
+                combo_key=combo_key,
+                payload=json.dumps(result, ensure_ascii=False),
+                created_at=time.time()
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def count(self, combo_key: str) -> int:
+        db = self.SessionLocal()
+        try:
+            return db.query(PooledPracticeSet).filter(PooledPracticeSet.combo_key == combo_key).count()
+        finally:
+            db.close()
+
+    def get_demand(self, combo_key: str) -> Optional[Dict]:
+        db = self.SessionLocal()
+        try:
+            demand = db.get(PracticeDemand, combo_key)
+            return self._demand_to_dict(demand) if demand is not None else None
+        finally:
+            db.close()
+
+    def popular_combos(self, limit: int = 20, window_days: int = 7) -> List[Dict]:
+        """
+        获取最近一段时间内请求最多的组合
+
+        Args:
+            limit: 返回的组合数量
+            window_days: 统计窗口（天）
+        """
+        db = self.SessionLocal()
+        try:
+            demands = (
+                db.query(PracticeDemand)
+                .filter(PracticeDemand.last_requested >= time.time() - window_days * 24 * 3600)
+                .order_by(PracticeDemand.requests.desc())
+                .limit(limit)
+                .all()
+            )
+            return [self._demand_to_dict(demand) for demand in demands]
+        finally:
+            db.close()
+
+    def cleanup(self) -> int:
+        """删除过期的练习集，返回删除的数量"""
+        db = self.SessionLocal()
+        try:
+            deleted = (
+                db.query(PooledPracticeSet)
+                .filter(PooledPracticeSet.created_at < time.time() - self.max_age)
+                .delete()
+            )
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        db = self.SessionLocal()
+        try:
+            size = db.query(func.count(PooledPracticeSet.id)).scalar()
+            combos = db.query(func.count(func.distinct(PooledPracticeSet.combo_key))).scalar()
+        finally:
+            db.close()
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "combos": combos,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    @staticmethod
+    def _demand_to_dict(demand: PracticeDemand) -> Dict:
+        return {
+            "combo_key": demand.combo_key,
+            "topics": json.loads(demand.topics),
+            "num_questions": demand.num_questions,
+            "difficulty": demand.difficulty,
+            "question_type": demand.question_type,
+            "requests": demand.requests,
+        }
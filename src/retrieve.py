@@ -63,13 +63,13 @@ class Retriever:
                 
         return chunk_text
 
-    def create_index(self, file_path: str, label: str):
-        # 创建索引
+    def create_index(self, file_path: str, label: str, files: list = None):
+        # 创建索引（files 不为空时增量添加）
         path = logger.color_text(file_path, "CYAN")
         label_str = logger.color_text(label, "YELLOW")
         logger.info(f"正在为 {path} 创建索引: {label_str}")
         
-        index = self.vector_store.create_index(file_path, label)
+        index = self.vector_store.create_index(file_path, label, files)
         logger.success(f"索引 {label_str} 创建成功")
         return index
 
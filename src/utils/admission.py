@@ -0,0 +1,283 @@
+import asyncio
+import math
+import os
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+from dotenv import load_dotenv
+
+from utils.logger import MyLogger, logging
+
+load_dotenv()
+
+logger = MyLogger(name="Admission", level=logging.INFO, colored=True)
+
+# 调度通道：交互式请求优先，批处理请求只能使用预留之外的并发额度
+INTERACTIVE = "interactive"
+BATCH = "batch"
+LANES = (INTERACTIVE, BATCH)
+
+# 各端点默认所属的通道，可以通过环境变量 AGENT_ENDPOINT_LANES 覆盖，
+# 格式为 "/chat=interactive,/paperAgent/download_and_read_paper=batch"
+DEFAULT_ENDPOINT_LANES = {
+    "/chat": INTERACTIVE,
+    "/explainAgent/explain": INTERACTIVE,
+    "/questionAgent/explain_question": INTERACTIVE,
+    "/questionAgent/quick_answer": INTERACTIVE,
+    "/umlAgent/generate_uml": INTERACTIVE,
+    "/paperAgent/search_papers": INTERACTIVE,
+    "/questionAgent/generate_practice_set": BATCH,
+    "/questionAgent/grade_practice_set": BATCH,
+    "/questionAgent/grade_class": BATCH,
+    "/paperAgent/download_and_read_paper": BATCH,
+    "/paperAgent/list_and_organize_papers": BATCH,
+    "/paperAgent/analyze_paper_for_project": BATCH,
+    "/paperAgent/recommend_learning_path": BATCH,
+    "/reviewAgent/generate_plan": BATCH,
+    "/testAgent/generate_test_cases": BATCH,
+    "/testAgent/analyze_code_for_testability": BATCH,
+    "/testAgent/evaluate_test_coverage": BATCH,
+}
+
+
+def _parse_lane_overrides(value: str) -> Dict[str, str]:
+    overrides = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        endpoint, lane = (part.strip() for part in item.split("=", 1))
+        if lane in LANES:
+            overrides[endpoint] = lane
+        else:
+            logger.warning(f"忽略未知的调度通道: {item}")
+    return overrides
+
+
+class AdmissionRejected(Exception):
+    """请求未被接纳（排队已满或排队超时）"""
+
+    def __init__(self, status_code: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Agent请求准入控制器
+
+    - 全局并发上限和每个用户的并发上限
+    - 交互式/批处理两个通道，为交互式请求预留并发额度，批处理请求排队等待
+    - 每个通道内按用户轮询出队，单个用户刷请求不会饿死其他用户
+    - 有界队列：用户队列满返回429，通道队列满或排队超时返回503，均带 Retry-After
+
+    多worker部署时，每个API进程各自持有一个控制器
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        per_user_concurrency: int = 2,
+        interactive_reserved: int = 2,
+        max_queue: int = 64,
+        max_queue_per_user: int = 4,
+        queue_timeout: float = 30,
+        endpoint_lanes: Optional[Dict[str, str]] = None,
+    ):
+        """
+        初始化准入控制器
+
+        Args:
+            max_concurrency: 全局并发上限
+            per_user_concurrency: 每个用户的并发上限
+            interactive_reserved: 为交互式通道预留的并发数，批处理通道最多使用 max_concurrency - interactive_reserved
+            max_queue: 每个通道的排队上限
+            max_queue_per_user: 每个用户的排队上限
+            queue_timeout: 最长排队时间（秒）
+            endpoint_lanes: 端点到通道的映射
+        """
+        self.max_concurrency = max_concurrency
+        self.per_user_concurrency = per_user_concurrency
+        self.interactive_reserved = min(interactive_reserved, max_concurrency - 1)
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self.endpoint_lanes = dict(DEFAULT_ENDPOINT_LANES)
+        self.endpoint_lanes.update(endpoint_lanes or {})
+
+        self.running = 0
+        self.running_by_user: Counter = Counter()
+        self.running_by_lane: Counter = Counter()
+        # 通道 -> 用户 -> 等待中的Future，OrderedDict的顺序即轮询顺序
+        self.queues: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            lane: OrderedDict() for lane in LANES
+        }
+
+        # 平均占用时长（指数移动平均），用于估算 Retry-After
+        self.avg_service_time = 5.0
+        self.counters: Counter = Counter()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_concurrency=int(os.getenv("AGENT_MAX_CONCURRENCY", "8")),
+            per_user_concurrency=int(os.getenv("AGENT_MAX_CONCURRENCY_PER_USER", "2")),
+            interactive_reserved=int(os.getenv("AGENT_INTERACTIVE_RESERVED", "2")),
+            max_queue=int(os.getenv("AGENT_MAX_QUEUE", "64")),
+            max_queue_per_user=int(os.getenv("AGENT_MAX_QUEUE_PER_USER", "4")),
+            queue_timeout=float(os.getenv("AGENT_QUEUE_TIMEOUT", "30")),
+            endpoint_lanes=_parse_lane_overrides(os.getenv("AGENT_ENDPOINT_LANES", "")),
+        )
+
+    def is_idle(self, max_running: int = 0) -> bool:
+        """没有排队请求且运行中的请求不超过 max_running 时视为空闲"""
+        return self.running <= max_running and not any(self.queues[lane] for lane in LANES)
+
+    def lane_for(self, endpoint: str) -> str:
+        """获取端点所属的通道，未配置的端点视为交互式"""
+        return self.endpoint_lanes.get(endpoint, INTERACTIVE)
+
+    def _queue_len(self, lane: str) -> int:
+        return sum(len(waiters) for waiters in self.queues[lane].values())
+
+    def _can_run(self, user: str, lane: str) -> bool:
+        if self.running >= self.max_concurrency:
+            return False
+        if self.running_by_user[user] >= self.per_user_concurrency:
+            return False
+        if lane == BATCH and self.running_by_lane[BATCH] >= self.max_concurrency - self.interactive_reserved:
+            return False
+        return True
+
+    def _grant(self, user: str, lane: str) -> None:
+        self.running += 1
+        self.running_by_user[user] += 1
+        self.running_by_lane[lane] += 1
+
+    def _retry_after(self, lane: str) -> int:
+        """按排队长度和平均占用时长估算多久后重试"""
+        waiting = self._queue_len(lane) + 1
+        return max(1, math.ceil(waiting * self.avg_service_time / self.max_concurrency))
+
+    def _dispatch(self) -> None:
+        """唤醒可以运行的等待者：先交互式通道，通道内按用户轮询"""
+        for lane in LANES:
+            queue = self.queues[lane]
+            progressed = True
+            while progressed and queue:
+                progressed = False
+                for user in list(queue.keys()):
+                    if not self._can_run(user, lane):
+                        continue
+                    waiters = queue[user]
+                    waiter = waiters.popleft()
+                    if waiters:
+                        # 该用户排到轮询队尾
+                        queue.move_to_end(user)
+                    else:
+                        del queue[user]
+                    if waiter.done():
+                        progressed = True
+                        break
+                    self._grant(user, lane)
+                    waiter.set_result(True)
+                    progressed = True
+                    break
+
+    def _remove_waiter(self, user: str, lane: str, waiter: asyncio.Future) -> None:
+        waiters = self.queues[lane].get(user)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
+        if not waiters:
+            del self.queues[lane][user]
+
+    async def acquire(self, user: Any, lane: str = INTERACTIVE) -> None:
+        """
+        申请执行额度
+
+        Raises:
+            AdmissionRejected: 排队已满或排队超时
+        """
+        user = str(user)
+        queue = self.queues[lane]
+
+        if not queue and self._can_run(user, lane):
+            self._grant(user, lane)
+            self.counters["admitted"] += 1
+            return
+
+        if len(queue.get(user, ())) >= self.max_queue_per_user:
+            self.counters["rejected_user_queue_full"] += 1
+            raise AdmissionRejected(429, "您的请求过多，请等待之前的请求完成后再试", self._retry_after(lane))
+        if self._queue_len(lane) >= self.max_queue:
+            self.counters["rejected_queue_full"] += 1
+            raise AdmissionRejected(503, "服务繁忙，请稍后再试", self._retry_after(lane))
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.setdefault(user, deque()).append(waiter)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # 超时的同时被唤醒，照常执行
+                self.counters["admitted"] += 1
+                return
+            waiter.cancel()
+            self._remove_waiter(user, lane, waiter)
+            self.counters["rejected_timeout"] += 1
+            raise AdmissionRejected(503, "排队超时，服务繁忙，请稍后再试", self._retry_after(lane))
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已获得额度但请求被取消，归还额度
+                self.release(user, lane)
+            else:
+                waiter.cancel()
+                self._remove_waiter(user, lane, waiter)
+            raise
+
+        self.counters["admitted"] += 1
+        self.counters["queued"] += 1
+        self.counters["queue_wait_ms"] += int((time.monotonic() - start) * 1000)
+
+    def release(self, user: Any, lane: str = INTERACTIVE, service_time: Optional[float] = None) -> None:
+        """归还执行额度并唤醒等待者"""
+        user = str(user)
+        self.running -= 1
+        self.running_by_user[user] -= 1
+        if self.running_by_user[user] <= 0:
+            del self.running_by_user[user]
+        self.running_by_lane[lane] -= 1
+        if service_time is not None:
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user: Any, lane: str = INTERACTIVE):
+        """在执行额度内运行一段代码"""
+        await self.acquire(user, lane)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(user, lane, time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        """实时队列和并发指标"""
+        return {
+            "running": self.running,
+            "max_concurrency": self.max_concurrency,
+            "running_by_lane": {lane: self.running_by_lane[lane] for lane in LANES},
+            "queue_depth": {lane: self._queue_len(lane) for lane in LANES},
+            "queued_users": {lane: len(self.queues[lane]) for lane in LANES},
+            "active_users": len(self.running_by_user),
+            "avg_service_time": round(self.avg_service_time, 2),
+            "counters": dict(self.counters),
+        }
@@ -0,0 +1,61 @@
+import asyncio
+
+from utils.logger import MyLogger, logging
+
+logger = MyLogger(name="Disconnect", level=logging.INFO, colored=True)
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    客户端断开连接时取消请求处理的ASGI中间件
+
+    Starlette不会在客户端断开时取消普通（非流式）请求的处理协程，
+    Agent调用会继续占用事件循环直到超时。该中间件代理 receive 通道，
+    一旦收到 http.disconnect 就取消请求处理任务，取消会传播到
+    run_in_agent_thread 等待的Agent任务。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # 队列容量为1：请求体没被处理函数读走之前不再读取下一块，保留上传的背压，
+        # 大文件不会在 save_uploads 读取之前被整个读进内存。请求体读完后 receive 只会返回断开消息
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        disconnected = asyncio.Event()
+
+        async def pump():
+            """转发客户端消息，直到连接断开"""
+            while True:
+                message = await receive()
+                await queue.put(message)
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        pump_task = asyncio.create_task(pump())
+        disconnect_task = asyncio.create_task(disconnected.wait())
+        app_task = asyncio.create_task(self.app(scope, queue.get, send))
+
+        try:
+            await asyncio.wait({app_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+
+            if not app_task.done():
+                logger.warning(f"客户端已断开连接，取消请求: {scope.get('path', '')}")
+                app_task.cancel()
+                try:
+                    await app_task
+                except asyncio.CancelledError:
+                    pass
+                return
+
+            # 处理正常完成时，抛出处理过程中的异常
+            app_task.result()
+        finally:
+            for task in (pump_task, disconnect_task, app_task):
+                if not task.done():
+                    task.cancel()
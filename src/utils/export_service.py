@@ -0,0 +1,545 @@
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+import types
+import uuid
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from utils.logger import MyLogger, logging
+from utils.single_flight import SingleFlight
+
+load_dotenv()
+
+logger = MyLogger(name="ExportService", level=logging.INFO, colored=True)
+
+SUPPORTED_FORMATS = ("pdf", "docx")
+
+# 渲染逻辑变化时修改版本号，使旧的缓存文件失效
+RENDER_VERSION = "1"
+
+# 导出文件名前缀，清理时只处理带这些前缀的文件（同时覆盖旧版本的 practice_set_ 文件）
+EXPORT_PREFIXES = ("practice_",)
+
+# 工作进程中注册好的PDF字体
+_pdf_font_name: Optional[str] = None
+
+
+def _init_worker():
+    """工作进程初始化：注册一次中文字体"""
+    global _pdf_font_name
+    try:
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+    except ImportError:
+        # 初始化函数出错会导致整个进程池不可用，缺少reportlab时留到导出PDF时再报错
+        _pdf_font_name = 'Helvetica'
+        return
+
+    try:
+        # 尝试注册思源黑体（Source Han Sans）
+        pdfmetrics.registerFont(TTFont('SourceHanSans', 'SourceHanSans-Regular.ttf'))
+        _pdf_font_name = 'SourceHanSans'
+    except Exception:
+        try:
+            # 尝试注册宋体
+            pdfmetrics.registerFont(TTFont('SimSun', 'SimSun.ttf'))
+            _pdf_font_name = 'SimSun'
+        except Exception:
+            # 如果都失败，使用默认字体
+            _pdf_font_name = 'Helvetica'
+            print("警告：未能加载中文字体，文档可能无法正确显示中文")
+
+
+def _warmup() -> int:
+    return os.getpid()
+
+
+_main_swap_lock = threading.Lock()
+
+
+class _WorkerProcess(multiprocessing.get_context("spawn").Process):
+    """
+    不重新导入主模块的spawn工作进程
+
+    spawn（以及forkserver）启动的子进程会按主模块的路径把 api.py 重新导入一遍，
+    api.py 导入时会创建全部Agent、检索器、数据库连接池和缓存。创建进程时临时换上
+    一个空的主模块，子进程只导入反序列化任务所需的模块（即本模块和渲染依赖）
+    """
+
+    def start(self):
+        with _main_swap_lock:
+            main_module = sys.modules["__main__"]
+            sys.modules["__main__"] = types.ModuleType("__main__")
+            try:
+                super().start()
+            finally:
+                sys.modules["__main__"] = main_module
+
+
+class _WorkerContext(type(multiprocessing.get_context("spawn"))):
+    Process = _WorkerProcess
+
+
+def render_pdf(practice_set_data: Dict, file_path: str):
+    """
+    生成PDF文件
+
+    Args:
+        practice_set_data: 习题集数据
+        file_path: 输出文件路径
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+    if _pdf_font_name is None:
+        _init_worker()
+    font_name = _pdf_font_name
+
+    # 创建自定义样式
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(
+        name='ChineseTitle',
+        fontName=font_name,
+        fontSize=18,
+        leading=22,
+        alignment=1  # 居中
+    ))
+    styles.add(ParagraphStyle(
+        name='ChineseHeading',
+        fontName=font_name,
+        fontSize=14,
+        leading=18
+    ))
+    styles.add(ParagraphStyle(
+        name='ChineseNormal',
+        fontName=font_name,
+        fontSize=10,
+        leading=14
+    ))
+
+    # 创建PDF文档
+    doc = SimpleDocTemplate(
+        file_path,
+        pagesize=A4,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=72,
+        bottomMargin=72
+    )
+
+    # 创建内容列表
+    content = []
+
+    # 添加标题
+    title = Paragraph("软件工程练习题集", styles['ChineseTitle'])
+    content.append(title)
+    content.append(Spacer(1, 12))
+
+    # 添加题目
+    for i, question in enumerate(practice_set_data.get("questions", [])):
+        # 题目标题
+        question_title = Paragraph(f"{i+1}. {question.get('question', '未提供题目')}", styles['ChineseHeading'])
+        content.append(question_title)
+        content.append(Spacer(1, 6))
+
+        # 选项（如果有）
+        if question.get("options"):
+            for j, option in enumerate(question["options"]):
+                option_text = Paragraph(f"{option}", styles['ChineseNormal'])
+                content.append(option_text)
+            content.append(Spacer(1, 6))
+
+        # 参考答案
+        answer_title = Paragraph("参考答案:", styles['ChineseHeading'])
+        content.append(answer_title)
+        answer_text = Paragraph(question.get("reference_answer", "未提供答案"), styles['ChineseNormal'])
+        content.append(answer_text)
+        content.append(Spacer(1, 6))
+
+        # 解析
+        if question.get("analysis"):
+            analysis_title = Paragraph("解析:", styles['ChineseHeading'])
+            content.append(analysis_title)
+            analysis_text = Paragraph(question.get("analysis", ""), styles['ChineseNormal'])
+            content.append(analysis_text)
+
+        content.append(Spacer(1, 12))
+
+    # 构建PDF
+    doc.build(content)
+
+
+def render_docx(practice_set_data: Dict, file_path: str):
+    """
+    生成DOCX文件
+
+    Args:
+        practice_set_data: 习题集数据
+        file_path: 输出文件路径
+    """
+    try:
+        from docx import Document
+
+        # 创建文档
+        doc = Document()
+
+        # 设置中文字体
+        chinese_font = '宋体'  # 或者使用'微软雅黑', '黑体'等
+
+        # 添加标题
+        title = doc.add_heading("软件工程练习题集", 0)
+        for run in title.runs:
+            run.font.name = chinese_font
+
+        # 添加题目
+        for i, question in enumerate(practice_set_data.get("questions", [])):
+            # 题目标题
+            heading = doc.add_heading(f"{i+1}. {question.get('question', '未提供题目')}", 2)
+            for run in heading.runs:
+                run.font.name = chinese_font
+
+            # 选项（如果有）
+            if question.get("options"):
+                for option in question["options"]:
+                    para = doc.add_paragraph(option)
+                    for run in para.runs:
+                        run.font.name = chinese_font
+
+            # 参考答案
+            answer_para = doc.add_paragraph()
+            answer_run = answer_para.add_run("参考答案:")
+            answer_run.bold = True
+            answer_run.font.name = chinese_font
+
+            answer_text = doc.add_paragraph(question.get("reference_answer", "未提供答案"))
+            for run in answer_text.runs:
+                run.font.name = chinese_font
+
+            # 解析
+            if question.get("analysis"):
+                analysis_para = doc.add_paragraph()
+                analysis_run = analysis_para.add_run("解析:")
+                analysis_run.bold = True
+                analysis_run.font.name = chinese_font
+
+                analysis_text = doc.add_paragraph(question.get("analysis", ""))
+                for run in analysis_text.runs:
+                    run.font.name = chinese_font
+
+            # 添加分隔线
+            doc.add_paragraph("-----------------------------------")
+
+        # 保存文档
+        doc.save(file_path)
+    except ImportError:
+        # 如果python-docx不可用，使用简单的文本文件
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write("软件工程练习题集\n\n")
+
+            for i, question in enumerate(practice_set_data.get("questions", [])):
+                f.write(f"{i+1}. {question.get('question', '未提供题目')}\n\n")
+
+                if question.get("options"):
+                    for j, option in enumerate(question["options"]):
+                        f.write(f"{option}\n")
+                    f.write("\n")
+
+                f.write(f"参考答案: {question.get('reference_answer', '未提供答案')}\n\n")
+
+                if question.get("analysis"):
+                    f.write(f"解析: {question.get('analysis', '')}\n\n")
+
+                f.write("-----------------------------------\n\n")
+
+
+_RENDERERS = {
+    "pdf": render_pdf,
+    "docx": render_docx,
+}
+
+
+def _render(practice_set_data: Dict, format: str, file_path: str) -> str:
+    """在工作进程中渲染到临时文件，完成后再替换为正式文件，避免读到写了一半的文件"""
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        _RENDERERS[format](practice_set_data, tmp_path)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return file_path
+
+
+class _StreamBuffer:
+    """
+    只能追加写入的缓冲区
+
+    不支持seek，zipfile会改为在每个文件数据之后写入数据描述符，
+    已经写入的字节可以随时取走发送，不需要在内存里保留整个压缩包
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _safe_filename(name: str) -> str:
+    name = re.sub(r'[\\/:*?"<>|\s]+', "_", name).strip("_")
+    return name[:60] or "练习题集"
+
+
+def _write_zip_entry(archive: zipfile.ZipFile, arcname: str, file_path: str):
+    with open(file_path, "rb") as src, archive.open(arcname, "w") as dest:
+        while True:
+            chunk = src.read(64 * 1024)
+            if not chunk:
+                break
+            dest.write(chunk)
+
+
+class ExportService:
+    """
+    习题集导出服务
+
+    - 在工作进程池中渲染PDF/DOCX，不阻塞事件循环；字体在工作进程启动时注册一次
+    - 按 习题集内容+格式 的哈希缓存导出文件，相同内容直接返回已有文件
+    - 相同内容的并发导出只渲染一次
+    - 按最长保存时间和总大小（最近最少使用优先删除）清理导出目录
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        max_workers: int = 2,
+        max_age_days: float = 7,
+        max_total_mb: float = 500,
+        cleanup_interval: float = 600,
+    ):
+        """
+        初始化导出服务
+
+        Args:
+            output_dir: 导出目录（static/docs）
+            max_workers: 工作进程数量
+            max_age_days: 导出文件最长保存时间（天），按最近一次使用计算
+            max_total_mb: 导出文件总大小上限（MB）
+            cleanup_interval: 两次清理之间的最小间隔（秒）
+        """
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.max_age = max_age_days * 24 * 3600
+        self.max_total_bytes = max_total_mb * 1024 * 1024
+        self.cleanup_interval = cleanup_interval
+        os.makedirs(output_dir, exist_ok=True)
+
+        self._executor: Optional[Executor] = None
+        self._single_flight = SingleFlight()
+        self._last_cleanup = 0.0
+        self.stats_counters = {"cache_hits": 0, "rendered": 0, "removed": 0}
+
+    @classmethod
+    def from_env(cls, output_dir: str) -> "ExportService":
+        return cls(
+            output_dir,
+            max_workers=int(os.getenv("EXPORT_WORKERS", "2")),
+            max_age_days=float(os.getenv("EXPORT_MAX_AGE_DAYS", "7")),
+            max_total_mb=float(os.getenv("EXPORT_MAX_TOTAL_MB", "500")),
+        )
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if sys.platform == "win32":
+                # Windows只能以spawn方式启动子进程，会重新导入api模块，改用线程池
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+            else:
+                # 不使用fork：此时进程中已有Agent线程、MCP管道和日志锁，fork出的子进程可能卡在继承来的锁上。
+                # 以spawn方式启动但不重新导入主模块，见 _WorkerProcess
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=_WorkerContext(),
+                    initializer=_init_worker
+                )
+        return self._executor
+
+    async def start(self):
+        """启动工作进程（同时完成字体注册）"""
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(
+            loop.run_in_executor(self.executor, _warmup) for _ in range(self.max_workers)
+        ))
+        logger.info(f"导出服务已启动，工作进程: {sorted(set(pids))}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @staticmethod
+    def content_hash(practice_set_data: Dict, format: str) -> str:
+        canonical = json.dumps(practice_set_data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(f"{RENDER_VERSION}:{format}:{canonical}".encode("utf-8")).hexdigest()
+
+    def path_for(self, practice_set_data: Dict, format: str) -> str:
+        return os.path.join(self.output_dir, f"practice_{self.content_hash(practice_set_data, format)[:24]}.{format}")
+
+    async def export(self, practice_set_data: Dict, format: str) -> str:
+        """
+        导出习题集
+
+        Args:
+            practice_set_data: 习题集数据
+            format: pdf 或 docx
+
+        Returns:
+            str: 导出文件路径
+        """
+        if format not in SUPPORTED_FORMATS:
+            raise ValueError(f"不支持的格式: {format}，只支持pdf或docx")
+
+        file_path = self.path_for(practice_set_data, format)
+        if os.path.exists(file_path):
+            # 更新修改时间，清理时按最近使用时间淘汰
+            os.utime(file_path)
+            self.stats_counters["cache_hits"] += 1
+            return file_path
+
+        async def render() -> str:
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(self.executor, _render, practice_set_data, format, file_path)
+            except BrokenProcessPool:
+                # 工作进程异常退出（如内存不足被杀），重建进程池后重试一次
+                logger.warning("导出工作进程异常退出，重建进程池")
+                self.shutdown()
+                result = await loop.run_in_executor(self.executor, _render, practice_set_data, format, file_path)
+            self.stats_counters["rendered"] += 1
+            return result
+
+        result = await self._single_flight.do(file_path, render)
+        self._maybe_cleanup()
+        return result
+
+    async def export_zip(
+        self,
+        items: List[Tuple[str, Dict]],
+        format: str,
+    ) -> AsyncIterator[bytes]:
+        """
+        批量导出并打包为zip，边渲染边输出
+
+        所有习题集同时提交渲染，哪个先完成就先写入压缩包并发送，
+        内存中最多只保留一个文件的压缩数据。导出失败的习题集记录在压缩包末尾的说明文件中。
+
+        Args:
+            items: (文件名, 习题集数据) 列表
+            format: pdf 或 docx
+
+        Yields:
+            bytes: zip数据块
+        """
+        if format not in SUPPORTED_FORMATS:
+            raise ValueError(f"不支持的格式: {format}，只支持pdf或docx")
+
+        async def export_one(index: int, name: str, data: Dict):
+            try:
+                return index, name, await self.export(data, format), None
+            except Exception as e:
+                return index, name, None, e
+
+        tasks = [
+            asyncio.create_task(export_one(index, name, data))
+            for index, (name, data) in enumerate(items, start=1)
+        ]
+        buffer = _StreamBuffer()
+        archive = zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED)
+        failures = []
+        try:
+            for future in asyncio.as_completed(tasks):
+                index, name, file_path, error = await future
+                if error is not None:
+                    logger.error(f"批量导出 {name} 失败: {error}")
+                    failures.append(f"{index}. {name}: {error}")
+                    continue
+                arcname = f"{index:02d}_{_safe_filename(name)}.{format}"
+                await asyncio.to_thread(_write_zip_entry, archive, arcname, file_path)
+                yield buffer.take()
+
+            if failures:
+                archive.writestr("导出失败.txt", "以下习题集导出失败：\n" + "\n".join(failures))
+            archive.close()
+            yield buffer.take()
+        finally:
+            # 客户端断开时取消尚未完成的渲染
+            for task in tasks:
+                task.cancel()
+
+    def _maybe_cleanup(self):
+        now = time.time()
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = now
+        asyncio.get_running_loop().run_in_executor(None, self.cleanup)
+
+    def cleanup(self) -> int:
+        """
+        清理导出目录：删除超过最长保存时间的文件，总大小超限时按最近使用时间从旧到新删除
+
+        Returns:
+            int: 删除的文件数量
+        """
+        now = time.time()
+        files = []
+        for name in os.listdir(self.output_dir):
+            if not name.startswith(EXPORT_PREFIXES) or name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.output_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age and total <= self.max_total_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+                total -= size
+            except OSError:
+                pass
+
+        if removed:
+            self.stats_counters["removed"] += removed
+            logger.info(f"已清理 {removed} 个导出文件")
+        return removed
+
+    def stats(self) -> Dict:
+        return dict(self.stats_counters)
@@ -0,0 +1,489 @@
+import asyncio
+import re
+import statistics
+import unicodedata
+from collections import Counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from utils.logger import MyLogger, logging
+from utils.structured_output import AnswerGrade, parse_structured
+
+logger = MyLogger(name="Grading", level=logging.INFO, colored=True)
+
+TRUE_WORDS = {"对", "正确", "是", "√", "✓", "t", "true", "yes", "y", "1"}
+FALSE_WORDS = {"错", "错误", "否", "×", "✗", "x", "f", "false", "no", "n", "0"}
+
+# 填空题多个空之间的分隔符
+BLANK_SEPARATORS = r"[;；|、,，\n]+"
+
+
+def _normalize_text(value: Any) -> str:
+    text = unicodedata.normalize("NFKC", str(value if value is not None else "")).lower()
+    return re.sub(r"[\s。.,，;；:：!！?？\"'“”‘’()（）]+", "", text)
+
+
+def _to_number(value: Any, default: float) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"\d+(?:\.\d+)?", str(value or ""))
+    return float(match.group()) if match else default
+
+
+def _round_score(value: float) -> float:
+    value = round(value, 1)
+    return int(value) if float(value).is_integer() else value
+
+
+def index_answers(answers: Any, questions: List[Dict], key: str) -> Dict[str, Any]:
+    """
+    把答案集整理为 题目id -> 答案
+
+    兼容以下格式：
+    - {"1": "A", "2": "..."}
+    - [{"id": 1, "answer": "A"}, ...]（答案字段也可以叫 student_answer / reference_answer）
+    - ["A", "..."]（按题目顺序）
+    """
+    if isinstance(answers, dict):
+        return {str(k): v for k, v in answers.items()}
+
+    indexed = {}
+    for position, item in enumerate(answers or []):
+        if isinstance(item, dict):
+            question_id = item.get("id", item.get("question_id"))
+            if question_id is None and position < len(questions):
+                question_id = questions[position].get("id", position + 1)
+            for field in ("answer", key):
+                if field in item:
+                    indexed[str(question_id)] = item[field]
+                    break
+        elif position < len(questions):
+            indexed[str(questions[position].get("id", position + 1))] = item
+    return indexed
+
+
+def _option_letters(answer: Any, options: List[str]) -> Optional[frozenset]:
+    """把选择题答案解析为选项字母集合，无法解析时返回None"""
+    if isinstance(answer, list):
+        answer = ",".join(str(a) for a in answer)
+    text = unicodedata.normalize("NFKC", str(answer or "")).strip()
+    if not text:
+        return frozenset()
+
+    # "A"、"AC"、"A,C"、"A. 瀑布模型"
+    match = re.match(r"^\s*([A-Ha-h](?:\s*[,，、/和]?\s*[A-Ha-h])*)(?:\s*[.．、:：)）]|\s*$)", text)
+    if match:
+        return frozenset(re.findall(r"[A-Ha-h]", match.group(1).upper()))
+
+    # 直接写了选项内容
+    normalized = _normalize_text(text)
+    for index, option in enumerate(options or []):
+        option_text = re.sub(r"^\s*[A-Ha-h]\s*[.．、:：)）]\s*", "", str(option))
+        if normalized and normalized == _normalize_text(option_text):
+            return frozenset(chr(ord("A") + index))
+    return None
+
+
+def _truth_value(answer: Any) -> Optional[bool]:
+    if isinstance(answer, bool):
+        return answer
+    text = _normalize_text(answer)
+    if text in TRUE_WORDS:
+        return True
+    if text in FALSE_WORDS:
+        return False
+    return None
+
+
+def _blanks(answer: Any) -> List[str]:
+    if isinstance(answer, list):
+        return [_normalize_text(a) for a in answer]
+    return [_normalize_text(part) for part in re.split(BLANK_SEPARATORS, str(answer or "")) if part.strip()]
+
+
+class ObjectiveChecker:
+    """
+    客观题判分器
+
+    参考答案只解析一次，批改全班答案时每个学生只需解析自己的答案
+    """
+
+    def __init__(self, question: Dict, reference_answer: Any):
+        self.question_type = question.get("type", "")
+        self.options = question.get("options") or []
+        self.reference_answer = reference_answer
+
+        if self.question_type == "选择题":
+            self.expected = _option_letters(reference_answer, self.options)
+        elif self.question_type == "判断题":
+            self.expected = _truth_value(reference_answer)
+        elif self.question_type == "填空题":
+            self.expected = (_normalize_text(reference_answer), _blanks(reference_answer))
+        else:
+            self.expected = None
+
+    @property
+    def applicable(self) -> bool:
+        """该题是否可能在本地批改"""
+        return self.expected is not None
+
+    def check(self, student_answer: Any) -> Optional[bool]:
+        """判断对错，不能在本地确定时（如填空题答案与参考答案不完全一致）返回None"""
+        if self.expected is None:
+            return None
+        if self.question_type == "选择题":
+            actual = _option_letters(student_answer, self.options)
+            return None if actual is None else actual == self.expected
+        if self.question_type == "判断题":
+            actual = _truth_value(student_answer)
+            if actual is None:
+                # 未作答直接判错，无法识别的答案（如"基本正确，但……"）交给LLM批改
+                return False if not str(student_answer or "").strip() else None
+            return actual == self.expected
+        # 填空题
+        normalized = _normalize_text(student_answer)
+        if normalized == self.expected[0] or _blanks(student_answer) == self.expected[1]:
+            return True
+        return False if not normalized else None
+
+    def grade(self, student_answer: Any, max_score: float) -> Optional[Dict]:
+        correct = self.check(student_answer)
+        if correct is None:
+            return None
+
+        if correct:
+            point = "回答正确"
+        elif _normalize_text(student_answer):
+            point = f"回答错误，参考答案为：{self.reference_answer}"
+        else:
+            point = f"未作答，参考答案为：{self.reference_answer}"
+        return {
+            "score": max_score if correct else 0,
+            "point": point,
+            "correct": correct,
+            "graded_by": "rule",
+        }
+
+
+def grade_objective(question: Dict, student_answer: Any, reference_answer: Any, max_score: float) -> Optional[Dict]:
+    """
+    本地批改客观题
+
+    Returns:
+        Optional[Dict]: 批改结果，不能在本地确定对错时返回None
+    """
+    return ObjectiveChecker(question, reference_answer).grade(student_answer, max_score)
+
+
+class GradingItem:
+    """准备好的一道题：题目id、分值、参考答案和客观题判分器"""
+
+    def __init__(self, question: Dict, position: int, reference_answer: Any, max_score: float):
+        self.question = question
+        self.id = str(question.get("id", position + 1))
+        self.reference_answer = reference_answer
+        self.max_score = max_score
+        self.checker = ObjectiveChecker(question, reference_answer)
+
+
+def prepare_items(practice_set: Any, reference_answers: Any) -> List[GradingItem]:
+    """解析题目集和参考答案集"""
+    questions = practice_set.get("questions", []) if isinstance(practice_set, dict) else list(practice_set)
+    references = index_answers(reference_answers, questions, "reference_answer")
+    default_score = 100 / len(questions) if questions else 0
+    items = []
+    for position, question in enumerate(questions):
+        question_id = str(question.get("id", position + 1))
+        items.append(GradingItem(
+            question,
+            position,
+            references.get(question_id, question.get("reference_answer", "")),
+            _to_number(question.get("value"), default_score)
+        ))
+    return items
+
+
+class GradingEngine:
+    """
+    练习题集批改引擎
+
+    - 选择题、判断题和与参考答案完全一致的填空题在本地批改
+    - 其余题目每题单独调用一次模型，并发执行，单题失败不影响其他题目
+    - 总分、得分点、评语按固定规则汇总
+    """
+
+    def __init__(self, complete: Callable[[str], Awaitable[str]], concurrency: int = 4, retries: int = 1):
+        """
+        初始化批改引擎
+
+        Args:
+            complete: 无状态的模型调用函数，参数为提示词，返回模型输出
+            concurrency: 同时批改的主观题数量
+            retries: 单题批改失败后的重试次数
+        """
+        self.complete = complete
+        self.concurrency = concurrency
+        self.retries = retries
+
+    async def grade_subjective(self, question: Dict, student_answer: Any, reference_answer: Any, max_score: float) -> Dict:
+        """使用模型批改一道主观题"""
+        if not _normalize_text(student_answer):
+            return {"score": 0, "point": "未作答", "correct": False, "graded_by": "rule"}
+
+        prompt = f"""请对以下软件工程{question.get('type', '简答题')}的答案进行批改：
+
+        题目：
+        {question.get('question', '')}
+
+        学生答案：
+        {student_answer}
+
+        参考答案：
+        {reference_answer}
+
+        要求：
+        1. 给出0-{_round_score(max_score)}分的评分
+        2. 说明得分点和失分点
+        3. 提供具体的改进建议
+        4. 指出答案中的亮点（如果有）
+
+        你只需要返回一个json字符串,包含以下内容，不要输出多余的前后缀：
+        {{
+            "score": 分数,
+            "scoring_points": [
+                {{"point": "得分点1", "score": 得分}},
+                {{"point": "失分点1", "deduction": 扣分}}
+            ],
+            "comments": "评价",
+            "suggestions": ["改进建议1", ...],
+            "highlights": ["亮点1", ...]
+        }}"""
+
+        last_error = None
+        for _ in range(self.retries + 1):
+            try:
+                data = await parse_structured(await self.complete(prompt), AnswerGrade, repair=self.complete)
+                score = min(max(_to_number(data["score"], 0), 0), max_score)
+                points = [
+                    p.get("point", "") for p in data.get("scoring_points", [])
+                    if isinstance(p, dict) and p.get("point")
+                ]
+                return {
+                    "score": _round_score(score),
+                    "point": "；".join(points) or data.get("comments", ""),
+                    "correct": score >= max_score,
+                    "graded_by": "llm",
+                    "comments": data.get("comments", ""),
+                    "suggestions": data["suggestions"],
+                    "highlights": data["highlights"],
+                }
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+
+        logger.warning(f"批改题目 {question.get('id')} 失败: {last_error}")
+        return {
+            "score": 0,
+            "point": "自动批改失败，需要人工复核",
+            "correct": False,
+            "graded_by": "llm",
+            "needs_review": True,
+        }
+
+    async def grade(self, practice_set: List[Dict], student_answers: Any, reference_answers: Any) -> Dict:
+        """
+        批改整套练习题
+
+        Returns:
+            Dict: {"score", "total_points", "scoring_points", "comments", "suggestions", "highlights"}
+        """
+        items = prepare_items(practice_set, reference_answers)
+        students = index_answers(student_answers, [item.question for item in items], "student_answer")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def grade_subjective(item: GradingItem, student: Any) -> Dict:
+            async with semaphore:
+                return await self.grade_subjective(item.question, student, item.reference_answer, item.max_score)
+
+        results = await asyncio.gather(*(
+            self._grade_item(item, students.get(item.id, ""), grade_subjective) for item in items
+        ))
+        return self.aggregate([item.question for item in items], results)
+
+    @staticmethod
+    async def _grade_item(item: GradingItem, student: Any, grade_subjective: Callable[[GradingItem, Any], Awaitable[Dict]]) -> Dict:
+        """批改一道题：能在本地批改的直接批改，否则交给 grade_subjective"""
+        result = item.checker.grade(student, item.max_score)
+        subjective = result is None
+        if subjective:
+            result = dict(await grade_subjective(item, student))
+        result.update({"id": item.id, "max_score": _round_score(item.max_score), "subjective": subjective})
+        return result
+
+    @staticmethod
+    def aggregate(questions: List[Dict], results: List[Dict]) -> Dict:
+        """按固定规则汇总各题的批改结果"""
+        score = sum(r["score"] for r in results)
+        total = sum(r["max_score"] for r in results)
+
+        scoring_points = [
+            {
+                "id": r["id"],
+                "point": r["point"],
+                "score": _round_score(r["score"]),
+                "deduction": _round_score(r["max_score"] - r["score"]),
+            }
+            for r in results
+        ]
+
+        suggestions, highlights = [], []
+        weak_topics = []
+        for question, r in zip(questions, results):
+            for suggestion in r.get("suggestions", []):
+                if suggestion not in suggestions:
+                    suggestions.append(suggestion)
+            for highlight in r.get("highlights", []):
+                if highlight not in highlights:
+                    highlights.append(highlight)
+            if not r["correct"]:
+                for topic in question.get("topics", []) or []:
+                    if topic not in weak_topics:
+                        weak_topics.append(topic)
+        if weak_topics:
+            suggestions.insert(0, f"建议复习以下知识点：{'、'.join(weak_topics)}")
+
+        objective = [r for r in results if not r["subjective"]]
+        subjective = [r for r in results if r["subjective"]]
+        percent = round(score / total * 100) if total else 0
+        comments = f"共{len(results)}题，得分{_round_score(score)}/{_round_score(total)}（{percent}%）。"
+        if objective:
+            comments += f"客观题答对{sum(1 for r in objective if r['correct'])}/{len(objective)}题"
+            comments += "，" if subjective else "。"
+        if subjective:
+            subjective_score = sum(r["score"] for r in subjective)
+            subjective_total = sum(r["max_score"] for r in subjective)
+            comments += f"主观题得分{_round_score(subjective_score)}/{_round_score(subjective_total)}。"
+        review_count = sum(1 for r in results if r.get("needs_review"))
+        if review_count:
+            comments += f"有{review_count}道题自动批改失败，需要人工复核。"
+
+        return {
+            "score": _round_score(score),
+            "total_points": _round_score(total),
+            "scoring_points": scoring_points,
+            "comments": comments,
+            "suggestions": suggestions,
+            "highlights": highlights,
+        }
+
+    async def grade_class(
+        self,
+        practice_set: Any,
+        submissions: List[Dict],
+        reference_answers: Any = None
+    ) -> AsyncIterator[Dict]:
+        """
+        批改全班的答案
+
+        - 题目集和参考答案只解析一次
+        - 客观题逐题在本地批改
+        - 同一道题的相同主观题答案（规范化后）只调用一次模型，结果共享
+        - 模型调用总并发受 concurrency 限制
+        - 每个学生批改完成后立即产出结果，最后产出全班汇总
+
+        Args:
+            practice_set: 题目集
+            submissions: 学生提交列表，每项为 {"student_id": ..., "name": ...(可选), "answers": 答案集}
+            reference_answers: 参考答案集，为空时使用题目中的 reference_answer
+
+        Yields:
+            Dict: {"type": "student", ...} 或最后的 {"type": "summary", ...}
+        """
+        items = prepare_items(practice_set, reference_answers)
+        questions = [item.question for item in items]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        shared: Dict[Tuple[str, str], asyncio.Future] = {}
+        counters: Counter = Counter()
+
+        async def limited(item: GradingItem, student: Any) -> Dict:
+            async with semaphore:
+                return await self.grade_subjective(item.question, student, item.reference_answer, item.max_score)
+
+        async def grade_subjective(item: GradingItem, student: Any) -> Dict:
+            key = (item.id, _normalize_text(student))
+            task = shared.get(key)
+            if task is None:
+                task = asyncio.ensure_future(limited(item, student))
+                shared[key] = task
+                counters["subjective_graded"] += 1
+            else:
+                counters["subjective_deduplicated"] += 1
+            # 某个学生的批改被取消时不影响共享同一答案的其他学生
+            return await asyncio.shield(task)
+
+        async def grade_student(submission: Dict) -> Tuple[Dict, List[Dict]]:
+            answers = index_answers(submission.get("answers"), questions, "student_answer")
+            results = await asyncio.gather(*(
+                self._grade_item(item, answers.get(item.id, ""), grade_subjective) for item in items
+            ))
+            report = {
+                "type": "student",
+                "student_id": submission.get("student_id"),
+                "name": submission.get("name"),
+                **self.aggregate(questions, results),
+            }
+            return report, [dict(r, answer=answers.get(r["id"], "")) for r in results]
+
+        tasks = [asyncio.ensure_future(grade_student(submission)) for submission in submissions]
+        graded: List[Tuple[Dict, List[Dict]]] = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                report, results = await next_done
+                graded.append((report, results))
+                yield report
+            yield self.summarize(items, graded, counters)
+        finally:
+            for task in list(tasks) + list(shared.values()):
+                if not task.done():
+                    task.cancel()
+
+    @staticmethod
+    def summarize(items: List[GradingItem], graded: List[Tuple[Dict, List[Dict]]], counters: Counter) -> Dict:
+        """全班汇总：分数统计、分数段分布、每道题的得分率和常见错误答案"""
+        scores = [report["score"] for report, _ in graded]
+        total = sum(item.max_score for item in items)
+
+        distribution = Counter()
+        for score in scores:
+            percent = score / total * 100 if total else 0
+            bucket = min(int(percent // 10) * 10, 90)
+            distribution[f"{bucket}-{bucket + 10}"] += 1
+
+        question_stats = []
+        for index, item in enumerate(items):
+            results = [results[index] for _, results in graded]
+            wrong_answers = Counter(
+                str(r["answer"]).strip() for r in results
+                if not r["correct"] and not r["subjective"] and str(r["answer"]).strip()
+            )
+            question_stats.append({
+                "id": item.id,
+                "type": item.question.get("type", ""),
+                "max_score": _round_score(item.max_score),
+                "average_score": _round_score(statistics.mean(r["score"] for r in results)) if results else 0,
+                "correct_rate": round(sum(1 for r in results if r["correct"]) / len(results), 4) if results else 0,
+                "common_wrong_answers": [answer for answer, _ in wrong_answers.most_common(3)],
+            })
+
+        return {
+            "type": "summary",
+            "students": len(scores),
+            "total_points": _round_score(total),
+            "average_score": _round_score(statistics.mean(scores)) if scores else 0,
+            "median_score": _round_score(statistics.median(scores)) if scores else 0,
+            "max_score": max(scores) if scores else 0,
+            "min_score": min(scores) if scores else 0,
+            "score_distribution": dict(sorted(distribution.items(), key=lambda kv: int(kv[0].split("-")[0]))),
+            "questions": question_stats,
+            **dict(counters),
+        }
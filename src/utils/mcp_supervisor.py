@@ -0,0 +1,216 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from utils.logger import MyLogger, logging
+
+load_dotenv()
+
+logger = MyLogger(name="MCPSupervisor", level=logging.INFO, colored=True)
+
+
+class SupervisedClient:
+    """被监控的MCP客户端及其运行状态"""
+
+    def __init__(self, key: str, client):
+        self.key = key
+        self.client = client
+        self.ready = asyncio.Event()
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.task: Optional[asyncio.Task] = None
+
+        self.connected_at: Optional[float] = None
+        self.restarts = 0
+        self.connect_failures = 0
+        self.ping_failures = 0
+        self.last_ping_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def stats(self) -> Dict:
+        return {
+            "connected": self.ready.is_set(),
+            "uptime": round(time.time() - self.connected_at, 1) if self.connected_at else 0.0,
+            "restarts": self.restarts,
+            "connect_failures": self.connect_failures,
+            "last_ping_ms": self.last_ping_ms,
+            "last_error": self.last_error,
+        }
+
+
+class MCPSupervisor:
+    """
+    MCP连接监控
+
+    每个MCP客户端由一个专属的后台任务负责连接、定期ping、重启和关闭
+    （stdio_client 必须在建立连接的同一个任务中关闭）。
+    ping连续失败或被请求重启时，在后台关闭旧连接并立即建立新连接，
+    连接失败按指数退避重试，使请求路径上拿到的始终是已经预热好的连接。
+    """
+
+    def __init__(
+        self,
+        ping_interval: float = 30,
+        ping_timeout: float = 10,
+        max_ping_failures: int = 2,
+        backoff_min: float = 1,
+        backoff_max: float = 60,
+    ):
+        """
+        初始化连接监控
+
+        Args:
+            ping_interval: 两次ping之间的间隔（秒）
+            ping_timeout: 单次ping的超时时间（秒）
+            max_ping_failures: 连续多少次ping失败后重启
+            backoff_min: 连接失败后第一次重试的等待时间（秒）
+            backoff_max: 重试等待时间的上限（秒）
+        """
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.max_ping_failures = max_ping_failures
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.clients: Dict[int, SupervisedClient] = {}
+
+    @classmethod
+    def from_env(cls) -> "MCPSupervisor":
+        return cls(
+            ping_interval=float(os.getenv("MCP_PING_INTERVAL", "30")),
+            ping_timeout=float(os.getenv("MCP_PING_TIMEOUT", "10")),
+            max_ping_failures=int(os.getenv("MCP_MAX_PING_FAILURES", "2")),
+            backoff_max=float(os.getenv("MCP_RESTART_BACKOFF_MAX", "60")),
+        )
+
+    def start(self, client, key: str) -> SupervisedClient:
+        """开始监控客户端（在Agent所在的事件循环中调用），后台任务会立即建立连接"""
+        state = self.clients.get(id(client))
+        if state is None or state.task is None or state.task.done():
+            state = SupervisedClient(key, client)
+            state.task = asyncio.create_task(self._own(state))
+            self.clients[id(client)] = state
+        return state
+
+    async def wait_ready(self, client, timeout: float) -> bool:
+        """等待客户端连接可用，超时返回False"""
+        state = self.clients.get(id(client))
+        if state is None:
+            return False
+        try:
+            await asyncio.wait_for(state.ready.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def restart(self, client, timeout: float) -> bool:
+        """请求重启客户端并等待新连接可用"""
+        state = self.clients.get(id(client))
+        if state is None:
+            return False
+        # 已连接时关闭旧连接重新建立；正在退避等待时立即重试
+        state.ready.clear()
+        state.wakeup.set()
+        return await self.wait_ready(client, timeout)
+
+    async def stop(self, client) -> None:
+        """停止监控并关闭连接"""
+        state = self.clients.pop(id(client), None)
+        if state is None or state.task is None:
+            return
+        state.stopping = True
+        state.wakeup.set()
+        try:
+            await state.task
+        except asyncio.CancelledError:
+            pass
+
+    async def _sleep(self, state: SupervisedClient, delay: float) -> None:
+        """等待一段时间，被唤醒（停止或请求重启）时提前返回"""
+        try:
+            await asyncio.wait_for(state.wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        state.wakeup.clear()
+
+    async def _own(self, state: SupervisedClient) -> None:
+        client = state.client
+        delay = self.backoff_min
+        try:
+            while not state.stopping:
+                try:
+                    await client.connect_to_server()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    state.connect_failures += 1
+                    state.last_error = f"连接失败: {e}"
+                    await client.reset()
+                    logger.warning(f"MCP服务器 {state.key} 连接失败，{delay:.1f}秒后重试: {e}")
+                    await self._sleep(state, delay)
+                    delay = min(delay * 2, self.backoff_max)
+                    continue
+
+                delay = self.backoff_min
+                state.connected_at = time.time()
+                state.ping_failures = 0
+                state.ready.set()
+
+                reason = await self._watch(state)
+
+                state.ready.clear()
+                state.connected_at = None
+                await client.reset()
+                if state.stopping:
+                    break
+                state.restarts += 1
+                logger.warning(f"MCP服务器 {state.key} {reason}，正在重启（第{state.restarts}次）")
+        finally:
+            state.ready.clear()
+            await client.reset()
+
+    async def _watch(self, state: SupervisedClient) -> str:
+        """定期ping，连接需要重启时返回原因"""
+        while True:
+            await self._sleep(state, self.ping_interval)
+            if state.stopping:
+                return "停止"
+            if not state.ready.is_set():
+                return "被请求重启"
+
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(state.client.ping(), timeout=self.ping_timeout)
+                state.last_ping_ms = round((time.monotonic() - start) * 1000, 1)
+                state.ping_failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                state.ping_failures += 1
+                state.last_error = f"ping失败: {e or type(e).__name__}"
+                if state.ping_failures >= self.max_ping_failures:
+                    return f"连续{state.ping_failures}次ping失败"
+
+    def stats(self) -> Dict:
+        """按服务器汇总的连接状态，以及每个客户端的详情"""
+        servers: Dict[str, Dict] = {}
+        # 本地模式下从API线程读取，先复制一份避免遍历时被修改
+        states = list(self.clients.values())
+        for state in states:
+            server = state.key.split("@", 1)[0]
+            summary = servers.setdefault(server, {"clients": 0, "connected": 0, "restarts": 0, "min_uptime": None})
+            client_stats = state.stats()
+            summary["clients"] += 1
+            summary["connected"] += int(client_stats["connected"])
+            summary["restarts"] += client_stats["restarts"]
+            if summary["min_uptime"] is None or client_stats["uptime"] < summary["min_uptime"]:
+                summary["min_uptime"] = client_stats["uptime"]
+        return {
+            "servers": servers,
+            "clients": {state.key: state.stats() for state in states},
+        }
+
+
+mcp_supervisor = MCPSupervisor.from_env()
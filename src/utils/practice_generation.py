@@ -0,0 +1,120 @@
+import difflib
+import math
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+# 各题型的预计作答时间（分钟）
+MINUTES_PER_TYPE = {
+    "选择题": 2,
+    "判断题": 1,
+    "填空题": 2,
+    "简答题": 8,
+}
+
+DIFFICULTY_KEYS = {
+    "简单": "easy",
+    "中等": "medium",
+    "困难": "hard",
+}
+
+
+def split_pieces(topics: List[str], num_questions: int, chunk_size: int) -> List[Tuple[str, int]]:
+    """
+    把练习集拆分成若干子任务
+
+    题目按知识点轮流分配，每个知识点的题目再按 chunk_size 分块
+
+    Returns:
+        List[Tuple[str, int]]: (知识点, 题目数量) 列表
+    """
+    topics = topics or ["软件工程"]
+    counts = [0] * len(topics)
+    for i in range(num_questions):
+        counts[i % len(topics)] += 1
+
+    pieces = []
+    for topic, count in zip(topics, counts):
+        while count > 0:
+            size = min(chunk_size, count)
+            pieces.append((topic, size))
+            count -= size
+    return pieces
+
+
+def _normalize_question(text: str) -> str:
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    return re.sub(r"[\s\W_]+", "", text)
+
+
+def is_valid_question(question: Dict, question_type: str) -> bool:
+    """检查单道题目是否完整"""
+    if not isinstance(question, dict):
+        return False
+    if not question.get("question") or not question.get("reference_answer"):
+        return False
+    if question_type == "选择题" and not question.get("options"):
+        return False
+    return True
+
+
+def dedupe_questions(questions: List[Dict], threshold: float = 0.85) -> Tuple[List[Dict], int]:
+    """
+    去除题干几乎相同的题目
+
+    Args:
+        questions: 题目列表
+        threshold: 题干相似度阈值，达到阈值视为重复
+
+    Returns:
+        Tuple[List[Dict], int]: 去重后的题目列表和去掉的数量
+    """
+    kept, kept_stems = [], []
+    for question in questions:
+        stem = _normalize_question(question.get("question", ""))
+        duplicate = any(
+            stem == other or difflib.SequenceMatcher(None, stem, other).ratio() >= threshold
+            for other in kept_stems
+        )
+        if duplicate:
+            continue
+        kept.append(question)
+        kept_stems.append(stem)
+    return kept, len(questions) - len(kept)
+
+
+def _to_number(value, default: float) -> float:
+    if isinstance(value, (int, float)):
+        return value
+    match = re.search(r"\d+(?:\.\d+)?", str(value or ""))
+    return float(match.group()) if match else default
+
+
+def assemble_practice_set(questions: List[Dict], difficulty: str, question_type: str) -> Dict:
+    """
+    组装最终的练习集：重新编号，计算总分、预计时间和难度分布
+
+    未给出分值的题目按总分100平均分配
+    """
+    default_value = math.floor(100 / len(questions)) if questions else 0
+    distribution = {"easy": 0, "medium": 0, "hard": 0}
+    total_points = 0
+    minutes = 0
+
+    for index, question in enumerate(questions, start=1):
+        question["id"] = index
+        question.setdefault("type", question_type)
+        value = _to_number(question.get("value"), default_value)
+        question["value"] = int(value) if float(value).is_integer() else value
+        total_points += question["value"]
+
+        question_difficulty = question.get("difficulty") or difficulty
+        distribution[DIFFICULTY_KEYS.get(question_difficulty, "medium")] += 1
+        minutes += MINUTES_PER_TYPE.get(question.get("type"), 3)
+
+    return {
+        "questions": questions,
+        "total_points": total_points,
+        "estimated_time": str(minutes),
+        "difficulty_distribution": distribution,
+    }
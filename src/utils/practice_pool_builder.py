@@ -0,0 +1,198 @@
+import asyncio
+import os
+from collections import Counter
+from typing import IO, Awaitable, Callable, Dict, Optional, Set
+
+from dotenv import load_dotenv
+
+from models.practice_pool import PracticePool, validate_practice_set
+from utils.logger import MyLogger, logging
+
+load_dotenv()
+
+logger = MyLogger(name="PracticePool", level=logging.INFO, colored=True)
+
+
+def try_lock_file(path: str) -> Optional[IO]:
+    """
+    非阻塞地获取文件锁
+
+    Returns:
+        打开的锁文件（保持打开即持有锁，进程退出时由系统释放），已被其他进程持有时返回None
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    f = open(path, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class PracticePoolBuilder:
+    """
+    练习集题库的后台补充任务
+
+    空闲时为热门的 (知识点, 题量, 难度, 题型) 组合预生成练习集，
+    校验通过后放入题库，使每个热门组合保持 target_per_combo 套存量。
+    请求取走一套或者现场生成后，通过 request_refill 让该组合在下一轮优先补充，
+    但只补充热门组合：请求次数不足 min_requests 的一次性组合不会预生成。
+    """
+
+    def __init__(
+        self,
+        pool: PracticePool,
+        generate: Callable[[Dict], Awaitable[Dict]],
+        is_idle: Callable[[], bool],
+        target_per_combo: int = 3,
+        max_combos: int = 20,
+        interval: float = 30,
+        min_requests: int = 2,
+        lock_path: Optional[str] = None,
+    ):
+        """
+        初始化后台补充任务
+
+        Args:
+            pool: 练习集题库
+            generate: 生成函数，参数为 popular_combos 返回的组合，返回 generate_practice_set 格式的结果
+            is_idle: 判断服务当前是否空闲
+            target_per_combo: 每个组合的目标存量
+            max_combos: 预生成的热门组合数量
+            interval: 两轮检查之间的间隔（秒）
+            min_requests: 组合至少被请求过这么多次才预生成
+            lock_path: 文件锁路径，多个进程共用一个题库时只有拿到锁的进程运行补充任务
+        """
+        self.pool = pool
+        self.generate = generate
+        self.is_idle = is_idle
+        self.target_per_combo = target_per_combo
+        self.max_combos = max_combos
+        self.interval = interval
+        self.min_requests = min_requests
+        self.lock_path = lock_path
+
+        self.pending: Set[str] = set()
+        self.wakeup = asyncio.Event()
+        self.counters: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+        self._lock_file: Optional[IO] = None
+
+    @classmethod
+    def from_env(cls, pool: PracticePool, generate, is_idle, lock_path: Optional[str] = None) -> "PracticePoolBuilder":
+        return cls(
+            pool,
+            generate,
+            is_idle,
+            target_per_combo=int(os.getenv("PRACTICE_POOL_TARGET", "3")),
+            max_combos=int(os.getenv("PRACTICE_POOL_MAX_COMBOS", "20")),
+            interval=float(os.getenv("PRACTICE_POOL_INTERVAL", "30")),
+            min_requests=int(os.getenv("PRACTICE_POOL_MIN_REQUESTS", "2")),
+            lock_path=lock_path,
+        )
+
+    def start(self) -> bool:
+        """
+        启动后台补充任务
+
+        Returns:
+            是否启动；设置了 lock_path 且锁已被其他进程持有时不启动
+        """
+        if self.lock_path and self._lock_file is None:
+            self._lock_file = try_lock_file(self.lock_path)
+            if self._lock_file is None:
+                logger.info("其他进程正在补充练习集题库，本进程不启动后台补充任务")
+                return False
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+            logger.info("练习集题库后台补充任务已启动")
+        return True
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def request_refill(self, combo_key: str) -> None:
+        """请求下一轮优先补充某个组合（仍然只在空闲时生成，且只补充热门组合）"""
+        self.pending.add(combo_key)
+        self.wakeup.set()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+            try:
+                await self.fill_round()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"补充练习集题库时出错: {e}")
+
+    async def fill_round(self) -> None:
+        """补充一轮热门组合，其中请求过补充的组合排在前面"""
+        if not self.is_idle():
+            return
+        # 题库是SQLite，查询放到线程中执行，不阻塞事件循环
+        await asyncio.to_thread(self.pool.cleanup)
+
+        popular = await asyncio.to_thread(self.pool.popular_combos, self.max_combos)
+        combos = [combo for combo in popular if combo["requests"] >= self.min_requests]
+        # 不在热门组合中的补充请求直接丢弃
+        combos.sort(key=lambda combo: combo["combo_key"] not in self.pending)
+        self.pending.clear()
+
+        for combo in combos:
+            combo_key = combo["combo_key"]
+            while await asyncio.to_thread(self.pool.count, combo_key) < self.target_per_combo:
+                if not self.is_idle():
+                    # 服务变忙，剩下的组合留到下一轮
+                    self.pending.add(combo_key)
+                    return
+                if not await self.fill_one(combo):
+                    break
+
+    async def fill_one(self, combo: Dict) -> bool:
+        """生成一套练习集并放入题库，返回是否成功"""
+        try:
+            result = await self.generate(combo)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.counters["failed"] += 1
+            logger.warning(f"预生成练习集失败: {e}")
+            return False
+
+        if not validate_practice_set(result, combo["num_questions"]):
+            self.counters["invalid"] += 1
+            logger.warning(f"预生成的练习集未通过校验，已丢弃: {combo['topics']}")
+            return False
+
+        await asyncio.to_thread(self.pool.add, combo["combo_key"], result)
+        self.counters["generated"] += 1
+        logger.info(f"已预生成练习集: {', '.join(combo['topics'])}（{combo['difficulty']}，{combo['question_type']}）")
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "pending": len(self.pending),
+            **dict(self.counters),
+        }
@@ -0,0 +1,372 @@
+import atexit
+import base64
+import copy
+import functools
+import hashlib
+import inspect
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.logger import MyLogger, logging
+
+load_dotenv()
+
+logger = MyLogger(name="ResponseCache", level=logging.INFO, colored=True)
+
+PROJECT_PATH = os.getenv("PROJECT_PATH", os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# 问句末尾常见的标点，不影响语义
+_TRAILING_PUNCTUATION = "？?。.!！~～…"
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    规范化用户输入：全半角统一、忽略大小写、合并空白、去掉末尾标点
+
+    例如 "什么是瀑布模型？" 与 " 什么是瀑布模型 " 视为同一个问题
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower().strip()
+    text = re.sub(r"\s+", " ", text)
+    return text.rstrip(_TRAILING_PUNCTUATION).strip()
+
+
+def _normalize_vector(vector: List[float]) -> np.ndarray:
+    """归一化并转为float32数组"""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector)) or 1.0
+    return vector / norm
+
+
+def _encode_vector(vector: np.ndarray) -> str:
+    """float32小端字节的base64，写盘体积约为JSON浮点列表的1/4"""
+    return base64.b64encode(np.asarray(vector, dtype="<f4").tobytes()).decode("ascii")
+
+
+def _decode_vector(value: Any) -> Optional[np.ndarray]:
+    """读取磁盘上的向量，兼容旧格式的浮点列表"""
+    if not value:
+        return None
+    if isinstance(value, list):
+        return np.asarray(value, dtype=np.float32)
+    return np.frombuffer(base64.b64decode(value), dtype="<f4").astype(np.float32)
+
+
+class ResponseCache:
+    """
+    LLM响应缓存
+
+    以 (agent, method, style, 规范化后的问题) 为键缓存成功的Agent响应。
+    可选地使用嵌入向量做语义匹配：同一 (agent, method, style) 下，
+    余弦相似度达到阈值的历史问题直接复用其回答。
+    支持TTL、条目数上限（LRU淘汰）和磁盘持久化。
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = 7 * 24 * 3600,
+        max_entries: int = 2000,
+        semantic_threshold: Optional[float] = None,
+        save_interval: float = 30,
+    ):
+        """
+        初始化响应缓存
+
+        Args:
+            path: 持久化文件路径，为None时只缓存在内存中
+            ttl: 条目有效期（秒）
+            max_entries: 最大条目数
+            semantic_threshold: 语义匹配的相似度阈值，为None时只做精确匹配
+            save_interval: 两次写盘的最小间隔（秒）
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic_threshold = semantic_threshold
+        self.save_interval = save_interval
+
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.counters: Counter = Counter()
+        self._dirty = False
+        self._last_saved = 0.0
+        self._lock = threading.Lock()
+        # 后台写盘线程：put() 在Agent事件循环上调用，不能在这里同步写文件
+        self._save_event = threading.Event()
+        self._save_lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        # 语义匹配用的连续向量矩阵，按 (agent, method, style, 维度) 分组，组内条目变化时重建
+        self._matrices: Dict[Tuple, Tuple[List[str], np.ndarray]] = {}
+
+        self._load()
+        if self.path:
+            atexit.register(self.save)
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        threshold = os.getenv("RESPONSE_CACHE_SEMANTIC_THRESHOLD", "")
+        enabled = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+        return cls(
+            path=os.path.join(PROJECT_PATH, "cache", "response_cache.json") if enabled else None,
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600))),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000")) if enabled else 0,
+            semantic_threshold=float(threshold) if threshold else None,
+        )
+
+    @staticmethod
+    def make_key(agent: str, method: str, style: Optional[str], prompt: str) -> str:
+        raw = json.dumps([agent, method, style or "", normalize_prompt(prompt)], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            now = time.time()
+            for key, entry in data.get("entries", []):
+                if now - entry["created_at"] < self.ttl:
+                    entry["embedding"] = _decode_vector(entry.get("embedding"))
+                    self.entries[key] = entry
+            logger.info(f"已加载 {logger.color_text(str(len(self.entries)), 'YELLOW')} 条缓存响应")
+        except Exception as e:
+            logger.warning(f"加载响应缓存失败: {e}")
+
+    def save(self) -> None:
+        """写盘（先写临时文件再替换，避免写到一半的文件）"""
+        if not self.path or not self._dirty:
+            return
+        # 后台线程与退出时的atexit可能同时写盘，串行化以免互相覆盖临时文件
+        with self._save_lock:
+            with self._lock:
+                snapshot = list(self.entries.items())
+                self._dirty = False
+                self._last_saved = time.time()
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                entries = [
+                    [key, {**entry, "embedding": _encode_vector(entry["embedding"]) if entry.get("embedding") is not None else None}]
+                    for key, entry in snapshot
+                ]
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"entries": entries}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning(f"保存响应缓存失败: {e}")
+
+    def _writer_loop(self) -> None:
+        while True:
+            self._save_event.wait()
+            self._save_event.clear()
+            self.save()
+
+    def _schedule_save(self) -> None:
+        """通知后台线程写盘，不阻塞调用方"""
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._writer_loop, name="ResponseCacheWriter", daemon=True)
+                    self._writer.start()
+        self._save_event.set()
+
+    def _is_fresh(self, entry: Dict) -> bool:
+        return time.time() - entry["created_at"] < self.ttl
+
+    @staticmethod
+    def _group_of(entry: Dict) -> Tuple[str, str, str]:
+        return entry["agent"], entry["method"], entry["style"]
+
+    def _forget_group(self, group: Tuple[str, str, str]) -> None:
+        """组内条目变化后丢弃该组的向量矩阵（调用方持有锁）"""
+        for matrix_key in [matrix_key for matrix_key in self._matrices if matrix_key[:3] == group]:
+            del self._matrices[matrix_key]
+
+    def _group_matrix(self, group: Tuple[str, str, str], dim: int) -> Tuple[List[str], np.ndarray]:
+        """获取一组条目的键和向量矩阵（调用方持有锁）"""
+        matrix_key = (*group, dim)
+        cached = self._matrices.get(matrix_key)
+        if cached is None:
+            keys, vectors = [], []
+            for key, entry in self.entries.items():
+                vector = entry.get("embedding")
+                if vector is not None and vector.shape[0] == dim and self._group_of(entry) == group:
+                    keys.append(key)
+                    vectors.append(vector)
+            matrix = np.stack(vectors) if vectors else np.empty((0, dim), dtype=np.float32)
+            cached = self._matrices[matrix_key] = (keys, matrix)
+        return cached
+
+    def get(
+        self,
+        agent: str,
+        method: str,
+        style: Optional[str],
+        prompt: str,
+        embedding: Optional[List[float]] = None,
+    ) -> Optional[Any]:
+        """
+        查询缓存
+
+        Args:
+            embedding: 问题的嵌入向量，提供时在精确匹配失败后做语义匹配
+
+        Returns:
+            缓存的响应，未命中时返回None
+        """
+        key = self.make_key(agent, method, style, prompt)
+        group = (agent, method, style or "")
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._is_fresh(entry):
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry["response"]
+            if entry is not None:
+                del self.entries[key]
+                self._forget_group(group)
+
+            if embedding is None or self.semantic_threshold is None:
+                self.counters["misses"] += 1
+                return None
+            query = _normalize_vector(embedding)
+            keys, matrix = self._group_matrix(group, query.shape[0])
+
+        # 矩阵只会被整体替换、不会原地修改，相似度在锁外计算
+        scores = matrix @ query
+        candidates = np.flatnonzero(scores >= self.semantic_threshold)
+        candidates = candidates[np.argsort(-scores[candidates])]
+
+        with self._lock:
+            for index in candidates:
+                candidate = self.entries.get(keys[index])
+                if candidate is None or not self._is_fresh(candidate):
+                    continue
+                self.entries.move_to_end(keys[index])
+                self.counters["hits"] += 1
+                self.counters["semantic_hits"] += 1
+                logger.info(f"语义缓存命中（相似度 {scores[index]:.3f}）: {prompt[:30]}")
+                return candidate["response"]
+            self.counters["misses"] += 1
+            return None
+
+    def put(
+        self,
+        agent: str,
+        method: str,
+        style: Optional[str],
+        prompt: str,
+        response: Any,
+        embedding: Optional[List[float]] = None,
+    ) -> None:
+        """写入缓存"""
+        if self.max_entries <= 0:
+            return
+        key = self.make_key(agent, method, style, prompt)
+        with self._lock:
+            self.entries[key] = {
+                "agent": agent,
+                "method": method,
+                "style": style or "",
+                "prompt": normalize_prompt(prompt),
+                "response": response,
+                "embedding": _normalize_vector(embedding) if embedding else None,
+                "created_at": time.time(),
+            }
+            self.entries.move_to_end(key)
+            self._forget_group((agent, method, style or ""))
+            while len(self.entries) > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                self._forget_group(self._group_of(evicted))
+                self.counters["evictions"] += 1
+            self._dirty = True
+            should_save = time.time() - self._last_saved >= self.save_interval
+
+        if should_save and self.path:
+            self._schedule_save()
+
+    def invalidate_label(self, label: str) -> int:
+        """删除基于某个知识库生成的缓存响应（知识库内容变化后调用），返回删除的条目数"""
+        suffix = f"@{label}"
+        with self._lock:
+            keys = [key for key, entry in self.entries.items() if entry["agent"].endswith(suffix)]
+            for key in keys:
+                self._forget_group(self._group_of(self.entries.pop(key)))
+            if keys:
+                self._dirty = True
+        if keys and self.path:
+            self._schedule_save()
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "semantic": self.semantic_threshold is not None,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+            **dict(self.counters),
+        }
+
+
+response_cache = ResponseCache.from_env()
+
+
+def cached_response(method: str, prompt_arg: str, style_arg: Optional[str] = None):
+    """
+    Agent方法的响应缓存装饰器
+
+    只缓存 status 为 success 的结果。Agent提供 embed_text 时启用语义匹配。
+
+    Args:
+        method: 缓存键中的方法名
+        prompt_arg: 用户问题对应的参数名
+        style_arg: 解释风格等影响回答内容的参数名
+    """
+    def decorator(func: Callable):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            if response_cache.max_entries <= 0:
+                return await func(self, *args, **kwargs)
+
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            prompt = bound.arguments.get(prompt_arg) or ""
+            style = bound.arguments.get(style_arg) if style_arg else None
+            style = getattr(style, "value", style)
+            # 回答依赖挂载的知识库，不同知识库分开缓存
+            agent_name = type(self).__name__
+            if getattr(self, "label", None):
+                agent_name = f"{agent_name}@{self.label}"
+
+            embedding = None
+            if response_cache.semantic_threshold is not None and hasattr(self, "embed_text"):
+                try:
+                    embedding = await self.embed_text(normalize_prompt(prompt))
+                except Exception as e:
+                    logger.warning(f"计算问题向量失败，仅使用精确匹配: {e}")
+
+            cached = response_cache.get(agent_name, method, style, prompt, embedding)
+            if cached is not None:
+                logger.info(f"响应缓存命中: {agent_name}.{method}")
+                return copy.deepcopy(cached)
+
+            result = await func(self, *args, **kwargs)
+            if isinstance(result, dict) and result.get("status") == "success":
+                response_cache.put(agent_name, method, style, prompt, result, embedding)
+            return result
+
+        return wrapper
+
+    return decorator
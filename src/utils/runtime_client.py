@@ -0,0 +1,161 @@
+import concurrent.futures
+import hashlib
+import importlib
+import itertools
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# 需要在所有运行时进程上执行的方法（修改的是进程内状态）
+# create_index/delete_index 修改的是共享磁盘上的索引，只在一个运行时执行，之后广播 reload_index
+BROADCAST_METHODS = {"update_label", "reload_index"}
+
+
+def encode_value(value: Any) -> Any:
+    """
+    将参数/结果编码为可JSON序列化的结构
+
+    枚举会携带类型信息，以便运行时进程还原为原始枚举（Agent中大量使用 .value）
+    """
+    if isinstance(value, Enum):
+        cls = type(value)
+        return {"__enum__": f"{cls.__module__}:{cls.__qualname__}", "value": value.value}
+    if isinstance(value, dict):
+        return {str(k): encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [encode_value(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def decode_value(value: Any) -> Any:
+    """encode_value 的逆过程"""
+    if isinstance(value, dict):
+        if "__enum__" in value and "value" in value:
+            module_name, qualname = value["__enum__"].split(":", 1)
+            cls = getattr(importlib.import_module(module_name), qualname)
+            return cls(value["value"])
+        return {k: decode_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    return value
+
+
+class AgentRuntimeError(Exception):
+    """运行时进程返回的错误"""
+
+
+class RuntimeClient:
+    """
+    Agent运行时客户端
+
+    API进程通过HTTP把Agent方法调用转发给独立的运行时进程。
+    同一会话（用户）总是路由到同一个运行时，保证Agent的上下文连续。
+    """
+
+    def __init__(self, urls: List[str]):
+        """
+        初始化运行时客户端
+
+        Args:
+            urls: 运行时进程地址列表，如 ["http://127.0.0.1:9001", ...]
+        """
+        if not urls:
+            raise ValueError("至少需要配置一个Agent运行时地址")
+        self.urls = [url.rstrip("/") for url in urls]
+        self._round_robin = itertools.cycle(range(len(self.urls)))
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            )
+        return self._client
+
+    def route(self, session_key: Optional[Any] = None) -> str:
+        """
+        选择运行时：有会话标识时按哈希粘滞路由，否则轮询
+
+        使用md5而不是hash()，保证不同API worker的路由结果一致
+        """
+        if session_key is None:
+            return self.urls[next(self._round_robin)]
+        digest = hashlib.md5(str(session_key).encode("utf-8")).digest()
+        index = int.from_bytes(digest[:8], "big") % len(self.urls)
+        return self.urls[index]
+
+    async def _post(self, url: str, payload: Dict, timeout: int) -> Any:
+        try:
+            response = await self.client.post(
+                f"{url}/invoke",
+                json=payload,
+                # 给运行时留出返回超时错误的时间
+                timeout=timeout + 5,
+            )
+        except httpx.TimeoutException:
+            raise concurrent.futures.TimeoutError()
+
+        data = response.json()
+        if response.status_code != 200:
+            if data.get("type") == "TimeoutError":
+                raise concurrent.futures.TimeoutError()
+            raise AgentRuntimeError(data.get("error", f"运行时返回错误: {response.status_code}"))
+        return decode_value(data["result"])
+
+    async def invoke(
+        self,
+        agent: str,
+        method: str,
+        args: tuple = (),
+        kwargs: Dict = None,
+        timeout: int = 300,
+        session_key: Optional[Any] = None,
+    ) -> Any:
+        """
+        调用运行时中的Agent方法
+
+        Args:
+            agent: Agent注册名
+            method: 方法名
+            args: 位置参数
+            kwargs: 关键字参数
+            timeout: 超时时间（秒）
+            session_key: 会话标识，用于粘滞路由
+
+        Returns:
+            方法的返回值
+        """
+        payload = {
+            "agent": agent,
+            "method": method,
+            "args": encode_value(list(args)),
+            "kwargs": encode_value(kwargs or {}),
+            "timeout": timeout,
+        }
+
+        if method in BROADCAST_METHODS:
+            result = None
+            for url in self.urls:
+                result = await self._post(url, payload, timeout)
+            return result
+
+        return await self._post(self.route(session_key), payload, timeout)
+
+    async def health(self) -> Dict[str, Any]:
+        """检查所有运行时的状态"""
+        status = {}
+        for url in self.urls:
+            try:
+                response = await self.client.get(f"{url}/health", timeout=5)
+                status[url] = response.json()
+            except Exception as e:
+                status[url] = {"status": "error", "message": str(e)}
+        return status
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
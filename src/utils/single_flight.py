@@ -0,0 +1,100 @@
+import asyncio
+import copy
+import hashlib
+import json
+from collections import Counter
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict
+
+from utils.logger import MyLogger, logging
+from utils.response_cache import normalize_prompt
+
+logger = MyLogger(name="SingleFlight", level=logging.INFO, colored=True)
+
+
+def _normalize_arg(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, str):
+        return normalize_prompt(value)
+    if isinstance(value, dict):
+        return {str(k): _normalize_arg(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_arg(v) for v in value]
+    return value
+
+
+class _Call:
+    """一次正在执行的调用及其等待者数量"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    相同调用合并（single-flight）
+
+    键相同的并发调用只执行一次：第一个调用者启动执行，之后到达的调用者
+    挂到同一个任务上共享结果。执行结束后键即被移除，不缓存结果。
+    某个等待者被取消（如客户端断开）不影响其他等待者；
+    所有等待者都离开后才取消共享的任务。
+    """
+
+    def __init__(self):
+        self.calls: Dict[str, _Call] = {}
+        self.counters: Counter = Counter()
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """
+        由调用标识和参数生成键
+
+        字符串参数按 normalize_prompt 规范化，枚举取其值
+        """
+        raw = json.dumps(_normalize_arg(list(parts)), ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行调用，或加入键相同的正在执行的调用
+
+        Args:
+            key: 调用的键
+            factory: 创建实际执行协程的函数，只有第一个调用者会用到
+
+        Returns:
+            调用结果的副本（每个等待者各自一份，避免互相修改）
+        """
+        call = self.calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self.calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.counters["executions"] += 1
+        else:
+            self.counters["coalesced"] += 1
+            logger.info(f"合并相同的并发请求，当前等待者: {call.waiters + 1}")
+
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 所有等待者都已离开，没有必要继续执行
+                call.task.cancel()
+                self.counters["cancelled"] += 1
+        return copy.deepcopy(result)
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self.calls.get(key) is call:
+            del self.calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self.calls),
+            "waiters": sum(call.waiters for call in self.calls.values()),
+            **dict(self.counters),
+        }
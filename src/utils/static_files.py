@@ -0,0 +1,23 @@
+import re
+
+from fastapi.staticfiles import StaticFiles
+
+# 按内容哈希命名的文件（如 class/3f2a9c0d1e4b5a6c7d8e.png），内容不变则文件名不变
+HASHED_FILE_PATTERN = re.compile(r"(^|/)[0-9a-f]{16,64}\.[A-Za-z0-9]+$")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class HashedStaticFiles(StaticFiles):
+    """
+    静态文件目录
+
+    按内容哈希命名的文件永远不会被改写，响应中加上长期缓存头，浏览器和CDN可以直接缓存；
+    其他文件保持默认行为（通过ETag/Last-Modified协商缓存）
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if HASHED_FILE_PATTERN.search(scope.get("path", "")):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
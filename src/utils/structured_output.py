@@ -0,0 +1,331 @@
+import json
+from collections import Counter, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type, Union
+
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+from utils.logger import MyLogger, logging
+
+logger = MyLogger(name="StructuredOutput", level=logging.INFO, colored=True)
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class IncrementalJSONParser:
+    """
+    增量JSON提取器
+
+    逐段输入模型输出（可以是流式输出的片段），跳过JSON之外的文字
+    （markdown代码块标记、前后缀说明），一旦出现完整的JSON对象/数组即可取出。
+    输出被截断时，partial() 尽量补全已经输出的部分。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.result: Any = None
+        self._reset()
+
+    def _reset(self):
+        self.start: Optional[int] = None
+        self.stack: List[str] = []
+        self.in_string = False
+        self.escape = False
+        # 对象/数组内部逗号的位置及当时的嵌套栈，用于截断补全
+        self.cut_points: List[Tuple[int, Tuple[str, ...]]] = []
+
+    def feed(self, chunk: str) -> Any:
+        """
+        输入一段输出
+
+        Returns:
+            完整的JSON值（之前已经得到过则直接返回），尚不完整时返回None
+        """
+        if self.result is not None:
+            return self.result
+        position = len(self.buffer)
+        self.buffer += chunk
+        return self._scan(position)
+
+    def _scan(self, position: int) -> Any:
+        text = self.buffer
+        i = position
+        while i < len(text):
+            char = text[i]
+            if self.start is None:
+                if char in _CLOSERS:
+                    self.start = i
+                    self.stack = [char]
+                i += 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in _CLOSERS:
+                self.stack.append(char)
+            elif char in "}]":
+                if self.stack and _CLOSERS[self.stack[-1]] == char:
+                    self.stack.pop()
+                if not self.stack:
+                    value = loads_lenient(text[self.start:i + 1])
+                    if value is not None:
+                        self.result = value
+                        return value
+                    # 不是有效的JSON（例如说明文字里的花括号），从下一个字符重新查找
+                    i = self.start + 1
+                    self._reset()
+                    continue
+            elif char == ",":
+                self.cut_points.append((i, tuple(self.stack)))
+            i += 1
+        return None
+
+    def partial(self) -> Any:
+        """补全被截断的输出，尽量保留已经完整输出的部分"""
+        if self.result is not None:
+            return self.result
+        if self.start is None:
+            return None
+
+        text = self.buffer[self.start:]
+        closing = "".join(_CLOSERS[c] for c in reversed(self.stack))
+        candidates = [text + ('"' if self.in_string else "") + closing]
+        # 从最后一个逗号开始往前截断，丢掉不完整的最后一项
+        for cut, stack in reversed(self.cut_points[-20:]):
+            candidates.append(self.buffer[self.start:cut] + "".join(_CLOSERS[c] for c in reversed(stack)))
+
+        for candidate in candidates:
+            value = loads_lenient(candidate)
+            if value is not None:
+                return value
+        return None
+
+
+def _strip_comments_and_trailing_commas(text: str) -> str:
+    """去掉字符串之外的 // 注释和多余的尾逗号（模型经常照抄提示词里的注释）"""
+    result = []
+    in_string = escape = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            result.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            result.append(char)
+        elif text.startswith("//", i):
+            while i < len(text) and text[i] != "\n":
+                i += 1
+            continue
+        elif char in "}]":
+            # 回退到上一个非空白字符，如果是逗号则删除
+            j = len(result) - 1
+            while j >= 0 and result[j].isspace():
+                j -= 1
+            if j >= 0 and result[j] == ",":
+                del result[j]
+            result.append(char)
+        else:
+            result.append(char)
+        i += 1
+    return "".join(result)
+
+
+def loads_lenient(text: str) -> Any:
+    """解析JSON，失败时去掉注释和尾逗号再试一次，仍然失败返回None"""
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        pass
+    try:
+        return json.loads(_strip_comments_and_trailing_commas(text))
+    except (json.JSONDecodeError, TypeError):
+        return None
+
+
+def extract_json(text: Any, allow_partial: bool = True) -> Optional[Any]:
+    """
+    从模型输出中提取JSON
+
+    兼容markdown代码块、前后多余的文字、注释、尾逗号，以及（allow_partial时）被截断的输出
+
+    Returns:
+        解析出的对象，提取失败返回None
+    """
+    if isinstance(text, (dict, list)):
+        return text
+    if not isinstance(text, str):
+        return None
+    value = loads_lenient(text.strip())
+    if value is not None:
+        return value
+    parser = IncrementalJSONParser()
+    value = parser.feed(text)
+    if value is None and allow_partial:
+        value = parser.partial()
+    return value
+
+
+# ---------------------------------------------------------------- 输出结构
+
+class OutputModel(BaseModel):
+    """模型输出结构的基类，保留未声明的字段"""
+    model_config = ConfigDict(extra="allow")
+
+
+class GeneratedQuestion(OutputModel):
+    question: str
+    type: str = ""
+    difficulty: str = ""
+    options: List[str] = []
+    reference_answer: Union[str, List[str]]
+    analysis: str = ""
+    key_points: List[str] = []
+
+
+class QuickAnswer(OutputModel):
+    answer: str
+    key_concepts: List[str] = []
+    references: List[str] = []
+
+
+class AnswerGrade(OutputModel):
+    score: float
+    scoring_points: List[Dict[str, Any]] = []
+    comments: str = ""
+    suggestions: List[str] = []
+    highlights: List[str] = []
+
+
+class PracticeQuestions(OutputModel):
+    questions: List[Dict[str, Any]]
+
+
+class ReviewStep(OutputModel):
+    id: Optional[str] = None
+    content: str
+    schedule_time: Optional[str] = None
+    is_completed: bool = False
+
+
+class ReviewPlan(OutputModel):
+    title: str
+    summary: str = ""
+    steps: List[ReviewStep]
+
+
+# ---------------------------------------------------------------- 解析与修复
+
+class StructuredOutputError(Exception):
+    """模型输出无法解析为要求的结构"""
+
+    def __init__(self, message: str, raw: str = ""):
+        super().__init__(message)
+        self.raw = raw
+
+
+# 结构名 -> 计数：clean（直接解析）、tolerant（容错提取）、repaired（修复成功）、failed、repair_calls
+_stats: Dict[str, Counter] = defaultdict(Counter)
+
+
+def structured_output_stats() -> Dict[str, Dict]:
+    """各输出结构的解析和修复统计"""
+    stats = {}
+    for name, counter in _stats.items():
+        total = counter["clean"] + counter["tolerant"] + counter["repaired"] + counter["failed"]
+        stats[name] = {
+            **dict(counter),
+            "repair_rate": round(counter["repaired"] / total, 4) if total else 0.0,
+            "failure_rate": round(counter["failed"] / total, 4) if total else 0.0,
+        }
+    return stats
+
+
+def _validate(data: Any, schema: Type[OutputModel]) -> Tuple[Optional[Dict], str]:
+    if data is None:
+        return None, "输出中没有找到JSON"
+    try:
+        return schema.model_validate(data).model_dump(), ""
+    except ValidationError as e:
+        errors = "；".join(
+            f"{'.'.join(str(p) for p in error['loc']) or '根对象'}: {error['msg']}" for error in e.errors()
+        )
+        return None, errors
+
+
+REPAIR_PROMPT = """下面是一段应当符合指定JSON结构的输出，但它存在问题：{errors}
+
+JSON结构（JSON Schema）：
+{schema}
+
+原始输出：
+{raw}
+
+请只修正上述问题，保留原有内容，直接返回修正后的JSON，不要输出任何其他内容。"""
+
+
+async def parse_structured(
+    text: Any,
+    schema: Type[OutputModel],
+    repair: Optional[Callable[[str], Awaitable[str]]] = None,
+    max_repairs: int = 1,
+) -> Dict:
+    """
+    把模型输出解析并校验为指定结构
+
+    先容错提取JSON并校验；不通过时把具体的错误和原始输出交给模型做小范围修复，
+    而不是重新生成整个回答
+
+    Args:
+        text: 模型输出
+        schema: 输出结构
+        repair: 无状态的模型调用函数（如 LLMClient.complete），为None时不修复
+        max_repairs: 最多修复次数
+
+    Returns:
+        Dict: 校验后的数据
+
+    Raises:
+        StructuredOutputError: 无法得到符合结构的输出
+    """
+    stats = _stats[schema.__name__]
+    raw = text if isinstance(text, str) else json.dumps(text, ensure_ascii=False, default=str)
+
+    clean = isinstance(text, (dict, list)) or loads_lenient(raw.strip()) is not None
+    data, errors = _validate(extract_json(text), schema)
+    if data is not None:
+        stats["clean" if clean else "tolerant"] += 1
+        return data
+
+    for attempt in range(max_repairs if repair is not None else 0):
+        stats["repair_calls"] += 1
+        logger.warning(f"{schema.__name__} 输出不符合要求，尝试修复（第{attempt + 1}次）: {errors}")
+        prompt = REPAIR_PROMPT.format(
+            errors=errors,
+            schema=json.dumps(schema.model_json_schema(), ensure_ascii=False),
+            raw=raw[:8000],
+        )
+        try:
+            raw = await repair(prompt)
+        except Exception as e:
+            logger.error(f"修复输出时出错: {e}")
+            break
+        data, errors = _validate(extract_json(raw), schema)
+        if data is not None:
+            stats["repaired"] += 1
+            return data
+
+    stats["failed"] += 1
+    raise StructuredOutputError(f"输出格式有误: {errors}", raw)
@@ -0,0 +1,140 @@
+import bisect
+import json
+import os
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from utils.logger import MyLogger, logging
+
+load_dotenv()
+
+logger = MyLogger(name="ToolLatency", level=logging.INFO, colored=True)
+
+# 工具名或服务器名 -> 超时时间（秒）；未列出的工具使用 MCP_TOOL_TIMEOUT
+DEFAULT_TOOL_TIMEOUTS: Dict[str, float] = {
+    # 搜索和网页
+    "bing_search": 20,
+    "fetch_webpage": 30,
+    "fetch": 30,
+    # 论文（下载和解析PDF较慢）
+    "search_papers": 30,
+    "download_paper": 120,
+    "read_paper": 120,
+    # UML渲染（按服务器名匹配，批量生成单独放宽）
+    "UML-MCP-Server": 60,
+    "generate_uml_batch": 120,
+}
+
+# 直方图桶的上界（毫秒），最后一个桶收集所有更慢的调用
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+
+
+class ToolTimeouts:
+    """
+    工具调用超时配置
+
+    键可以是 "服务器:工具名"、工具名或服务器名，按此顺序匹配，都未匹配时使用默认值
+    """
+
+    def __init__(self, default: float = 60, overrides: Optional[Dict[str, float]] = None):
+        self.default = default
+        self.overrides = dict(DEFAULT_TOOL_TIMEOUTS if overrides is None else overrides)
+
+    @classmethod
+    def from_env(cls) -> "ToolTimeouts":
+        """
+        从环境变量创建超时配置
+
+        MCP_TOOL_TIMEOUTS 为JSON，覆盖或补充默认配置，例如 {"fetch": 15, "filesystem": 10, "paper:read_paper": 180}
+        """
+        overrides = dict(DEFAULT_TOOL_TIMEOUTS)
+        value = os.getenv("MCP_TOOL_TIMEOUTS", "")
+        if value:
+            try:
+                overrides.update(json.loads(value))
+            except json.JSONDecodeError as e:
+                logger.warning(f"MCP_TOOL_TIMEOUTS 不是有效的JSON，使用默认配置: {e}")
+        return cls(default=float(os.getenv("MCP_TOOL_TIMEOUT", "60")), overrides=overrides)
+
+    def get(self, server: str, tool_name: str) -> float:
+        for key in (f"{server}:{tool_name}", tool_name, server):
+            if key in self.overrides:
+                return float(self.overrides[key])
+        return self.default
+
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图，分位数按桶上界估算"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float) -> None:
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += n
+            if seen >= target:
+                return round(min(float(bound), self.max_ms), 1)
+        return round(self.max_ms, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        labels = [f"le_{bound}" for bound in LATENCY_BUCKETS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 1) if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 1),
+            "buckets": {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+
+class ToolLatencyStats:
+    """按服务器和工具统计调用延迟、失败和超时次数"""
+
+    def __init__(self):
+        self.histograms: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self.counters: Dict[str, Dict[str, Counter]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, server: str, tool_name: str, elapsed_ms: float, outcome: str = "ok") -> None:
+        """
+        记录一次工具调用
+
+        Args:
+            outcome: ok / error / timeout
+        """
+        with self._lock:
+            histogram = self.histograms.setdefault(server, {}).setdefault(tool_name, LatencyHistogram())
+            histogram.observe(elapsed_ms)
+            self.counters.setdefault(server, {}).setdefault(tool_name, Counter())[outcome] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                server: {
+                    tool_name: {**histogram.stats(), **dict(self.counters[server][tool_name])}
+                    for tool_name, histogram in tools.items()
+                }
+                for server, tools in self.histograms.items()
+            }
+
+
+tool_timeouts = ToolTimeouts.from_env()
+tool_latency = ToolLatencyStats()
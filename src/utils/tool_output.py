@@ -0,0 +1,375 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from utils.logger import MyLogger, logging
+
+load_dotenv()
+
+logger = MyLogger(name="ToolOutput", level=logging.INFO, colored=True)
+
+PROJECT_PATH = os.getenv("PROJECT_PATH", os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# 工具名 -> 写入对话上下文的最大字符数；未列出的工具使用 TOOL_OUTPUT_MAX_CHARS
+DEFAULT_TOOL_OUTPUT_LIMITS: Dict[str, int] = {
+    # 搜索结果
+    "bing_search": 4000,
+    "search_papers": 6000,
+    "search_files": 4000,
+    # 网页和论文全文
+    "fetch": 8000,
+    "fetch_webpage": 8000,
+    "read_paper": 12000,
+    # 文件
+    "read_file": 12000,
+    "read_multiple_files": 16000,
+    "directory_tree": 6000,
+}
+
+# Agent内置的工具：按id分段读取被截取的完整输出
+READ_TOOL_OUTPUT = "read_tool_output"
+
+OUTPUT_ID_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+
+
+def split_chunks(text: str, chunk_size: int) -> List[str]:
+    """按段落把文本切成不超过 chunk_size 字符的片段，过长的段落直接按长度切开"""
+    chunks: List[str] = []
+    current = ""
+    for paragraph in re.split(r"(?<=\n)", text):
+        while len(paragraph) > chunk_size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:chunk_size])
+            paragraph = paragraph[chunk_size:]
+        if len(current) + len(paragraph) > chunk_size:
+            chunks.append(current)
+            current = ""
+        current += paragraph
+    if current.strip():
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def _normalize_vector(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class ToolOutputStore:
+    """过长的工具输出原文，按内容哈希保存在磁盘上，可以按id分段读取"""
+
+    def __init__(self, directory: str, max_age_hours: float = 24, cleanup_interval: float = 600):
+        self.directory = directory
+        self.max_age = max_age_hours * 3600
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0.0
+
+    def _path(self, output_id: str, suffix: str = "txt") -> str:
+        return os.path.join(self.directory, f"{output_id}.{suffix}")
+
+    def put(self, text: str) -> str:
+        """保存原文，返回id（内容相同则id相同）"""
+        output_id = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+        path = self._path(output_id)
+        try:
+            if os.path.exists(path):
+                os.utime(path)
+            else:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"保存工具输出原文失败: {e}")
+        self._maybe_cleanup()
+        return output_id
+
+    def get(self, output_id: str) -> Optional[str]:
+        if not OUTPUT_ID_PATTERN.match(output_id or ""):
+            return None
+        try:
+            with open(self._path(output_id), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get_summary(self, output_id: str) -> Optional[str]:
+        try:
+            with open(self._path(output_id, "summary.txt"), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put_summary(self, output_id: str, summary: str) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(output_id, "summary.txt"), "w", encoding="utf-8") as f:
+                f.write(summary)
+        except OSError as e:
+            logger.warning(f"保存工具输出摘要失败: {e}")
+
+    def _maybe_cleanup(self) -> None:
+        now = time.time()
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = now
+        self.cleanup()
+
+    def cleanup(self) -> int:
+        """删除超过保存时间的原文和摘要，返回删除的文件数"""
+        removed = 0
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+class ToolOutputProcessor:
+    """
+    工具输出后处理
+
+    工具输出超过该工具的字符上限时，原文保存到磁盘并返回id，写入上下文的内容依次尝试：
+    1. 摘要（开启时；同一份输出只摘要一次）
+    2. 与用户问题最相关的片段（按嵌入向量相似度排序，保持原文顺序拼接）
+    3. 开头部分
+    末尾附上原文id，模型需要更多内容时可以调用 read_tool_output 分段读取
+    """
+
+    def __init__(
+        self,
+        store: Optional[ToolOutputStore] = None,
+        limits: Optional[Dict[str, int]] = None,
+        default_limit: int = 8000,
+        chunk_size: int = 1000,
+        max_chunks: int = 64,
+        summarize_min_chars: int = 0,
+        summary_input_chars: int = 32000,
+    ):
+        """
+        初始化工具输出后处理
+
+        Args:
+            store: 原文存储，为None时不处理工具输出
+            limits: 工具名 -> 最大字符数
+            default_limit: 未列出的工具的最大字符数
+            chunk_size: 相关片段的大小（字符）
+            max_chunks: 最多计算多少个片段的嵌入向量，原文很长时相应地增大片段
+            summarize_min_chars: 原文达到多少字符时做摘要，0 表示不做摘要
+            summary_input_chars: 交给模型做摘要的最大字符数（取最相关的片段）
+        """
+        self.store = store
+        self.limits = dict(DEFAULT_TOOL_OUTPUT_LIMITS if limits is None else limits)
+        self.default_limit = default_limit
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.summarize_min_chars = summarize_min_chars
+        self.summary_input_chars = summary_input_chars
+        self.counters: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ToolOutputProcessor":
+        """
+        从环境变量创建
+
+        TOOL_OUTPUT_LIMITS 为JSON，覆盖或补充各工具的字符上限，例如 {"fetch": 4000}
+        """
+        enabled = os.getenv("TOOL_OUTPUT_LIMIT_ENABLED", "true").lower() == "true"
+        limits = dict(DEFAULT_TOOL_OUTPUT_LIMITS)
+        overrides = os.getenv("TOOL_OUTPUT_LIMITS", "")
+        if overrides:
+            try:
+                limits.update(json.loads(overrides))
+            except json.JSONDecodeError as e:
+                logger.warning(f"TOOL_OUTPUT_LIMITS 不是有效的JSON，使用默认配置: {e}")
+        store = ToolOutputStore(
+            os.path.join(PROJECT_PATH, "cache", "tool_outputs"),
+            max_age_hours=float(os.getenv("TOOL_OUTPUT_MAX_AGE_HOURS", "24")),
+        )
+        return cls(
+            store=store if enabled else None,
+            limits=limits,
+            default_limit=int(os.getenv("TOOL_OUTPUT_MAX_CHARS", "8000")),
+            summarize_min_chars=int(os.getenv("TOOL_OUTPUT_SUMMARIZE_MIN_CHARS", "0")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.store is not None
+
+    def limit_for(self, tool_name: str) -> int:
+        return int(self.limits.get(tool_name, self.default_limit))
+
+    def _count(self, **values: int) -> None:
+        with self._lock:
+            self.counters.update(values)
+
+    async def _select_relevant(
+        self,
+        text: str,
+        query: str,
+        budget: int,
+        embed_query: Optional[Callable[[str], Awaitable[List[float]]]],
+        embed_documents: Optional[Callable[[List[str]], Awaitable[List[List[float]]]]],
+    ) -> Optional[str]:
+        """按与问题的相似度挑选片段，总长度不超过 budget；没有嵌入模型或计算失败时返回None"""
+        if not query or embed_query is None or embed_documents is None:
+            return None
+        chunk_size = max(self.chunk_size, math.ceil(len(text) / self.max_chunks))
+        chunks = split_chunks(text, chunk_size)
+        try:
+            query_vector = _normalize_vector(await embed_query(query))
+            vectors = await embed_documents(chunks)
+        except Exception as e:
+            logger.warning(f"计算工具输出片段的嵌入向量失败，改为截取开头: {e}")
+            return None
+
+        scores = [
+            sum(a * b for a, b in zip(query_vector, _normalize_vector(vector)))
+            for vector in vectors
+        ]
+        selected = []
+        used = 0
+        for index in sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True):
+            if used + len(chunks[index]) > budget:
+                if not selected:
+                    selected.append((index, chunks[index][:budget]))
+                continue
+            selected.append((index, chunks[index]))
+            used += len(chunks[index])
+        selected.sort()
+        return "\n...\n".join(chunk.strip("\n") for _, chunk in selected)
+
+    async def process(
+        self,
+        tool_name: str,
+        text: str,
+        query: str = "",
+        embed_query: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+        embed_documents: Optional[Callable[[List[str]], Awaitable[List[List[float]]]]] = None,
+        summarize: Optional[Callable[[str], Awaitable[str]]] = None,
+    ) -> str:
+        """
+        限制工具输出的长度
+
+        Args:
+            tool_name: 工具名
+            text: 工具输出的文本
+            query: 用户的问题，用于挑选相关片段
+            embed_query: 计算问题嵌入向量的异步函数
+            embed_documents: 批量计算片段嵌入向量的异步函数
+            summarize: 对文本做摘要的异步函数
+
+        Returns:
+            不超过该工具字符上限的文本（未超过时原样返回）
+        """
+        limit = self.limit_for(tool_name)
+        if not self.enabled or len(text) <= limit:
+            self._count(passed=1)
+            return text
+
+        output_id = self.store.put(text)
+        note = (
+            f"\n\n[工具输出共 {len(text)} 字符，以上为摘要或节选。完整内容的id为 {output_id}，"
+            f"需要更多内容时可以调用 {READ_TOOL_OUTPUT} 按id和偏移分段读取]"
+        )
+        budget = max(limit - len(note), limit // 2)
+
+        content = None
+        method = "head"
+        if summarize is not None and self.summarize_min_chars and len(text) >= self.summarize_min_chars:
+            content = self.store.get_summary(output_id)
+            if content is None:
+                source = await self._select_relevant(
+                    text, query, self.summary_input_chars, embed_query, embed_documents
+                ) or text[:self.summary_input_chars]
+                try:
+                    content = await summarize(source)
+                    self.store.put_summary(output_id, content)
+                except Exception as e:
+                    logger.warning(f"工具 {tool_name} 的输出摘要失败: {e}")
+            if content is not None:
+                content = content[:budget]
+                method = "summarized"
+        if content is None:
+            content = await self._select_relevant(text, query, budget, embed_query, embed_documents)
+            if content is not None:
+                method = "ranked"
+        if content is None:
+            content = text[:budget]
+
+        self._count(limited=1, **{method: 1}, chars_in=len(text), chars_out=len(content) + len(note))
+        logger.info(
+            f"工具 {logger.color_text(tool_name, 'CYAN')} 的输出从 {len(text)} 字符缩减到 "
+            f"{logger.color_text(str(len(content) + len(note)), 'YELLOW')} 字符（{method}）"
+        )
+        return content + note
+
+    def read(self, output_id: str, offset: int = 0, length: Optional[int] = None) -> str:
+        """按id分段读取完整输出（read_tool_output 工具）"""
+        text = self.store.get(output_id) if self.enabled else None
+        if text is None:
+            return f"未找到id为 {output_id} 的工具输出，可能已过期，请重新调用原工具"
+        try:
+            length = min(int(length or self.default_limit), self.default_limit)
+            offset = max(int(offset or 0), 0)
+        except (TypeError, ValueError):
+            return "offset 和 length 必须是整数"
+        segment = text[offset:offset + length]
+        self._count(reads=1)
+        end = offset + len(segment)
+        more = f"，继续读取请使用 offset={end}" if end < len(text) else "，已读到末尾"
+        return f"[第 {offset}-{end} 字符，共 {len(text)} 字符{more}]\n{segment}"
+
+    def tool_schema(self) -> Dict[str, Any]:
+        """read_tool_output 的工具定义，与MCP工具的格式一致"""
+        return {
+            "type": "function",
+            "function": {
+                "name": READ_TOOL_OUTPUT,
+                "description": "分段读取之前被截取的工具输出的完整内容",
+                "input_schema": {
+                    "type": "object",
+                    "properties": {
+                        "output_id": {"type": "string", "description": "工具输出末尾给出的id"},
+                        "offset": {"type": "integer", "description": "起始字符位置，默认为0"},
+                        "length": {"type": "integer", "description": f"读取的字符数，最多{self.default_limit}"},
+                    },
+                    "required": ["output_id"],
+                },
+            },
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+        chars_in = counters.get("chars_in", 0)
+        return {
+            "enabled": self.enabled,
+            "saved_chars": chars_in - counters.get("chars_out", 0),
+            **counters,
+        }
+
+
+tool_output_processor = ToolOutputProcessor.from_env()
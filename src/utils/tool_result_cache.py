@@ -0,0 +1,242 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from utils.logger import MyLogger, logging
+
+load_dotenv()
+
+logger = MyLogger(name="ToolResultCache", level=logging.INFO, colored=True)
+
+PROJECT_PATH = os.getenv("PROJECT_PATH", os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# 工具名 -> 缓存有效期（秒），None 表示永久有效；未列出的工具不缓存
+DEFAULT_TOOL_TTLS: Dict[str, Optional[float]] = {
+    # 搜索和网页
+    "bing_search": 3600,
+    "fetch_webpage": 3600,
+    "fetch": 3600,
+    # 论文
+    "search_papers": 3600,
+    "read_paper": None,
+    # 文件系统只读操作（写操作会使同一服务器的缓存失效）
+    "read_file": 300,
+    "read_multiple_files": 300,
+    "get_file_info": 60,
+    "list_directory": 60,
+    "directory_tree": 60,
+    "search_files": 60,
+    # 时间
+    "convert_time": 86400,
+}
+
+# 有副作用的工具：调用后清空同一服务器的缓存
+WRITE_TOOLS = {"write_file", "edit_file", "create_directory", "move_file", "download_paper"}
+
+
+def canonical_args(args: Optional[Dict]) -> str:
+    """参数的规范JSON表示（键排序、紧凑分隔符），与参数顺序和空白无关"""
+    return json.dumps(args or {}, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ToolResultCache:
+    """
+    MCP工具调用结果缓存
+
+    以 (服务器, 工具名, 规范化参数) 为键缓存幂等工具的成功结果，每个工具有自己的有效期，
+    写类工具调用后清空同一服务器的缓存。按条目数和总大小做LRU淘汰，并持久化到磁盘。
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttls: Optional[Dict[str, Optional[float]]] = None,
+        max_entries: int = 1000,
+        max_bytes: int = 50 * 1024 * 1024,
+        save_interval: float = 30,
+    ):
+        """
+        初始化工具结果缓存
+
+        Args:
+            path: 持久化文件路径，为None时只缓存在内存中
+            ttls: 工具名 -> 有效期（秒），None 表示永久，0 或未列出表示不缓存
+            max_entries: 最大条目数
+            max_bytes: 缓存结果的最大总大小（按JSON长度计算）
+            save_interval: 两次写盘的最小间隔（秒）
+        """
+        self.path = path
+        self.ttls = dict(DEFAULT_TOOL_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.save_interval = save_interval
+
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.total_bytes = 0
+        self.counters: Counter = Counter()
+        # 工具名 -> 命中/未命中次数
+        self.tool_counters: Dict[str, Counter] = {}
+        self._dirty = False
+        self._last_saved = 0.0
+        self._lock = threading.Lock()
+
+        self._load()
+        if self.path:
+            atexit.register(self.save)
+
+    @classmethod
+    def from_env(cls) -> "ToolResultCache":
+        """
+        从环境变量创建缓存
+
+        TOOL_CACHE_TTLS 为JSON，覆盖或补充默认的有效期，例如 {"bing_search": 600, "read_file": 0}
+        """
+        enabled = os.getenv("TOOL_CACHE_ENABLED", "true").lower() == "true"
+        ttls = dict(DEFAULT_TOOL_TTLS)
+        overrides = os.getenv("TOOL_CACHE_TTLS", "")
+        if overrides:
+            try:
+                ttls.update(json.loads(overrides))
+            except json.JSONDecodeError as e:
+                logger.warning(f"TOOL_CACHE_TTLS 不是有效的JSON，使用默认配置: {e}")
+        return cls(
+            path=os.path.join(PROJECT_PATH, "cache", "tool_cache.json") if enabled else None,
+            ttls=ttls if enabled else {},
+            max_entries=int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "1000")),
+            max_bytes=int(float(os.getenv("TOOL_CACHE_MAX_MB", "50")) * 1024 * 1024),
+        )
+
+    @staticmethod
+    def make_key(server: str, tool_name: str, args: Optional[Dict]) -> str:
+        raw = f"{server}\n{tool_name}\n{canonical_args(args)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def is_cacheable(self, tool_name: str) -> bool:
+        return tool_name in self.ttls and self.ttls[tool_name] != 0
+
+    def _is_fresh(self, entry: Dict) -> bool:
+        ttl = self.ttls.get(entry["tool"], 0)
+        return ttl is None or (ttl > 0 and time.time() - entry["created_at"] < ttl)
+
+    def _count(self, tool_name: str, name: str) -> None:
+        self.counters[name] += 1
+        self.tool_counters.setdefault(tool_name, Counter())[name] += 1
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for key, entry in data.get("entries", []):
+                if self._is_fresh(entry):
+                    self.entries[key] = entry
+                    self.total_bytes += entry["size"]
+            logger.info(f"已加载 {logger.color_text(str(len(self.entries)), 'YELLOW')} 条工具调用缓存")
+        except Exception as e:
+            logger.warning(f"加载工具调用缓存失败: {e}")
+
+    def save(self) -> None:
+        """写盘（先写临时文件再替换，避免写到一半的文件）"""
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            snapshot = list(self.entries.items())
+            self._dirty = False
+            self._last_saved = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"entries": snapshot}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"保存工具调用缓存失败: {e}")
+
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["size"]
+
+    def get(self, server: str, tool_name: str, args: Optional[Dict]) -> Optional[Dict]:
+        """
+        查询缓存
+
+        Returns:
+            缓存的调用结果（CallToolResult 的JSON表示），未命中或工具不缓存时返回None
+        """
+        if not self.is_cacheable(tool_name):
+            return None
+        key = self.make_key(server, tool_name, args)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._is_fresh(entry):
+                self.entries.move_to_end(key)
+                self._count(tool_name, "hits")
+                return entry["result"]
+            if entry is not None:
+                self._remove(key)
+                self.counters["expired"] += 1
+            self._count(tool_name, "misses")
+            return None
+
+    def put(self, server: str, tool_name: str, args: Optional[Dict], result: Dict) -> None:
+        """写入缓存（result 为 CallToolResult 的JSON表示）"""
+        if not self.is_cacheable(tool_name):
+            return
+        size = len(json.dumps(result, ensure_ascii=False, default=str))
+        if size > self.max_bytes:
+            return
+        key = self.make_key(server, tool_name, args)
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = {
+                "server": server,
+                "tool": tool_name,
+                "args": canonical_args(args),
+                "result": result,
+                "size": size,
+                "created_at": time.time(),
+            }
+            self.total_bytes += size
+            self.counters["stores"] += 1
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+            self._dirty = True
+            should_save = time.time() - self._last_saved >= self.save_interval
+
+        if should_save:
+            self.save()
+
+    def invalidate_server(self, server: str) -> int:
+        """清空某个服务器的全部缓存，返回删除的条目数"""
+        with self._lock:
+            keys = [key for key, entry in self.entries.items() if entry["server"] == server]
+            for key in keys:
+                self._remove(key)
+            if keys:
+                self.counters["invalidations"] += len(keys)
+                self._dirty = True
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "total_mb": round(self.total_bytes / 1024 / 1024, 2),
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+            **dict(self.counters),
+            "tools": {name: dict(counter) for name, counter in self.tool_counters.items()},
+        }
+
+
+tool_result_cache = ToolResultCache.from_env()
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from utils.logger import MyLogger, logging
+from utils.tool_output import READ_TOOL_OUTPUT
+
+load_dotenv()
+
+logger = MyLogger(name="ToolSelector", level=logging.INFO, colored=True)
+
+
+def estimate_tokens(tools: List[Dict]) -> int:
+    """粗略估算工具定义占用的token数（按JSON长度计算，中文约1.5字符一个token，英文约4字符一个token）"""
+    if not tools:
+        return 0
+    text = json.dumps(tools, ensure_ascii=False)
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return math.ceil(non_ascii / 1.5 + (len(text) - non_ascii) / 4)
+
+
+def _tool_name(tool: Dict) -> str:
+    return tool["function"]["name"]
+
+
+def _tool_text(tool: Dict) -> str:
+    function = tool.get("function", {})
+    return f"{function.get('name', '')}: {function.get('description') or ''}"
+
+
+def _normalize_vector(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class ToolSelector:
+    """
+    按请求挑选工具
+
+    每次对话只把与问题相关的少量工具定义发给模型：先按Agent的白名单过滤，
+    工具仍多于 max_tools 时，按问题与工具描述的嵌入向量相似度取前 max_tools 个。
+    工具描述的向量只计算一次，在所有Agent之间共享。
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_tools: int = 8,
+        min_score: float = 0.0,
+        always_include: Iterable[str] = (),
+        allowlists: Optional[Dict[str, List[str]]] = None,
+    ):
+        """
+        初始化工具选择器
+
+        Args:
+            enabled: 为False时只按白名单过滤，不做相似度筛选
+            max_tools: 每次请求最多发送的工具数
+            min_score: 相似度低于该值的工具不发送（0 表示不限制）
+            always_include: 总是发送的工具名（不占 max_tools 名额）
+            allowlists: Agent类名 -> 白名单，覆盖Agent自带的白名单
+        """
+        self.enabled = enabled
+        self.max_tools = max_tools
+        self.min_score = min_score
+        self.always_include = set(always_include)
+        self.allowlists = dict(allowlists or {})
+        # 工具描述的哈希 -> 归一化后的向量
+        self._vectors: Dict[str, List[float]] = {}
+        self.counters: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, always_include: Iterable[str] = ()) -> "ToolSelector":
+        """
+        从环境变量创建
+
+        TOOL_ALLOWLISTS 为JSON，按Agent类名覆盖白名单，例如 {"TestAgent": ["bing_search"]}
+        """
+        allowlists = {}
+        value = os.getenv("TOOL_ALLOWLISTS", "")
+        if value:
+            try:
+                allowlists = json.loads(value)
+            except json.JSONDecodeError as e:
+                logger.warning(f"TOOL_ALLOWLISTS 不是有效的JSON，使用Agent自带的白名单: {e}")
+        return cls(
+            enabled=os.getenv("TOOL_SELECT_ENABLED", "true").lower() == "true",
+            max_tools=int(os.getenv("TOOL_SELECT_MAX", "8")),
+            min_score=float(os.getenv("TOOL_SELECT_MIN_SCORE", "0")),
+            always_include=always_include,
+            allowlists=allowlists,
+        )
+
+    def allowlist_for(self, agent_name: str, default: Optional[List[str]] = None) -> Optional[List[str]]:
+        return self.allowlists.get(agent_name, default)
+
+    @staticmethod
+    def _key(tool: Dict) -> str:
+        return hashlib.sha256(_tool_text(tool).encode("utf-8")).hexdigest()
+
+    async def _ensure_vectors(
+        self,
+        tools: List[Dict],
+        embed_documents: Callable[[List[str]], Awaitable[List[List[float]]]],
+    ) -> None:
+        """计算还没有向量的工具描述"""
+        missing = {self._key(tool): _tool_text(tool) for tool in tools if self._key(tool) not in self._vectors}
+        if not missing:
+            return
+        keys = list(missing)
+        vectors = await embed_documents([missing[key] for key in keys])
+        for key, vector in zip(keys, vectors):
+            self._vectors[key] = _normalize_vector(vector)
+        logger.info(f"已计算 {logger.color_text(str(len(keys)), 'YELLOW')} 个工具描述的向量")
+
+    async def select(
+        self,
+        tools: List[Dict],
+        query: str,
+        allowlist: Optional[Iterable[str]] = None,
+        always_include: Iterable[str] = (),
+        tool_servers: Optional[Dict[str, str]] = None,
+        embed_query: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+        embed_documents: Optional[Callable[[List[str]], Awaitable[List[List[float]]]]] = None,
+    ) -> List[Dict]:
+        """
+        挑选本次请求发送的工具
+
+        Args:
+            tools: Agent的全部工具定义
+            query: 用户的问题
+            allowlist: 白名单，元素可以是工具名或服务器名，为None时不限制
+            always_include: 本次请求总是发送的工具名（Agent提示词中要求使用的工具），不占 max_tools 名额
+            tool_servers: 工具名 -> 服务器名
+            embed_query: 计算问题嵌入向量的异步函数
+            embed_documents: 批量计算工具描述嵌入向量的异步函数
+
+        Returns:
+            工具定义列表（保持原有顺序）；计算向量失败时返回白名单过滤后的全部工具
+        """
+        tool_servers = tool_servers or {}
+        always_include = self.always_include | set(always_include)
+        if allowlist is not None:
+            allowed = set(allowlist) | always_include
+            tools = [
+                tool for tool in tools
+                if _tool_name(tool) in allowed or tool_servers.get(_tool_name(tool)) in allowed
+            ]
+
+        candidates = [tool for tool in tools if _tool_name(tool) not in always_include]
+        if not self.enabled or len(candidates) <= self.max_tools or not query:
+            return tools
+        if embed_query is None or embed_documents is None:
+            return tools
+
+        try:
+            await self._ensure_vectors(candidates, embed_documents)
+            query_vector = _normalize_vector(await embed_query(query))
+        except Exception as e:
+            logger.warning(f"计算工具相似度失败，发送全部工具: {e}")
+            with self._lock:
+                self.counters["fallbacks"] += 1
+            return tools
+
+        scored = []
+        for index, tool in enumerate(candidates):
+            vector = self._vectors[self._key(tool)]
+            scored.append((sum(a * b for a, b in zip(query_vector, vector)), index))
+        scored.sort(reverse=True)
+        chosen = {
+            _tool_name(candidates[index]) for rank, (score, index) in enumerate(scored)
+            if rank < self.max_tools and (not self.min_score or score >= self.min_score)
+        }
+        # 按原有顺序返回：工具列表顺序稳定，模型服务的提示词前缀缓存才能命中
+        return [tool for tool in tools if _tool_name(tool) in chosen or _tool_name(tool) in always_include]
+
+    def record(self, agent_name: str, all_tools: List[Dict], selected: List[Dict], turns: int) -> None:
+        """记录并打印一次请求节省的token数（每一轮工具调用都会重复发送工具定义）"""
+        saved_per_turn = estimate_tokens(all_tools) - estimate_tokens(selected)
+        with self._lock:
+            self.counters["requests"] += 1
+            self.counters["turns"] += turns
+            self.counters["tools_available"] += len(all_tools)
+            self.counters["tools_sent"] += len(selected)
+            self.counters["tokens_saved"] += saved_per_turn * turns
+        if saved_per_turn > 0:
+            logger.info(
+                f"{agent_name} 发送 {len(selected)}/{len(all_tools)} 个工具，"
+                f"每轮约节省 {saved_per_turn} tokens，本次 {turns} 轮共约节省 "
+                f"{logger.color_text(str(saved_per_turn * turns), 'YELLOW')} tokens"
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+        requests = counters.get("requests", 0)
+        return {
+            "enabled": self.enabled,
+            "max_tools": self.max_tools,
+            "cached_vectors": len(self._vectors),
+            "avg_tools_sent": round(counters.get("tools_sent", 0) / requests, 2) if requests else 0.0,
+            **counters,
+        }
+
+
+# 读取完整工具输出的内置工具很小，总是发送
+tool_selector = ToolSelector.from_env(always_include=[READ_TOOL_OUTPUT])
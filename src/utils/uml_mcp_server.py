@@ -3,12 +3,15 @@
 UML-MCP-Server: UML图制作工具的MCP服务器实现 (修复版)
 """
 
+import asyncio
 import base64
+import hashlib
 import json
 import os
+import re
 import sys
 import zlib
-import requests
+import httpx
 import logging
 import datetime
 from typing import Any, Dict, List, Optional, Tuple, Union
@@ -21,6 +24,19 @@ PROJECT_PATH = os.getenv("PROJECT_PATH")
 # 从环境变量获取UML服务器域名，默认为localhost
 PLANTUML_HOST = os.getenv("PLANTUML_HOST", "localhost")
 PLANTUML_PORT = os.getenv("PLANTUML_PORT", "8080")
+# 与PlantUML服务之间保持的最大连接数
+PLANTUML_MAX_CONNECTIONS = int(os.getenv("PLANTUML_MAX_CONNECTIONS", "8"))
+# UML图缓存目录的最大总大小（MB）
+UML_CACHE_MAX_MB = float(os.getenv("UML_CACHE_MAX_MB", "200"))
+# 静态目录中UML图文件名使用的哈希长度
+STATIC_HASH_LENGTH = 20
+# 渲染方式：server（请求PlantUML服务）或 local（本地常驻的PlantUML进程）
+UML_RENDER_BACKEND = os.getenv("UML_RENDER_BACKEND", "server").lower()
+# 本地渲染使用的plantuml.jar路径和java命令
+PLANTUML_JAR = os.getenv("PLANTUML_JAR", "")
+PLANTUML_JAVA = os.getenv("PLANTUML_JAVA", "java")
+# 每种输出格式常驻的本地PlantUML进程数
+PLANTUML_LOCAL_WORKERS = int(os.getenv("PLANTUML_LOCAL_WORKERS", "2"))
 
 
 # 添加src目录到Python路径
@@ -39,9 +55,12 @@ def setup_logging():
     current_date = datetime.datetime.now().strftime("%Y-%m-%d")
     log_file = os.path.join(log_dir, f"uml_mcp_server_{current_date}.log")
     
-    # 配置根日志记录器
-    logger = logging.getLogger()
+    # 使用独立的日志记录器，在进程内加载时不影响主程序的根日志记录器
+    logger = logging.getLogger("uml_mcp_server")
     logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if logger.handlers:
+        return logger
     
     # 创建文件处理器
     file_handler = logging.FileHandler(log_file, encoding='utf-8')
@@ -75,6 +94,12 @@ UML_TYPES = [
     "state", "component", "deployment", "object"
 ]
 
+# 支持的图片格式
+OUTPUT_FORMATS = ["png", "svg"]
+
+# 批量生成时一次最多处理的图数量
+UML_BATCH_MAX = int(os.getenv("UML_BATCH_MAX", "10"))
+
 # 类图示例
 CLASS_EXAMPLES = {
     "user_order": """
@@ -156,6 +181,13 @@ Cart --> Customer: Order Confirmation
 """
 }
 
+# 标准base64的字符映射: ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/
+# PlantUML使用的字符映射: 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_
+_BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_PLANTUML_ALPHABET = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+_ENCODE_TABLE = bytes.maketrans(_BASE64_ALPHABET, _PLANTUML_ALPHABET)
+_DECODE_TABLE = bytes.maketrans(_PLANTUML_ALPHABET, _BASE64_ALPHABET)
+
 def plantuml_encode(text):
     """
     将PlantUML文本编码为URL安全的字符串
@@ -165,85 +197,567 @@ def plantuml_encode(text):
     # 使用官方推荐的编码方式
     compressed = zlib.compress(text.encode('utf-8'))
     
-    # 标准base64的字符映射: ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/
-    # PlantUML使用的字符映射: 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_
-    
-    # 首先使用标准base64编码
-    standard_b64 = base64.b64encode(compressed).decode('ascii')
-    
-    # 然后转换为PlantUML的编码
-    result = ""
-    for c in standard_b64:
-        if c == 'A': result += '0'
-        elif c == 'B': result += '1'
-        elif c == 'C': result += '2'
-        elif c == 'D': result += '3'
-        elif c == 'E': result += '4'
-        elif c == 'F': result += '5'
-        elif c == 'G': result += '6'
-        elif c == 'H': result += '7'
-        elif c == 'I': result += '8'
-        elif c == 'J': result += '9'
-        elif c == 'K': result += 'A'
-        elif c == 'L': result += 'B'
-        elif c == 'M': result += 'C'
-        elif c == 'N': result += 'D'
-        elif c == 'O': result += 'E'
-        elif c == 'P': result += 'F'
-        elif c == 'Q': result += 'G'
-        elif c == 'R': result += 'H'
-        elif c == 'S': result += 'I'
-        elif c == 'T': result += 'J'
-        elif c == 'U': result += 'K'
-        elif c == 'V': result += 'L'
-        elif c == 'W': result += 'M'
-        elif c == 'X': result += 'N'
-        elif c == 'Y': result += 'O'
-        elif c == 'Z': result += 'P'
-        elif c == 'a': result += 'Q'
-        elif c == 'b': result += 'R'
-        elif c == 'c': result += 'S'
-        elif c == 'd': result += 'T'
-        elif c == 'e': result += 'U'
-        elif c == 'f': result += 'V'
-        elif c == 'g': result += 'W'
-        elif c == 'h': result += 'X'
-        elif c == 'i': result += 'Y'
-        elif c == 'j': result += 'Z'
-        elif c == 'k': result += 'a'
-        elif c == 'l': result += 'b'
-        elif c == 'm': result += 'c'
-        elif c == 'n': result += 'd'
-        elif c == 'o': result += 'e'
-        elif c == 'p': result += 'f'
-        elif c == 'q': result += 'g'
-        elif c == 'r': result += 'h'
-        elif c == 's': result += 'i'
-        elif c == 't': result += 'j'
-        elif c == 'u': result += 'k'
-        elif c == 'v': result += 'l'
-        elif c == 'w': result += 'm'
-        elif c == 'x': result += 'n'
-        elif c == 'y': result += 'o'
-        elif c == 'z': result += 'p'
-        elif c == '0': result += 'q'
-        elif c == '1': result += 'r'
-        elif c == '2': result += 's'
-        elif c == '3': result += 't'
-        elif c == '4': result += 'u'
-        elif c == '5': result += 'v'
-        elif c == '6': result += 'w'
-        elif c == '7': result += 'x'
-        elif c == '8': result += 'y'
-        elif c == '9': result += 'z'
-        elif c == '+': result += '-'
-        elif c == '/': result += '_'
-        elif c == '=': pass  # 忽略填充字符
-        else: result += c
-    
-    return result
+    # 先做标准base64编码，再按映射表整体替换为PlantUML的字符，并去掉填充字符
+    return base64.b64encode(compressed).translate(_ENCODE_TABLE, b"=").decode('ascii')
+
+def plantuml_decode(encoded):
+    """
+    将plantuml_encode编码的字符串还原为PlantUML文本
+    """
+    standard_b64 = encoded.encode('ascii').translate(_DECODE_TABLE)
+    standard_b64 += b"=" * (-len(standard_b64) % 4)
+    compressed = base64.b64decode(standard_b64)
+    try:
+        return zlib.decompress(compressed).decode('utf-8')
+    except zlib.error:
+        # 其他工具生成的编码使用不带zlib头的deflate数据
+        return zlib.decompress(compressed, -zlib.MAX_WBITS).decode('utf-8')
+
+def wrap_uml_code(code):
+    """确保代码包含 @startuml 和 @enduml"""
+    if "@startuml" not in code:
+        code = f"@startuml\n{code}"
+    if "@enduml" not in code:
+        code = f"{code}\n@enduml"
+    return code
+
+
+# ---------------------------------------------------------------- 语法预检查
+
+# 只能出现在其他类型图中的声明关键字，出现时PlantUML会按其他类型解析或者直接报错
+FOREIGN_KEYWORDS = {
+    "class": {"participant", "activate", "deactivate", "autonumber", "usecase"},
+    "sequence": {"class", "interface", "enum", "abstract", "usecase", "state"},
+    "activity": {"participant", "activate", "deactivate", "class", "interface", "enum", "usecase"},
+    "usecase": {"participant", "activate", "deactivate", "autonumber", "class", "interface", "enum"},
+    "state": {"participant", "activate", "deactivate", "autonumber", "class", "interface", "enum", "usecase"},
+    "component": {"participant", "activate", "deactivate", "autonumber"},
+    "deployment": {"participant", "activate", "deactivate", "autonumber"},
+    "object": {"participant", "activate", "deactivate", "autonumber"},
+}
+
+# 活动图中需要成对出现的块：起始关键字 -> 可用的结束关键字
+ACTIVITY_BLOCKS = {
+    "if": ("endif", "end if"),
+    "while": ("endwhile", "end while"),
+    "repeat": ("repeat while",),
+    "fork": ("end fork", "fork end", "end merge"),
+    "split": ("end split", "split end"),
+    "switch": ("endswitch", "end switch"),
+}
+# 块中间的分支，不是新的块
+ACTIVITY_BRANCHES = ("fork again", "split again", "repeat while")
+
+# 序列图中以 end 结束的分组
+SEQUENCE_GROUPS = {"alt", "opt", "loop", "par", "break", "critical", "group", "box"}
+
+# 多行文本块：起始关键字 -> 结束标记
+TEXT_BLOCKS = {
+    "note": ("end note", "endnote"),
+    "rnote": ("end rnote", "endrnote"),
+    "hnote": ("end hnote", "endhnote"),
+    "legend": ("end legend", "endlegend"),
+    "title": ("end title", "endtitle"),
+    "header": ("end header", "endheader"),
+    "footer": ("end footer", "endfooter"),
+    "ref": ("end ref", "endref"),
+}
+
+# 多行文本块起始行中可以跟在关键字之后的位置说明；有其他文字（或引号、冒号）时是单行写法，
+# 例如 note "文字" as N1、header 页眉、note left of A : 文字
+_POSITION_WORDS = {"left", "right", "top", "bottom", "center", "over", "of", "on", "link", "across", "as"}
+TEXT_BLOCK_POSITIONS = {
+    "note": _POSITION_WORDS,
+    "rnote": _POSITION_WORDS,
+    "hnote": _POSITION_WORDS,
+    "legend": {"left", "right", "top", "bottom", "center"},
+    "header": {"left", "right", "center"},
+    "footer": {"left", "right", "center"},
+    "ref": {"over"},
+    "title": set(),
+}
+
+
+def _opens_text_block(keyword, rest):
+    """关键字之后的部分（rest）是否表示一个以结束标记收尾的多行文本块"""
+    if ":" in rest or '"' in rest:
+        return False
+    words = rest.replace(",", " ").split()
+    if not words or words[0].startswith("#"):
+        return True
+    positions = TEXT_BLOCK_POSITIONS[keyword]
+    if words[0] not in positions:
+        return False
+    if keyword in ("note", "rnote", "hnote", "ref"):
+        # note left of A / note over A, B / note as N1：位置之后可以跟参与者、别名和颜色
+        return True
+    return all(word in positions or word.startswith("#") for word in words)
+
+
+_ARROW_PATTERN = re.compile(r"[-.=]+>|<[-.=]+|--|\.\.")
+
+# 语法检查统计
+validation_stats = {
+    "checked": 0,
+    "rejected": 0,
+    # 上一次被拒绝后，下一次提交即通过检查的次数（模型根据行号错误一次修正）
+    "fixed_on_next_attempt": 0,
+}
+# 上一次检查未通过的图类型
+_last_rejected_types = set()
+
+
+def _strip_strings(line):
+    """去掉双引号括起的文字，返回 (剩余部分, 引号是否闭合)"""
+    parts = line.split('"')
+    return "".join(parts[::2]), len(parts) % 2 == 1
 
-def generate_uml_image(uml_code, diagram_type=None, output_dir=None):
+
+def validate_uml(code, diagram_type=None):
+    """
+    在渲染之前检查PlantUML代码的常见语法错误
+
+    检查 @startuml/@enduml 是否成对、花括号是否匹配、引号是否闭合、
+    活动图和序列图的块是否闭合，以及是否使用了其他类型图的关键字
+
+    Args:
+        code: 完整的PlantUML代码（包含 @startuml 和 @enduml）
+        diagram_type: UML图类型，为None时不检查关键字
+
+    Returns:
+        List[Dict]: 错误列表，每项为 {"line": 行号, "message": 错误说明}，没有错误时为空
+    """
+    errors = []
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    foreign = FOREIGN_KEYWORDS.get(diagram_type, set())
+
+    start_line = end_line = None
+    braces = []  # 未闭合的 { 所在行号
+    blocks = []  # 未闭合的块：(起始关键字, 期望的结束关键字, 行号)
+    text_block = None  # 正在读取的多行文本块：(结束标记, 起始行号)
+    in_comment = False
+
+    for number, raw in enumerate(lines, start=1):
+        line = raw.strip()
+        lower = line.lower()
+
+        # 块注释 /' ... '/
+        if in_comment:
+            if "'/" in line:
+                in_comment = False
+            continue
+        if line.startswith("/'"):
+            in_comment = "'/" not in line[2:]
+            continue
+        if not line or line.startswith("'"):
+            continue
+
+        if lower.startswith("@startuml"):
+            if start_line is not None:
+                errors.append({"line": number, "message": "重复的 @startuml，一段代码只能包含一张图"})
+            start_line = number
+            continue
+        if lower.startswith("@enduml"):
+            if start_line is None:
+                errors.append({"line": number, "message": "@enduml 出现在 @startuml 之前"})
+            elif end_line is not None:
+                errors.append({"line": number, "message": "重复的 @enduml"})
+            end_line = number
+            continue
+        if start_line is None:
+            errors.append({"line": number, "message": "@startuml 之前不能有内容"})
+            continue
+        if end_line is not None:
+            errors.append({"line": number, "message": "@enduml 之后不能有内容"})
+            continue
+
+        # 多行文本块中的内容不做检查
+        if text_block is not None:
+            if lower in text_block[0]:
+                text_block = None
+            continue
+        keyword = re.split(r"[\s(:<{\[\"]", lower, maxsplit=1)[0]
+        rest = lower[len(keyword):]
+        # left header / center footer：位置写在关键字之前
+        if keyword in ("left", "right", "center"):
+            prefixed = rest.split(None, 1)
+            if prefixed and prefixed[0] in ("header", "footer"):
+                keyword = prefixed[0]
+                rest = prefixed[1] if len(prefixed) > 1 else ""
+        if keyword in TEXT_BLOCKS and _opens_text_block(keyword, rest):
+            text_block = (TEXT_BLOCKS[keyword], number)
+            continue
+
+        if keyword in foreign:
+            errors.append({
+                "line": number,
+                "message": f"{diagram_type} 图中不能使用 {keyword}，它属于其他类型的UML图",
+            })
+
+        # 活动图的标签（:文字;）和连线上的说明文字可以包含任意字符，不检查括号和引号
+        if line.startswith(":"):
+            continue
+        structural = line
+        if _ARROW_PATTERN.search(line) and ":" in line:
+            structural = line.split(":", 1)[0]
+        structural, quotes_closed = _strip_strings(structural)
+        if not quotes_closed:
+            errors.append({"line": number, "message": "引号没有闭合"})
+            continue
+
+        for char in structural:
+            if char == "{":
+                braces.append(number)
+            elif char == "}":
+                if braces:
+                    braces.pop()
+                else:
+                    errors.append({"line": number, "message": "多余的 }，没有与之匹配的 {"})
+
+        if diagram_type == "activity":
+            if keyword in ACTIVITY_BLOCKS and not lower.startswith(ACTIVITY_BRANCHES):
+                blocks.append((keyword, ACTIVITY_BLOCKS[keyword][0], number))
+            elif not lower.startswith(ACTIVITY_BRANCHES[:2]):
+                for opener, closers in ACTIVITY_BLOCKS.items():
+                    if lower.startswith(closers):
+                        if blocks and blocks[-1][0] == opener:
+                            blocks.pop()
+                        else:
+                            errors.append({"line": number, "message": f"{line} 没有对应的 {opener}"})
+                        break
+        elif diagram_type == "sequence":
+            if keyword in SEQUENCE_GROUPS:
+                blocks.append((keyword, "end", number))
+            elif lower == "end" or lower.startswith("end box"):
+                if blocks:
+                    blocks.pop()
+                else:
+                    errors.append({"line": number, "message": "end 没有对应的分组（alt/opt/loop/par/group等）"})
+
+    if start_line is None:
+        errors.append({"line": 1, "message": "缺少 @startuml"})
+    if end_line is None:
+        errors.append({"line": len(lines), "message": "缺少 @enduml"})
+    if text_block is not None:
+        errors.append({"line": text_block[1], "message": f"多行文本块没有用 {text_block[0][0]} 结束"})
+    for number in braces:
+        errors.append({"line": number, "message": "{ 没有闭合"})
+    for opener, closer, number in blocks:
+        errors.append({"line": number, "message": f"{opener} 没有用 {closer} 结束"})
+
+    errors.sort(key=lambda error: error["line"])
+    return errors
+
+
+def check_uml_syntax(code, diagram_type=None):
+    """检查语法并记录统计，返回错误列表"""
+    errors = validate_uml(code, diagram_type)
+    key = diagram_type or "unknown"
+    validation_stats["checked"] += 1
+    if errors:
+        validation_stats["rejected"] += 1
+        _last_rejected_types.add(key)
+        logger.warning(f"PlantUML语法检查未通过（{key}），已跳过渲染: {errors[:3]}")
+    elif key in _last_rejected_types:
+        _last_rejected_types.discard(key)
+        validation_stats["fixed_on_next_attempt"] += 1
+    return errors
+
+
+def normalize_uml(text):
+    """规范化PlantUML代码：统一换行，去掉行尾空白和首尾空行，使只有格式差异的代码得到相同的缓存键"""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+class DiagramCache:
+    """
+    UML图片的磁盘缓存
+
+    以 规范化后的PlantUML代码+输出格式 的哈希作为文件名，
+    总大小超过上限时按最近使用时间从旧到新删除
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(
+            entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file()
+        )
+
+    @staticmethod
+    def make_key(uml_code, output_format):
+        return hashlib.sha256(f"{output_format}\n{normalize_uml(uml_code)}".encode("utf-8")).hexdigest()
+
+    def _path(self, key, output_format):
+        return os.path.join(self.cache_dir, f"{key}.{output_format}")
+
+    def get(self, key, output_format):
+        path = self._path(key, output_format)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        # 更新修改时间，淘汰时按最近使用时间排序
+        os.utime(path)
+        self.hits += 1
+        return data
+
+    def put(self, key, output_format, data):
+        path = self._path(key, output_format)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.total_bytes += len(data)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """删除最久未使用的图片，直到总大小降到上限的90%"""
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.cache_dir) if entry.is_file()
+        )
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.total_bytes -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_mb": round(self.total_bytes / 1024 / 1024, 2),
+        }
+
+
+diagram_cache = DiagramCache(
+    os.path.join(PROJECT_PATH or ".", "cache", "uml"),
+    UML_CACHE_MAX_MB * 1024 * 1024,
+)
+
+# 复用连接的PlantUML客户端，在第一次渲染时创建
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=30,
+            limits=httpx.Limits(
+                max_connections=PLANTUML_MAX_CONNECTIONS,
+                max_keepalive_connections=PLANTUML_MAX_CONNECTIONS,
+            ),
+        )
+    return _http_client
+
+
+class LocalPlantUMLRenderer:
+    """
+    本地PlantUML渲染器
+
+    以 -pipe 模式常驻若干个 plantuml.jar 进程，通过标准输入写入代码，
+    从标准输出读取图片，每张图片之后跟一个分隔符。省去HTTP往返，也不依赖PlantUML服务；
+    JVM只在启动时预热一次。同一进程一次只渲染一张图，并发由进程数决定。
+    """
+
+    DELIMITER = b"___UML_MCP_DIAGRAM_END___"
+    WARMUP_CODE = "@startuml\nA -> B\n@enduml"
+
+    def __init__(self, jar, java="java", workers=2, timeout=60):
+        self.jar = jar
+        self.java = java
+        self.workers = workers
+        self.timeout = timeout
+        # 输出格式 -> 空闲进程，以及限制同时渲染数量的信号量（每个额度对应一个进程）
+        self._idle: Dict[str, List] = {}
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        # 输出格式 -> 存活的进程数量（空闲的和正在渲染的）
+        self._alive: Dict[str, int] = {}
+        self._warmed = set()
+        self._closing = False
+
+    async def _spawn(self, output_format):
+        if not self.jar or not os.path.exists(self.jar):
+            raise FileNotFoundError(f"未找到plantuml.jar: {self.jar or '未配置PLANTUML_JAR'}")
+        process = await asyncio.create_subprocess_exec(
+            self.java, "-Djava.awt.headless=true", "-jar", self.jar,
+            "-pipe", f"-t{output_format}", "-charset", "UTF-8",
+            "-pipedelimitor", self.DELIMITER.decode(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=64 * 1024 * 1024,
+        )
+        self._alive[output_format] = self._alive.get(output_format, 0) + 1
+        logger.info(f"已启动本地PlantUML进程({output_format}): pid={process.pid}")
+        return process
+
+    async def _acquire(self, output_format, fresh=False):
+        """
+        占用一个渲染额度，取一个空闲进程，没有可用进程时启动新进程
+
+        Args:
+            fresh: 为True时总是启动新进程（用于补充被丢弃的进程），进程数已满时返回None
+        """
+        slots = self._slots.setdefault(output_format, asyncio.Semaphore(self.workers))
+        idle = self._idle.setdefault(output_format, [])
+        await slots.acquire()
+        try:
+            while idle and not fresh:
+                process = idle.pop()
+                if process.returncode is None:
+                    return process
+                self._alive[output_format] -= 1
+            if fresh and self._alive.get(output_format, 0) >= self.workers:
+                slots.release()
+                return None
+            return await self._spawn(output_format)
+        except BaseException:
+            slots.release()
+            raise
+
+    def _release(self, output_format, process):
+        self._idle[output_format].append(process)
+        self._slots[output_format].release()
+
+    def _discard(self, output_format, process):
+        """丢弃出错的进程并归还额度（等待中的请求会启动新进程），同时在后台补充一个预热好的进程"""
+        if process.returncode is None:
+            process.kill()
+        self._alive[output_format] -= 1
+        self._slots[output_format].release()
+        if not self._closing:
+            asyncio.get_running_loop().create_task(self._replenish(output_format))
+
+    async def _replenish(self, output_format):
+        try:
+            process = await self._acquire(output_format, fresh=True)
+            if process is not None:
+                await self._run(output_format, process, self.WARMUP_CODE)
+        except Exception as e:
+            logger.warning(f"补充本地PlantUML进程({output_format})失败: {e}")
+
+    async def render(self, uml_code, output_format="png"):
+        """
+        渲染一张UML图
+
+        Returns:
+            bytes: 图片内容
+        """
+        process = await self._acquire(output_format)
+        return await self._run(output_format, process, uml_code)
+
+    async def _run(self, output_format, process, uml_code):
+        """在已占用的进程上渲染一张图，完成后归还进程"""
+        try:
+            process.stdin.write(uml_code.encode("utf-8") + b"\n")
+            await process.stdin.drain()
+            output = await asyncio.wait_for(process.stdout.readuntil(self.DELIMITER), timeout=self.timeout)
+            # 分隔符之后还有一个换行
+            await asyncio.wait_for(process.stdout.readline(), timeout=self.timeout)
+        except BaseException:
+            # 超时、进程退出或请求被取消后，输出流的位置不再可靠，丢弃该进程
+            self._discard(output_format, process)
+            raise
+        self._release(output_format, process)
+
+        image = output[:-len(self.DELIMITER)]
+        if not image:
+            raise ValueError("本地PlantUML未输出图像")
+        return image
+
+    async def warmup(self, output_format="png"):
+        """预先启动进程并渲染一张小图，使JVM完成类加载和JIT预热"""
+        await self.render(self.WARMUP_CODE, output_format)
+
+    async def start(self, formats):
+        """为每种格式同时预热 workers 个进程（重复调用时跳过已预热的格式）"""
+        pending = [output_format for output_format in formats if output_format not in self._warmed]
+        self._warmed.update(pending)
+        results = await asyncio.gather(
+            *(self.warmup(output_format) for output_format in pending for _ in range(self.workers)),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            logger.warning(f"本地PlantUML进程预热失败: {errors[0]}")
+        elif pending:
+            logger.info(f"本地PlantUML进程已预热: {', '.join(pending)} × {self.workers}")
+
+    async def close(self):
+        self._closing = True
+        for output_format, idle in self._idle.items():
+            while idle:
+                process = idle.pop()
+                self._alive[output_format] -= 1
+                if process.returncode is None:
+                    process.kill()
+
+
+local_renderer = LocalPlantUMLRenderer(PLANTUML_JAR, PLANTUML_JAVA, PLANTUML_LOCAL_WORKERS)
+
+
+async def render_via_server(encoded, output_format="png"):
+    """通过PlantUML服务渲染"""
+    url = f"http://{PLANTUML_HOST}:{PLANTUML_PORT}/{output_format}/{encoded}"
+    logger.info(f"使用PlantUML服务: {PLANTUML_HOST}:{PLANTUML_PORT}")
+    response = await get_http_client().get(url)
+
+    # 检查响应状态码
+    if response.status_code != 200:
+        logger.error(f"PlantUML服务返回错误: {response.status_code}")
+        raise httpx.HTTPError(f"PlantUML服务错误: {response.status_code}")
+
+    # 检查响应内容是否为图像
+    content_type = response.headers.get('Content-Type', '')
+    if 'image' not in content_type:
+        logger.error(f"响应不是图像，Content-Type: {content_type}")
+        raise ValueError("未收到有效的图像")
+
+    return response.content
+
+
+async def render_uml(uml_code, encoded, output_format="png"):
+    """
+    渲染UML图，相同的代码直接使用缓存，不请求PlantUML服务
+
+    Returns:
+        bytes: 图片内容
+    """
+    key = DiagramCache.make_key(uml_code, output_format)
+    data = diagram_cache.get(key, output_format)
+    if data is not None:
+        logger.info(f"命中UML图缓存: {key[:12]}")
+        return data
+
+    if UML_RENDER_BACKEND == "local":
+        try:
+            data = await local_renderer.render(uml_code, output_format)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            # 本地进程不可用时退回PlantUML服务
+            logger.error(f"本地PlantUML渲染失败，改用PlantUML服务: {e}")
+            data = await render_via_server(encoded, output_format)
+    else:
+        data = await render_via_server(encoded, output_format)
+
+    diagram_cache.put(key, output_format, data)
+    return data
+
+
+async def generate_uml_image(uml_code, diagram_type=None, output_dir=None, output_format="png"):
     """
     生成UML图片并返回代码、URL和本地路径
 
@@ -251,6 +765,7 @@ def generate_uml_image(uml_code, diagram_type=None, output_dir=None):
         uml_code: PlantUML代码
         diagram_type: 可选的UML图类型，用于文件命名
         output_dir: 输出目录路径，必须显式提供
+        output_format: 图片格式，png 或 svg
     
     Returns:
         dict: 包含以下键值对:
@@ -258,6 +773,7 @@ def generate_uml_image(uml_code, diagram_type=None, output_dir=None):
             - url: 可访问的PlantUML URL
             - encoded: 编码后的字符串
             - local_path: 本地保存的文件路径
+            - static_path: static目录下按内容哈希命名的文件路径（相对static目录），内容不变则路径不变
     """
 
     # 检查输出目录是否提供
@@ -266,6 +782,24 @@ def generate_uml_image(uml_code, diagram_type=None, output_dir=None):
         logger.error(error_msg)
         raise ValueError(error_msg)
     
+    if output_format not in OUTPUT_FORMATS:
+        error_msg = f"不支持的图片格式: {output_format}。支持的格式: {', '.join(OUTPUT_FORMATS)}"
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+    
+    # 渲染之前先检查语法，有错误时直接返回带行号的错误，不请求渲染
+    syntax_errors = check_uml_syntax(uml_code, diagram_type)
+    if syntax_errors:
+        return {
+            "code": uml_code,
+            "url": None,
+            "encoded": None,
+            "local_path": None,
+            "static_path": None,
+            "error": "PlantUML语法错误，请根据 syntax_errors 中的行号修正代码后重试",
+            "syntax_errors": syntax_errors
+        }
+    
     logger.info(f"生成UML图: {diagram_type if diagram_type else 'unknown'}")
     
     try:
@@ -273,47 +807,36 @@ def generate_uml_image(uml_code, diagram_type=None, output_dir=None):
         encoded = plantuml_encode(uml_code)
         
         # 构建URL，使用环境变量中配置的域名和端口
-        url = f"http://{PLANTUML_HOST}:{PLANTUML_PORT}/png/{encoded}"
-        logger.info(f"使用PlantUML服务: {PLANTUML_HOST}:{PLANTUML_PORT}")
+        url = f"http://{PLANTUML_HOST}:{PLANTUML_PORT}/{output_format}/{encoded}"
         
         # 确保输出目录存在
         os.makedirs(output_dir, exist_ok=True)
 
-        # 生成文件名
-        if diagram_type:
-            filename = f"{diagram_type}_{encoded[:10]}"
-            static_dir = os.path.join(PROJECT_PATH, "static", f"{diagram_type}")
-        else:
-            filename = f"uml_{encoded[:10]}"
-            static_dir = os.path.join(PROJECT_PATH, "static", "uml")
+        static_subdir = diagram_type or "uml"
+        static_dir = os.path.join(PROJECT_PATH, "static", static_subdir)
 
         os.makedirs(static_dir, exist_ok=True)
         
-        # 构建完整的文件路径
-        file_path = os.path.join(output_dir, f"{filename}.png")
-        static_file_path = os.path.join(static_dir, "uml.png")
-        
-        # 发送请求获取图片
-        response = requests.get(url, timeout=30)
-        
-        # 检查响应状态码
-        if response.status_code != 200:
-            logger.error(f"PlantUML服务返回错误: {response.status_code}")
-            raise requests.RequestException(f"PlantUML服务错误: {response.status_code}")
+        # 构建完整的文件路径；两份文件都按内容哈希命名，不同的图互不覆盖，静态文件浏览器可以长期缓存
+        # （编码结果的前几个字符对所有图几乎相同，不能用来命名）
+        content_key = DiagramCache.make_key(uml_code, output_format)
+        file_path = os.path.join(output_dir, f"{static_subdir}_{content_key[:STATIC_HASH_LENGTH]}.{output_format}")
+        static_name = f"{content_key[:STATIC_HASH_LENGTH]}.{output_format}"
+        static_file_path = os.path.join(static_dir, static_name)
         
-        # 检查响应内容是否为图像
-        content_type = response.headers.get('Content-Type', '')
-        if 'image' not in content_type:
-            logger.error(f"响应不是图像，Content-Type: {content_type}")
-            raise ValueError("未收到有效的图像")
+        # 获取图片（优先使用缓存）
+        image = await render_uml(uml_code, encoded, output_format)
         
         # 保存到文件
         with open(file_path, 'wb') as f:
-            f.write(response.content)
+            f.write(image)
         
-        # 保存到静态目录
-        with open(static_file_path, 'wb') as f:
-            f.write(response.content)
+        # 保存到静态目录（相同内容的文件已存在时无需重复写入）
+        if not os.path.exists(static_file_path):
+            tmp_path = f"{static_file_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(image)
+            os.replace(tmp_path, static_file_path)
         
         logger.info(f"UML图生成成功: {diagram_type}")
         
@@ -322,7 +845,8 @@ def generate_uml_image(uml_code, diagram_type=None, output_dir=None):
             "code": uml_code,
             "url": url,
             "encoded": encoded,
-            "local_path": file_path
+            "local_path": file_path,
+            "static_path": f"{static_subdir}/{static_name}"
         }
     
     except Exception as e:
@@ -334,11 +858,12 @@ def generate_uml_image(uml_code, diagram_type=None, output_dir=None):
             "url": url if 'url' in locals() else None,
             "encoded": encoded if 'encoded' in locals() else None,
             "local_path": None,
+            "static_path": None,
             "error": str(e)
         }
 
 @mcp.tool()
-def generate_uml(diagram_type: str, code: str, output_dir: str) -> str:
+async def generate_uml(diagram_type: str, code: str, output_dir: str) -> str:
     """生成UML图并返回代码、URL和本地路径。
 
     Args:
@@ -363,19 +888,16 @@ def generate_uml(diagram_type: str, code: str, output_dir: str) -> str:
         raise ValueError(error_msg)
     
     # 确保代码包含 @startuml 和 @enduml
-    if "@startuml" not in code:
-        code = f"@startuml\n{code}"
-    if "@enduml" not in code:
-        code = f"{code}\n@enduml"
+    code = wrap_uml_code(code)
     
     # 生成URL、代码和本地路径
-    result = generate_uml_image(code, diagram_type, output_dir)
+    result = await generate_uml_image(code, diagram_type, output_dir)
     
     # 返回JSON字符串
     return json.dumps(result, ensure_ascii=False, indent=2)
 
 @mcp.tool()
-def generate_class_diagram(code: str, output_dir: str) -> str:
+async def generate_class_diagram(code: str, output_dir: str) -> str:
     """生成类图并返回代码和URL。
 
     Args:
@@ -385,10 +907,10 @@ def generate_class_diagram(code: str, output_dir: str) -> str:
     Returns:
         包含PlantUML代码和URL的JSON字符串
     """
-    return generate_uml("class", code, output_dir)
+    return await generate_uml("class", code, output_dir)
 
 @mcp.tool()
-def generate_sequence_diagram(code: str, output_dir: str) -> str:
+async def generate_sequence_diagram(code: str, output_dir: str) -> str:
     """生成序列图并返回代码和URL。
 
     Args:
@@ -398,10 +920,10 @@ def generate_sequence_diagram(code: str, output_dir: str) -> str:
     Returns:
         包含PlantUML代码和URL的JSON字符串
     """
-    return generate_uml("sequence", code, output_dir)
+    return await generate_uml("sequence", code, output_dir)
 
 @mcp.tool()
-def generate_activity_diagram(code: str, output_dir: str) -> str:
+async def generate_activity_diagram(code: str, output_dir: str) -> str:
     """生成活动图并返回代码和URL。
 
     Args:
@@ -411,10 +933,10 @@ def generate_activity_diagram(code: str, output_dir: str) -> str:
     Returns:
         包含PlantUML代码和URL的JSON字符串
     """
-    return generate_uml("activity", code, output_dir)
+    return await generate_uml("activity", code, output_dir)
 
 @mcp.tool()
-def generate_usecase_diagram(code: str, output_dir: str) -> str:
+async def generate_usecase_diagram(code: str, output_dir: str) -> str:
     """生成用例图并返回代码和URL。
 
     Args:
@@ -424,10 +946,10 @@ def generate_usecase_diagram(code: str, output_dir: str) -> str:
     Returns:
         包含PlantUML代码和URL的JSON字符串
     """
-    return generate_uml("usecase", code, output_dir)
+    return await generate_uml("usecase", code, output_dir)
 
 @mcp.tool()
-def generate_state_diagram(code: str, output_dir: str) -> str:
+async def generate_state_diagram(code: str, output_dir: str) -> str:
     """生成状态图并返回代码和URL。
 
     Args:
@@ -437,10 +959,10 @@ def generate_state_diagram(code: str, output_dir: str) -> str:
     Returns:
         包含PlantUML代码和URL的JSON字符串
     """
-    return generate_uml("state", code, output_dir)
+    return await generate_uml("state", code, output_dir)
 
 @mcp.tool()
-def generate_component_diagram(code: str, output_dir: str) -> str:
+async def generate_component_diagram(code: str, output_dir: str) -> str:
     """生成组件图并返回代码和URL。
 
     Args:
@@ -450,10 +972,10 @@ def generate_component_diagram(code: str, output_dir: str) -> str:
     Returns:
         包含PlantUML代码和URL的JSON字符串
     """
-    return generate_uml("component", code, output_dir)
+    return await generate_uml("component", code, output_dir)
 
 @mcp.tool()
-def generate_deployment_diagram(code: str, output_dir: str) -> str:
+async def generate_deployment_diagram(code: str, output_dir: str) -> str:
     """生成部署图并返回代码和URL。
 
     Args:
@@ -463,10 +985,10 @@ def generate_deployment_diagram(code: str, output_dir: str) -> str:
     Returns:
         包含PlantUML代码和URL的JSON字符串
     """
-    return generate_uml("deployment", code, output_dir)
+    return await generate_uml("deployment", code, output_dir)
 
 @mcp.tool()
-def generate_object_diagram(code: str, output_dir: str) -> str:
+async def generate_object_diagram(code: str, output_dir: str) -> str:
     """生成对象图并返回代码和URL。
 
     Args:
@@ -476,10 +998,10 @@ def generate_object_diagram(code: str, output_dir: str) -> str:
     Returns:
         包含PlantUML代码和URL的JSON字符串
     """
-    return generate_uml("object", code, output_dir)
+    return await generate_uml("object", code, output_dir)
 
 @mcp.tool()
-def generate_uml_from_code(code: str, output_dir: str) -> str:
+async def generate_uml_from_code(code: str, output_dir: str) -> str:
     """从PlantUML代码生成UML图并返回代码和URL。
     自动检测图表类型。
 
@@ -491,16 +1013,67 @@ def generate_uml_from_code(code: str, output_dir: str) -> str:
         包含PlantUML代码和URL的JSON字符串
     """
     # 确保代码包含 @startuml 和 @enduml
-    if "@startuml" not in code:
-        code = f"@startuml\n{code}"
-    if "@enduml" not in code:
-        code = f"{code}\n@enduml"
+    code = wrap_uml_code(code)
     
     # 生成URL、代码和本地路径
-    result = generate_uml_image(code, None, output_dir)
+    result = await generate_uml_image(code, None, output_dir)
     
     return json.dumps(result, ensure_ascii=False, indent=2)
 
+@mcp.tool()
+async def generate_uml_batch(diagrams: List[Dict[str, str]], output_dir: str, output_format: str = "png") -> str:
+    """一次生成多张UML图（并发渲染），返回所有图片的代码、URL和本地路径。
+    同一需求需要多张图（如同一系统的类图和序列图）时，优先使用此工具一次完成。
+
+    Args:
+        diagrams: 图列表，每项为 {"diagram_type": UML图类型, "code": 完整的PlantUML代码}
+        output_dir: 输出目录路径，必须显式提供
+        output_format: 图片格式，png 或 svg（svg体积更小、可缩放），默认png
+
+    Returns:
+        包含每张图结果（顺序与输入一致）的JSON字符串: {"results": [...]}
+    """
+    # 检查输出目录是否提供
+    if not output_dir:
+        error_msg = "必须提供输出目录（output_dir）"
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+
+    output_format = output_format.lower()
+    if output_format not in OUTPUT_FORMATS:
+        error_msg = f"不支持的图片格式: {output_format}。支持的格式: {', '.join(OUTPUT_FORMATS)}"
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+
+    if not diagrams:
+        raise ValueError("diagrams 不能为空")
+    if len(diagrams) > UML_BATCH_MAX:
+        raise ValueError(f"一次最多生成{UML_BATCH_MAX}张图")
+
+    semaphore = asyncio.Semaphore(PLANTUML_MAX_CONNECTIONS)
+
+    async def generate_one(item):
+        diagram_type = str(item.get("diagram_type") or item.get("type") or "").lower()
+        code = item.get("code") or ""
+        # 单张图的参数错误只影响这一张
+        if diagram_type not in UML_TYPES:
+            return {
+                "diagram_type": diagram_type,
+                "static_path": None,
+                "error": f"不支持的UML图类型: {diagram_type}。支持的类型: {', '.join(UML_TYPES)}"
+            }
+        if not code.strip():
+            return {"diagram_type": diagram_type, "static_path": None, "error": "缺少PlantUML代码"}
+
+        async with semaphore:
+            result = await generate_uml_image(wrap_uml_code(code), diagram_type, output_dir, output_format)
+        return {"diagram_type": diagram_type, **result}
+
+    results = await asyncio.gather(*(generate_one(item) for item in diagrams))
+    logger.info(f"批量生成UML图完成: {sum(1 for r in results if not r.get('error'))}/{len(results)} 成功")
+
+    return json.dumps({"results": results}, ensure_ascii=False, indent=2)
+
 @mcp.resource("uml://types")
 def get_uml_types() -> str:
     """获取支持的UML图类型列表。
@@ -510,6 +1083,7 @@ def get_uml_types() -> str:
     """
     return json.dumps({
         "types": UML_TYPES,
+        "formats": OUTPUT_FORMATS,
         "descriptions": {
             "class": "展示系统中的类、属性、方法以及它们之间的关系",
             "sequence": "展示对象之间的交互，按时间顺序排列",
@@ -522,6 +1096,26 @@ def get_uml_types() -> str:
         }
     })
 
+@mcp.resource("uml://cache_stats")
+def get_cache_stats() -> str:
+    """获取UML图缓存的命中统计。
+
+    Returns:
+        缓存统计的JSON字符串
+    """
+    return json.dumps(diagram_cache.stats())
+
+@mcp.resource("uml://validation_stats")
+def get_validation_stats() -> str:
+    """获取PlantUML语法预检查的统计。
+
+    rejected 为因语法错误而跳过的渲染次数，fixed_on_next_attempt 为被拒绝后下一次提交即修正的次数。
+
+    Returns:
+        语法检查统计的JSON字符串
+    """
+    return json.dumps(validation_stats)
+
 @mcp.prompt()
 def create_class_diagram() -> str:
     """创建类图的提示模板。"""
@@ -563,11 +1157,27 @@ def create_sequence_diagram() -> str:
 - 展示从用户发起登录请求到登录成功的完整流程
 """
 
+async def on_startup():
+    """服务器启动时调用：本地渲染方式下为每种输出格式预热常驻的PlantUML进程"""
+    if UML_RENDER_BACKEND == "local":
+        await local_renderer.start(OUTPUT_FORMATS)
+
+
+async def main():
+    # 预热在后台进行，不阻塞MCP握手
+    startup = asyncio.create_task(on_startup())
+    try:
+        await mcp.run_stdio_async()
+    finally:
+        startup.cancel()
+        await local_renderer.close()
+
+
 if __name__ == "__main__":
     # 初始化并运行服务器
     logger.info("启动UML-MCP服务器")
     try:
-        mcp.run(transport='stdio')
+        asyncio.run(main())
     except Exception as e:
         logger.critical(f"服务器运行出错: {str(e)}", exc_info=True)
     finally:
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 每次从上传流读取的块大小（字节）
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# 单个文件和单次请求的大小上限（MB）
+UPLOAD_MAX_FILE_SIZE_MB = float(os.getenv("UPLOAD_MAX_FILE_SIZE_MB", "50"))
+UPLOAD_MAX_REQUEST_SIZE_MB = float(os.getenv("UPLOAD_MAX_REQUEST_SIZE_MB", "200"))
+
+# 清单文件以 . 开头，SimpleDirectoryReader 默认会忽略隐藏文件，不会被当作知识库文档索引
+MANIFEST_FILENAME = ".index_manifest.json"
+
+
+class UploadLimitExceeded(Exception):
+    """上传文件超过大小限制"""
+
+    def __init__(self, message: str, filename: str = None):
+        super().__init__(message)
+        self.filename = filename
+
+
+class IndexManifest:
+    """
+    知识库文件清单
+
+    记录知识库目录中每个文件的内容哈希，用于上传去重，
+    也为增量索引提供"哪些文件是新增的"依据
+    """
+
+    def __init__(self, kb_dir: str):
+        """
+        初始化文件清单
+
+        Args:
+            kb_dir: 知识库目录
+        """
+        self.kb_dir = kb_dir
+        self.manifest_path = os.path.join(kb_dir, MANIFEST_FILENAME)
+        self.files: Dict[str, Dict] = {}
+        self._load()
+
+    def _load(self) -> None:
+        """加载清单，并为清单之外已存在的文件补算哈希"""
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    self.files = json.load(f).get("files", {})
+            except (json.JSONDecodeError, OSError):
+                self.files = {}
+
+        # 丢弃已被删除的文件记录
+        self.files = {
+            digest: info for digest, info in self.files.items()
+            if os.path.exists(os.path.join(self.kb_dir, info["filename"]))
+        }
+
+        # 兼容清单功能上线前就存在的文件
+        known = {info["filename"] for info in self.files.values()}
+        if os.path.isdir(self.kb_dir):
+            for filename in os.listdir(self.kb_dir):
+                path = os.path.join(self.kb_dir, filename)
+                if filename.startswith(".") or filename in known or not os.path.isfile(path):
+                    continue
+                digest = hash_file(path)
+                self.files.setdefault(digest, {
+                    "filename": filename,
+                    "size": os.path.getsize(path),
+                    "uploaded_at": datetime.fromtimestamp(os.path.getmtime(path)).isoformat(),
+                })
+
+    def get(self, digest: str) -> Optional[Dict]:
+        """根据内容哈希查找已存在的文件"""
+        return self.files.get(digest)
+
+    def add(self, digest: str, filename: str, size: int) -> None:
+        """登记新文件"""
+        self.files[digest] = {
+            "filename": filename,
+            "size": size,
+            "uploaded_at": datetime.now().isoformat(),
+        }
+
+    def save(self) -> None:
+        """保存清单"""
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False, indent=2)
+
+
+def hash_file(path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    """分块计算文件的 sha256"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _unique_dest_path(kb_dir: str, filename: str) -> str:
+    """目标文件名已被占用时，为其添加时间戳"""
+    dest_path = os.path.join(kb_dir, filename)
+    if not os.path.exists(dest_path):
+        return dest_path
+
+    file_name, file_ext = os.path.splitext(filename)
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    new_filename = f"{file_name}_{timestamp}{file_ext}"
+    print(f"文件已存在，重命名为: {new_filename}")
+    return os.path.join(kb_dir, new_filename)
+
+
+async def save_uploads(
+    files: List,
+    kb_dir: str,
+    max_file_size: int = int(UPLOAD_MAX_FILE_SIZE_MB * 1024 * 1024),
+    max_request_size: int = int(UPLOAD_MAX_REQUEST_SIZE_MB * 1024 * 1024),
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> Dict:
+    """
+    以流式方式保存上传文件
+
+    每个文件按固定大小分块写入临时文件，同时增量计算哈希，
+    内容与知识库中已有文件（或本次请求中更早的文件）相同的会被丢弃。
+    任一文件超出限制时，本次请求已写入的文件全部回滚。
+    清单不在这里写盘：调用方在索引建好后调用 manifest.save()，
+    索引失败时调用 discard_uploads 删除新文件，避免清单记录了未索引的文件。
+
+    Args:
+        files: UploadFile 列表
+        kb_dir: 知识库目录
+        max_file_size: 单个文件大小上限（字节）
+        max_request_size: 单次请求所有文件大小之和的上限（字节）
+        chunk_size: 分块大小（字节）
+
+    Returns:
+        Dict: {"saved": [文件路径, ...], "duplicates": [{"filename", "existing"}, ...], "manifest": IndexManifest}
+
+    Raises:
+        UploadLimitExceeded: 文件或请求超出大小限制
+    """
+    manifest = IndexManifest(kb_dir)
+    saved: List[str] = []
+    duplicates: List[Dict] = []
+    request_total = 0
+
+    try:
+        for file in files:
+            filename = os.path.basename(file.filename or "")
+            if not filename:
+                continue
+            print(f"处理文件: {filename}")
+
+            tmp_path = os.path.join(kb_dir, f".upload_{uuid.uuid4().hex}.part")
+            sha = hashlib.sha256()
+            size = 0
+            start = time.time()
+            try:
+                with open(tmp_path, "wb") as buffer:
+                    while True:
+                        chunk = await file.read(chunk_size)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        request_total += len(chunk)
+                        if size > max_file_size:
+                            raise UploadLimitExceeded(
+                                f"文件 {filename} 超过单个文件大小上限 {max_file_size / (1024 * 1024):g}MB",
+                                filename,
+                            )
+                        if request_total > max_request_size:
+                            raise UploadLimitExceeded(
+                                f"本次上传文件总大小超过上限 {max_request_size / (1024 * 1024):g}MB",
+                                filename,
+                            )
+                        sha.update(chunk)
+                        buffer.write(chunk)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            finally:
+                await file.close()
+
+            digest = sha.hexdigest()
+            existing = manifest.get(digest)
+            if existing:
+                os.remove(tmp_path)
+                duplicates.append({"filename": filename, "existing": existing["filename"]})
+                print(f"文件内容与 {existing['filename']} 相同，跳过: {filename}")
+                continue
+
+            dest_path = _unique_dest_path(kb_dir, filename)
+            os.replace(tmp_path, dest_path)
+            manifest.add(digest, os.path.basename(dest_path), size)
+            saved.append(dest_path)
+            print(f"已保存文件到: {dest_path} ({size} 字节, {time.time() - start:.2f}s)")
+    except BaseException:
+        # 回滚本次请求已保存的文件，清单保持不变
+        for path in saved:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    return {"saved": saved, "duplicates": duplicates, "manifest": manifest}
+
+
+def discard_uploads(paths: List[str]) -> None:
+    """删除未能建立索引的新文件（清单未写盘，重试时不会被当作重复文件）"""
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
@@ -66,19 +66,28 @@ class VectorStore:
         return os.listdir(self.index_path)
     
     
-    def create_index(self, file_path: str, label: str):
+    def create_index(self, file_path: str, label: str, files: list = None):
 
 
         # 确认路径存在
         if not os.path.exists(file_path):
             raise ValueError(f"文件路径不存在: {file_path}")
 
+        db_path = os.path.join(self.index_path, label)
+        # 索引已存在时只为新增文件计算向量，不重新索引整个目录
+        if files and os.path.exists(db_path):
+            index = self.load_index(label)
+            for document in SimpleDirectoryReader(input_files=files).load_data():
+                index.insert(document)
+            index.storage_context.persist(db_path)
+            print(f"向量数据库已添加 {len(files)} 个文件: {label}")
+            return
+
         reader = SimpleDirectoryReader(file_path)
         index = VectorStoreIndex.from_documents(
             documents=reader.load_data(),
             embedding=self.embedding_model,
         )
-        db_path = os.path.join(self.index_path, label)
         index.storage_context.persist(db_path)
         print(f"向量数据库创建成功: {label}")
 
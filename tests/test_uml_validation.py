@@ -0,0 +1,128 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "utils"))
+
+from uml_mcp_server import validate_uml
+
+
+def messages(code, diagram_type=None):
+    return [error["message"] for error in validate_uml(code, diagram_type)]
+
+
+def test_floating_note_with_text_is_single_line():
+    code = """@startuml
+class User
+note "用户实体" as N1
+N1 .. User
+@enduml"""
+    assert validate_uml(code, "class") == []
+
+
+def test_floating_note_with_alias_only_is_multi_line():
+    code = """@startuml
+class User
+note as N1
+  用户实体 {可以包含任意字符
+end note
+N1 .. User
+@enduml"""
+    assert validate_uml(code, "class") == []
+
+
+def test_single_line_header_and_footer():
+    code = """@startuml
+header Page header
+footer Page %page% of %lastpage%
+left header 左侧页眉
+class User
+@enduml"""
+    assert validate_uml(code, "class") == []
+
+
+def test_multi_line_header_and_legend():
+    code = """@startuml
+center header
+  多行 "页眉
+endheader
+legend right
+  图例 {
+endlegend
+class User
+@enduml"""
+    assert validate_uml(code, "class") == []
+
+
+def test_unclosed_multi_line_note_is_reported():
+    code = """@startuml
+class User
+note left of User
+  没有结束标记
+@enduml"""
+    assert any("end note" in message for message in messages(code, "class"))
+
+
+def test_activity_happy_path():
+    code = """@startuml
+start
+:登录;
+if (密码正确?) then (是)
+  :进入首页;
+else (否)
+  :提示错误;
+endif
+fork
+  :记录日志;
+fork again
+  :发送通知;
+end fork
+while (还有任务?)
+  :处理任务;
+endwhile
+repeat
+  :重试;
+repeat while (失败?)
+stop
+@enduml"""
+    assert validate_uml(code, "activity") == []
+
+
+def test_activity_unclosed_if_is_reported():
+    code = """@startuml
+start
+if (条件) then (是)
+  :处理;
+stop
+@enduml"""
+    assert any("endif" in message for message in messages(code, "activity"))
+
+
+def test_sequence_happy_path():
+    code = """@startuml
+participant 用户
+participant 服务器
+用户 -> 服务器: 登录请求 {用户名, 密码}
+activate 服务器
+alt 验证成功
+  服务器 --> 用户: 登录成功
+else 验证失败
+  服务器 --> 用户: 登录失败
+end
+loop 每30秒
+  用户 -> 服务器: 心跳
+end
+note over 用户, 服务器
+  会话保持
+end note
+ref over 用户, 服务器 : 注销流程
+deactivate 服务器
+@enduml"""
+    assert validate_uml(code, "sequence") == []
+
+
+def test_sequence_foreign_keyword_is_reported():
+    code = """@startuml
+class User
+A -> B: hello
+@enduml"""
+    assert any("class" in message for message in messages(code, "sequence"))